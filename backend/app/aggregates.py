@@ -0,0 +1,212 @@
+import math
+import heapq
+import operator
+import numpy as np
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+from table_columns import group_positions
+
+# Columns whose totals are kept, and the column whose largest value is tracked
+SUM_COLUMNS = ['pnl', 'margin', 'max_risk']
+MAX_COLUMN = 'max_risk'
+
+
+class Totals:
+    """Running totals for one group of rows.
+
+    Sums are adjusted by each added or removed row, with Neumaier
+    compensation so that long runs of edits do not drift.  The largest
+    ``max_risk`` comes from a max-heap of ``(-value, row id)``; entries
+    whose row has since been removed or changed are skipped lazily when
+    they reach the top, and the heap is rebuilt once they pile up.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._sums = {column: 0.0 for column in SUM_COLUMNS}
+        self._errors = {column: 0.0 for column in SUM_COLUMNS}  # compensation terms
+        self._values: Dict[int, float] = {}  # row id -> current max_risk
+        self._heap: List[Tuple[float, int]] = []
+
+    def add(self, row: Dict[str, Any]):
+        self.count += 1
+        for column in SUM_COLUMNS:
+            self._add(column, row[column])
+        self._values[row['id']] = row[MAX_COLUMN]
+        if len(self._heap) > 2 * self.count + 64:
+            self._heap = [(-value, row_id) for row_id, value in self._values.items()]
+            heapq.heapify(self._heap)
+        else:
+            heapq.heappush(self._heap, (-row[MAX_COLUMN], row['id']))
+
+    def add_many(self, columns: Dict[str, Sequence]):
+        """``add`` for rows given as columns; each sum moves by the batch's exact total."""
+        self.count += len(columns['id'])
+        for column in SUM_COLUMNS:
+            self._add(column, math.fsum(columns[column].tolist()))
+        self._push_many(columns['id'].tolist(), columns[MAX_COLUMN].tolist())
+
+    def replace_many(self, old: Dict[str, Sequence], new: Dict[str, Sequence]):
+        """``remove`` then ``add`` for rows given as columns, ``old`` and ``new`` holding the same ids in order.
+
+        Only the values that changed move the sums and the heap.
+        """
+        for column in SUM_COLUMNS:
+            changed = old[column] != new[column]
+            if changed.any():
+                self._add(column, math.fsum(new[column][changed].tolist() + (-old[column][changed]).tolist()))
+        changed = old[MAX_COLUMN] != new[MAX_COLUMN]
+        if changed.any():
+            self._push_many(new['id'][changed].tolist(), new[MAX_COLUMN][changed].tolist())
+
+    def _push_many(self, ids: List[int], values: List[float]):
+        self._values.update(zip(ids, values))
+        if len(ids) < 64:
+            for row_id, value in zip(ids, values):
+                heapq.heappush(self._heap, (-value, row_id))
+            return
+        if len(self._heap) + len(ids) > 2 * self.count + 64:
+            self._heap = [(-value, row_id) for row_id, value in self._values.items()]
+        else:
+            self._heap.extend(zip([-value for value in values], ids))
+        heapq.heapify(self._heap)
+
+    def remove(self, row: Dict[str, Any]):
+        self.count -= 1
+        del self._values[row['id']]
+        if self.count == 0:
+            self._reset()
+            return
+        for column in SUM_COLUMNS:
+            self._add(column, -row[column])
+
+    def remove_many(self, columns: Dict[str, Sequence]):
+        """``remove`` for rows given as columns, as they were added."""
+        ids = columns['id'].tolist()
+        self.count -= len(ids)
+        for row_id in ids:
+            del self._values[row_id]
+        if self.count == 0:
+            self._reset()
+            return
+        for column in SUM_COLUMNS:
+            self._add(column, -math.fsum(columns[column].tolist()))
+
+    def _reset(self):
+        # Start again from exact zeros rather than accumulated rounding error
+        self._sums = {column: 0.0 for column in SUM_COLUMNS}
+        self._errors = {column: 0.0 for column in SUM_COLUMNS}
+        self._heap = []
+
+    def _add(self, column: str, value: float):
+        total = self._sums[column]
+        result = total + value
+        if abs(total) >= abs(value):
+            self._errors[column] += (total - result) + value
+        else:
+            self._errors[column] += (value - result) + total
+        self._sums[column] = result
+
+    def sum(self, column: str) -> float:
+        return self._sums[column] + self._errors[column]
+
+    def largest(self) -> Optional[Tuple[float, int]]:
+        """``(max_risk, row id)`` of the row with the highest max_risk."""
+        while self._heap:
+            value, row_id = self._heap[0]
+            if self._values.get(row_id) == -value:
+                return -value, row_id
+            heapq.heappop(self._heap)
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        largest = self.largest()
+        return {
+            'rows': self.count,
+            'total_pnl': self.sum('pnl'),
+            'total_margin': self.sum('margin'),
+            'total_max_risk': self.sum('max_risk'),
+            'worst_max_risk': largest[0] if largest else None,
+            'worst_max_risk_id': largest[1] if largest else None,
+        }
+
+
+def _select(columns: Dict[str, Sequence], positions) -> Dict[str, Sequence]:
+    return {column: columns[column][positions] for column in ['id'] + SUM_COLUMNS}
+
+
+class TableAggregates:
+    """Whole-table and per-broker totals, updated row by row.
+
+    Every change costs O(1) for the sums plus O(log n) for the heap push,
+    so reading the aggregates never scans the table.  A bulk change is
+    applied per broker with ``add_many``/``remove_many``/``update_many``.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.total = Totals()
+        self.brokers: Dict[str, Totals] = {}
+        for row in rows:
+            self.add(row)
+
+    def add(self, row: Dict[str, Any]):
+        self.total.add(row)
+        broker = self.brokers.get(row['broker'])
+        if broker is None:
+            broker = self.brokers[row['broker']] = Totals()
+        broker.add(row)
+
+    def remove(self, row: Dict[str, Any]):
+        self.total.remove(row)
+        broker = self.brokers[row['broker']]
+        broker.remove(row)
+        if broker.count == 0:
+            del self.brokers[row['broker']]
+
+    def add_many(self, columns: Dict[str, Sequence]):
+        """``add`` for many rows (``TableColumns.columns()``), one update per broker."""
+        self.total.add_many(columns)
+        self._add_brokers(columns, columns['broker'])
+
+    def remove_many(self, columns: Dict[str, Sequence]):
+        self.total.remove_many(columns)
+        self._remove_brokers(columns, columns['broker'])
+
+    def update_many(self, old: Dict[str, Sequence], new: Dict[str, Sequence]):
+        """``remove_many(old)`` then ``add_many(new)`` for the same ids in the same order.
+
+        Rows that stay with their broker only move the values that changed.
+        """
+        if not len(new['id']):
+            return
+        self.total.replace_many(old, new)
+        before, after = old['broker'], new['broker']
+        moved = np.fromiter(map(operator.ne, before, after), dtype=bool, count=len(after))
+        if moved.any():
+            positions = np.flatnonzero(moved)
+            listed = positions.tolist()
+            self._remove_brokers(_select(old, positions), [before[position] for position in listed])
+            self._add_brokers(_select(new, positions), [after[position] for position in listed])
+            kept = np.flatnonzero(~moved)
+            old, new, after = _select(old, kept), _select(new, kept), [after[position] for position in kept.tolist()]
+        for name, positions in group_positions(after).items():
+            self.brokers[name].replace_many(_select(old, positions), _select(new, positions))
+
+    def _add_brokers(self, columns: Dict[str, Sequence], names: Sequence[str]):
+        for name, positions in group_positions(names).items():
+            broker = self.brokers.get(name)
+            if broker is None:
+                broker = self.brokers[name] = Totals()
+            broker.add_many(_select(columns, positions))
+
+    def _remove_brokers(self, columns: Dict[str, Sequence], names: Sequence[str]):
+        for name, positions in group_positions(names).items():
+            broker = self.brokers[name]
+            broker.remove_many(_select(columns, positions))
+            if broker.count == 0:
+                del self.brokers[name]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'total': self.total.to_dict(),
+            'brokers': {name: totals.to_dict() for name, totals in sorted(self.brokers.items())},
+        }
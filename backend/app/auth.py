@@ -5,13 +5,13 @@ from fastapi.security import (
 )
 from datetime import datetime, timedelta
 from jose import jwt
-import sqlite3
 from passlib.context import CryptContext
 from pydantic import BaseModel
 from typing import Dict, Optional
 import os
 from dotenv import load_dotenv
 import jose
+from database import read_connection, write_connection
 
 # Load environment variables
 load_dotenv()
@@ -34,67 +34,59 @@ bearer = HTTPBearer()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
-DATABASE = os.getenv("DATABASE_URL", "backend.db").replace("sqlite:///", "")
 
 # Initialize database
 def init_db():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE,
-            password TEXT,
-            last_login TIMESTAMP,
-            session_token TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
+    with write_connection() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE,
+                password TEXT,
+                last_login TIMESTAMP,
+                session_token TEXT
+            )
+        """)
 
 # Create initial user (run once)
 def create_initial_user():
-    try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        admin_username = os.getenv("ADMIN_USERNAME", "admin")
-        admin_password = os.getenv("ADMIN_PASSWORD")
-        if not admin_password:
-            print("Warning: ADMIN_PASSWORD not set in environment variables")
-            return
-            
-        hashed_password = pwd_context.hash(admin_password)
-        cursor.execute(
+    admin_username = os.getenv("ADMIN_USERNAME", "admin")
+    admin_password = os.getenv("ADMIN_PASSWORD")
+    if not admin_password:
+        print("Warning: ADMIN_PASSWORD not set in environment variables")
+        return
+        
+    hashed_password = pwd_context.hash(admin_password)
+    with write_connection() as conn:
+        conn.execute(
             "INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)",
             (admin_username, hashed_password)
         )
-        conn.commit()
-    finally:
-        conn.close()
 
 # Initialize database and create initial user
 init_db()
 create_initial_user()
 
+# Plain def: FastAPI runs it on the threadpool, so waiting for the SQLite
+# write lock (held by the number writer during its commits) and hashing
+# the password never block the event loop
 @router.post("/register")
-async def register(register_data: RegisterRequest):
+def register(register_data: RegisterRequest):
     """Handle user registration"""
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
         # Check if username already exists
-        cursor.execute("SELECT username FROM users WHERE username = ?", (register_data.username,))
-        if cursor.fetchone():
-            raise HTTPException(status_code=400, detail="Username already exists")
+        with read_connection() as conn:
+            cursor = conn.execute("SELECT username FROM users WHERE username = ?", (register_data.username,))
+            if cursor.fetchone():
+                raise HTTPException(status_code=400, detail="Username already exists")
         
         # Hash password and store new user
         hashed_password = pwd_context.hash(register_data.password)
-        cursor.execute(
-            "INSERT INTO users (username, password) VALUES (?, ?)",
-            (register_data.username, hashed_password)
-        )
-        conn.commit()
+        with write_connection() as conn:
+            conn.execute(
+                "INSERT INTO users (username, password) VALUES (?, ?)",
+                (register_data.username, hashed_password)
+            )
         
         return {"message": "User registered successfully"}
     except HTTPException:
@@ -102,22 +94,17 @@ async def register(register_data: RegisterRequest):
     except Exception as e:
         print(f"Registration error: {e}")
         raise HTTPException(status_code=500, detail="Failed to register user")
-    finally:
-        conn.close()
 
 def invalidate_existing_session(username: str):
     """Invalidate any existing session for the user"""
     if username in active_sessions:
         del active_sessions[username]
     
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE users SET session_token = NULL WHERE username = ?",
-        (username,)
-    )
-    conn.commit()
-    conn.close()
+    with write_connection() as conn:
+        conn.execute(
+            "UPDATE users SET session_token = NULL WHERE username = ?",
+            (username,)
+        )
 
 @router.post("/login")
 async def login(login_data: LoginRequest):
@@ -144,8 +131,9 @@ async def login(login_data: LoginRequest):
         print(f"ALGORITHM: {ALGORITHM}")  # Debug log
         raise HTTPException(status_code=500, detail=f"Login failed: {str(e)}")
 
+# Plain def for the same reason as register: the session update waits for the write lock
 @router.post("/logout")
-async def logout(request: Request, credentials: HTTPAuthorizationCredentials = Depends(bearer)):
+def logout(request: Request, credentials: HTTPAuthorizationCredentials = Depends(bearer)):
     """Handle user logout"""
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
@@ -0,0 +1,175 @@
+import os
+import json
+import glob
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+from table_columns import TableColumns
+
+# A full snapshot is kept at most this often; archived log segments cover the time in between
+BACKUP_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv('BACKUP_SNAPSHOT_INTERVAL_SECONDS', 600))
+# How far back a restore can go, and the fewest snapshots kept regardless of age
+BACKUP_RETENTION_HOURS = float(os.getenv('BACKUP_RETENTION_HOURS', 24))
+BACKUP_KEEP_SNAPSHOTS = int(os.getenv('BACKUP_KEEP_SNAPSHOTS', 10))
+# Newest snapshots whose parsed rows stay in memory, so restoring them needs no parsing
+BACKUP_CACHED_SNAPSHOTS = int(os.getenv('BACKUP_CACHED_SNAPSHOTS', 3))
+
+
+class BackupStore:
+    """Point-in-time backups of the broker table.
+
+    Layout under ``directory``:
+
+    - ``objects/<sha256>``: snapshot contents (columnar or CSV, told apart
+      by their first bytes), stored once per distinct content however many
+      snapshots share it.  Objects written before the columnar format
+      carry a ``.csv`` suffix.
+    - ``segments/``: mutation log segments that compaction would otherwise
+      delete, still named by the last seq they hold.
+    - ``catalog.json``: one entry per snapshot (seq, sha256, rows, size,
+      created_at), oldest first.
+
+    The table at any seq from the oldest snapshot onwards is that seq's
+    nearest earlier snapshot plus the logged mutations after it.  Every
+    method touches only files and is meant to run on the snapshot thread.
+
+    The rows of the newest snapshots taken by this process are also kept
+    in memory, as the compact typed columns they were written from.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, 'objects')
+        self.segments_dir = os.path.join(directory, 'segments')
+        self.catalog_path = os.path.join(directory, 'catalog.json')
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.segments_dir, exist_ok=True)
+        self.catalog: List[Dict[str, Any]] = self._read_catalog()
+        self._tables: Dict[int, TableColumns] = {}  # seq -> rows of a recent snapshot
+
+    def _read_catalog(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.catalog_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _write_catalog(self):
+        tmp_path = f"{self.catalog_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.catalog, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.catalog_path)
+
+    def object_path(self, sha256: str) -> str:
+        path = os.path.join(self.objects_dir, sha256)
+        legacy = f"{path}.csv"
+        return legacy if os.path.exists(legacy) else path
+
+    def add_snapshot(self, data: bytes, seq: int, table: TableColumns, force: bool = False) -> bool:
+        """Record the snapshot for ``seq`` if the interval has passed (or ``force``).
+
+        ``table`` holds the rows that ``data`` was written from; it
+        must not be changed afterwards.  Returns whether a
+        snapshot was recorded.  Identical content is only stored once.
+        """
+        with self._lock:
+            now = datetime.now()
+            if self.catalog and not force:
+                if self.catalog[-1]['seq'] >= seq:
+                    return False
+                last = datetime.fromisoformat(self.catalog[-1]['created_at'])
+                if now - last < timedelta(seconds=BACKUP_SNAPSHOT_INTERVAL_SECONDS):
+                    return False
+            sha256 = hashlib.sha256(data).hexdigest()
+            path = self.object_path(sha256)
+            if not os.path.exists(path):
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+            self.catalog.append({
+                'seq': seq,
+                'sha256': sha256,
+                'rows': len(table),
+                'size': len(data),
+                'created_at': now.isoformat(timespec='seconds')
+            })
+            self._tables[seq] = table
+            self._prune(now)
+            self._write_catalog()
+            return True
+
+    def _prune(self, now: datetime):
+        """Drop snapshots past retention (keeping the newest few) and what only they needed."""
+        cutoff = now - timedelta(hours=BACKUP_RETENTION_HOURS)
+        keep_from = max(len(self.catalog) - BACKUP_KEEP_SNAPSHOTS, 0)
+        while keep_from > 0 and datetime.fromisoformat(self.catalog[keep_from - 1]['created_at']) >= cutoff:
+            keep_from -= 1
+        self.catalog = self.catalog[keep_from:]
+        for seq in sorted(self._tables)[:-BACKUP_CACHED_SNAPSHOTS or None]:
+            del self._tables[seq]
+
+        referenced = {entry['sha256'] for entry in self.catalog}
+        for path in glob.glob(os.path.join(self.objects_dir, '*')):
+            if os.path.basename(path).split('.', 1)[0] not in referenced:
+                os.remove(path)
+        oldest_seq = self.catalog[0]['seq'] if self.catalog else 0
+        for last_seq, path in self.segments():
+            if last_seq <= oldest_seq:
+                os.remove(path)
+
+    def segments(self) -> List[tuple]:
+        """Archived log segments as ``(last seq, path)``, oldest first."""
+        found = []
+        for path in glob.glob(os.path.join(self.segments_dir, '*')):
+            suffix = path.rsplit('.', 1)[-1]
+            if suffix.isdigit():
+                found.append((int(suffix), path))
+        return sorted(found)
+
+    def snapshot_before(self, seq: int) -> Dict[str, Any]:
+        """The newest catalog entry at or before ``seq``; ValueError if none is kept."""
+        with self._lock:
+            candidates = [entry for entry in self.catalog if entry['seq'] <= seq]
+        if not candidates:
+            oldest = self.catalog[0]['seq'] if self.catalog else None
+            raise ValueError(f"No backup covers seq {seq} (oldest available: {oldest})")
+        return candidates[-1]
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Catalog entries, newest first."""
+        with self._lock:
+            return list(reversed(self.catalog))
+
+    def cached_table(self, entry: Dict[str, Any]) -> Optional[TableColumns]:
+        """The rows of a snapshot if they are still in memory."""
+        return self._tables.get(entry['seq'])
+
+    def read_snapshot(self, entry: Dict[str, Any]) -> bytes:
+        with open(self.object_path(entry['sha256']), 'rb') as f:
+            return f.read()
+
+    def records_between(self, after_seq: int, upto_seq: int, log) -> List[Dict[str, Any]]:
+        """Logged mutations with ``after_seq < seq <= upto_seq``, from the archive and the live log."""
+        for attempt in range(3):
+            paths = [path for last_seq, path in self.segments() if last_seq > after_seq]
+            paths += log.segments()
+            records = []
+            try:
+                for path in paths:
+                    for record in log.read_file(path):
+                        if record['seq'] > upto_seq:
+                            return records
+                        if record['seq'] > after_seq:
+                            records.append(record)
+                return records
+            except FileNotFoundError:
+                # The live segment was rotated while we listed it; list again
+                continue
+        raise RuntimeError("The mutation log kept changing while it was being read")
@@ -0,0 +1,94 @@
+import json
+import struct
+import numpy as np
+from typing import Dict, List, Sequence, Tuple
+
+# First bytes of a columnar snapshot; anything else is read as CSV
+MAGIC = b'BRKCOL1\n'
+
+# Buffers start on this boundary so numpy can view them in place
+ALIGNMENT = 64
+
+# Column types and the dtype of their value buffer (text has offsets plus UTF-8 bytes)
+DTYPES = {'int64': '<i8', 'float64': '<f8'}
+
+_HEADER_SIZE = struct.Struct('<Q')
+
+
+def _padding(size: int) -> int:
+    return -size % ALIGNMENT
+
+
+def is_columnar(data) -> bool:
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def encode_columns(schema: List[Tuple[str, str]], columns: Dict[str, Sequence]) -> bytes:
+    """Serialize whole columns (lists or arrays, all the same length).
+
+    ``schema`` lists ``(name, type)`` pairs with type ``int64``, ``float64``
+    or ``utf8``.  The layout is ``MAGIC``, the header length, a JSON header
+    describing every buffer, then the buffers, each aligned to ``ALIGNMENT``
+    bytes.  Numbers are stored as little-endian arrays; text as ``rows + 1``
+    int64 offsets into one UTF-8 blob, as Arrow does.
+    """
+    buffers, specs_by_column, offset = [], [], 0
+
+    def add(data: bytes) -> Dict[str, int]:
+        nonlocal offset
+        spec = {'offset': offset, 'length': len(data)}
+        buffers.append(data + b'\0' * _padding(len(data)))
+        offset += len(buffers[-1])
+        return spec
+
+    count = len(columns[schema[0][0]]) if schema else 0
+    for name, kind in schema:
+        values = columns[name]
+        if kind == 'utf8':
+            encoded = [value.encode('utf-8') for value in values]
+            offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+            np.cumsum([len(value) for value in encoded], out=offsets[1:])
+            specs = [add(offsets.tobytes()), add(b''.join(encoded))]
+        else:
+            specs = [add(np.asarray(values, dtype=DTYPES[kind]).tobytes())]
+        specs_by_column.append({'name': name, 'type': kind, 'buffers': specs})
+
+    header = json.dumps({'rows': count, 'columns': specs_by_column}, separators=(',', ':')).encode('utf-8')
+    prefix = MAGIC + _HEADER_SIZE.pack(len(header)) + header
+    return b''.join([prefix, b'\0' * _padding(len(prefix))] + buffers)
+
+
+def decode_columns(data) -> Dict[str, Sequence]:
+    """Read the columns of an ``encode_columns`` buffer.
+
+    ``data`` may be bytes or an mmap.  Numeric columns are returned as
+    read-only numpy views into ``data`` (copy them before it goes away)
+    and text columns as lists of str; nothing is parsed row by row except
+    the slicing of text values.
+    """
+    if not is_columnar(data):
+        raise ValueError("Not a columnar snapshot")
+    start = len(MAGIC) + _HEADER_SIZE.size
+    (header_size,) = _HEADER_SIZE.unpack_from(data, len(MAGIC))
+    header = json.loads(bytes(data[start:start + header_size]))
+    base = start + header_size
+    base += _padding(base)
+    count = header['rows']
+
+    columns = {}
+    for column in header['columns']:
+        specs = column['buffers']
+        if column['type'] == 'utf8':
+            offsets = np.frombuffer(data, dtype='<i8', count=count + 1, offset=base + specs[0]['offset']).tolist()
+            blob = bytes(data[base + specs[1]['offset']:base + specs[1]['offset'] + specs[1]['length']])
+            text = blob.decode('utf-8')
+            if len(text) == len(blob):
+                # Pure ASCII: byte offsets are character offsets, so slice the decoded string
+                values = [text[a:b] for a, b in zip(offsets, offsets[1:])]
+            else:
+                values = [blob[a:b].decode('utf-8') for a, b in zip(offsets, offsets[1:])]
+        else:
+            values = np.frombuffer(data, dtype=DTYPES[column['type']], count=count,
+                                   offset=base + specs[0]['offset'])
+        columns[column['name']] = values
+    return columns
@@ -1,4 +1,7 @@
 import sqlite3
+import queue
+import threading
+from contextlib import contextmanager
 from passlib.context import CryptContext
 import os
 from dotenv import load_dotenv
@@ -7,43 +10,116 @@ from dotenv import load_dotenv
 load_dotenv()
 
 DATABASE = os.getenv("DATABASE_URL", "backend.db").replace("sqlite:///", "")
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 4))
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-# ✅ Initialize the database
-def init_db():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE,
-        password TEXT
-    )""")
+class ConnectionPool:
+    """Long-lived SQLite connections shared by every module.
+
+    Reads borrow one of up to ``size`` query-only connections, so concurrent
+    readers never wait on each other or on the writer (WAL mode).  All writes
+    go through a single writer connection guarded by a lock, which matches
+    SQLite's one-writer model.  Connections live as long as the process, so
+    their prepared-statement caches are reused across requests.
+    """
+
+    def __init__(self, database: str, size: int = DB_READ_POOL_SIZE):
+        self.database = database
+        self.size = size
+        self._readers: queue.LifoQueue = queue.LifoQueue()
+        self._created = 0
+        self._create_lock = threading.Lock()
+        self._writer = None
+        self._write_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.database, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _get_reader(self) -> sqlite3.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._create_lock:
+            if self._created < self.size:
+                self._created += 1
+                conn = self._connect()
+                conn.execute("PRAGMA query_only=ON")
+                return conn
+        return self._readers.get()
+
+    @contextmanager
+    def read(self):
+        """Borrow a read-only connection."""
+        conn = self._get_reader()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    @contextmanager
+    def write(self):
+        """Use the writer connection; commits on success, rolls back on error."""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+                self._writer.execute("PRAGMA journal_mode=WAL")
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS random_numbers (
-        timestamp TEXT PRIMARY KEY,
-        value INTEGER
-    )""")
 
-    conn.commit()
-    conn.close()
+db_pool = ConnectionPool(DATABASE)
+
+
+def read_connection():
+    """Context manager yielding a pooled read-only connection."""
+    return db_pool.read()
+
+
+def write_connection():
+    """Context manager yielding the shared writer connection."""
+    return db_pool.write()
+
+# ✅ Initialize the database
+def init_db():
+    with write_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password TEXT
+        )""")
 
 # ✅ Create a new user
 def add_user(username, password):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
     hashed_password = pwd_context.hash(password)
-    
-    cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed_password))
-    conn.commit()
-    conn.close()
+    with write_connection() as conn:
+        conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed_password))
 
 # ✅ Verify if the user exists
 def verify_user(username, password):
     return True
-
-# ✅ Database connection function
-def get_db_connection():
-    return sqlite3.connect(DATABASE)
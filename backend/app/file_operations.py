@@ -1,16 +1,60 @@
+import io
 import os
+import zlib
 import pandas as pd
-import shutil
-from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 import json
-from fastapi import WebSocket
 import asyncio
-from websocket import broadcast_table_update
+from concurrent.futures import ThreadPoolExecutor
+from websocket import (
+    broadcast_table_delta, broadcast_table_snapshot, broadcast_aggregates, row_changes, encode_table_delta,
+    lock_manager
+)
+from table_store import TableStore, COLUMNS, ID_COLUMN, VERSION_COLUMN, normalize_frame, bulk_changes, to_csv
+from table_columns import TableColumns
+from backups import BackupStore
+from table_index import SORT_COLUMNS, GROUP_COLUMNS, encode_cursor, decode_cursor
 
 # Get the CSV file path from environment variables
 CSV_FILE_PATH = os.getenv('CSV_FILE_PATH', '/opt/render/project/src/backend/data/backend_table.csv')
 CSV_BACKUP_DIR = os.getenv('CSV_BACKUP_DIR', '/opt/render/project/src/backend/data/backups')
+CSV_WAL_PATH = os.getenv('CSV_WAL_PATH', f"{CSV_FILE_PATH}.log")
+
+# On-disk format of the table snapshot.  With 'columnar' the CSV is only
+# read once, to seed the table when no snapshot exists yet, and is
+# otherwise available through /export_csv.
+TABLE_SNAPSHOT_FORMAT = os.getenv('TABLE_SNAPSHOT_FORMAT', 'columnar')
+TABLE_SNAPSHOT_PATH = os.getenv(
+    'TABLE_SNAPSHOT_PATH',
+    f"{os.path.splitext(CSV_FILE_PATH)[0]}.cols" if TABLE_SNAPSHOT_FORMAT == 'columnar' else CSV_FILE_PATH
+)
+
+# Compaction folds the mutation log into the table snapshot in the background
+WAL_COMPACT_INTERVAL_SECONDS = float(os.getenv('WAL_COMPACT_INTERVAL_SECONDS', 30))
+WAL_COMPACT_MAX_RECORDS = int(os.getenv('WAL_COMPACT_MAX_RECORDS', 1000))
+
+# Writes arriving within this window are logged, applied and broadcast together
+WRITE_BATCH_WINDOW_MS = float(os.getenv('WRITE_BATCH_WINDOW_MS', 20))
+
+# Requests of a committed batch resumed per event loop iteration, so a large
+# batch's responses do not all run before the next tick or ping
+WRITE_RELEASE_SLICE = 8
+
+# Largest number of rows accepted by one bulk import
+BULK_MAX_ROWS = int(os.getenv('BULK_MAX_ROWS', 50000))
+
+# Rows encoded per chunk of a streamed /export_csv download
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 10000))
+
+# Export formats and their media types
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# Page size of /fetch_csv when paging, and the largest page a client may ask for
+PAGE_DEFAULT_ROWS = 100
+PAGE_MAX_ROWS = int(os.getenv('PAGE_MAX_ROWS', 1000))
+
+# Input names accepted for the columns whose names contain spaces
+COLUMN_ALIASES = {'API_key': 'API key', 'API_secret': 'API secret'}
 
 # Ensure directories exist
 os.makedirs(os.path.dirname(CSV_FILE_PATH), exist_ok=True)
@@ -19,14 +63,157 @@ os.makedirs(CSV_BACKUP_DIR, exist_ok=True)
 class RowLockError(Exception):
     pass
 
+# Snapshots and archived log segments for point-in-time restore
+backup_store = BackupStore(CSV_BACKUP_DIR)
+
+# Resident copy of the table; the snapshot is only read once at startup
+table_store = TableStore(TABLE_SNAPSHOT_PATH, CSV_WAL_PATH, backup_store.segments_dir,
+                         snapshot_format=TABLE_SNAPSHOT_FORMAT, import_path=CSV_FILE_PATH)
+compaction_requested = asyncio.Event()
+
+# Snapshots and backups run on their own thread so they never delay log writes
+snapshot_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='table-snapshot')
+
+
+class WriteBatcher:
+    """Coalesces table writes into batches that are committed together.
+
+    The event loop only prepares records and awaits them.  The first write
+    of a batch opens a ``WRITE_BATCH_WINDOW_MS`` window; everything queued
+    by the time it closes (or while the previous batch was being fsynced)
+    is written to the log on a dedicated thread with a single fsync,
+    applied to the store in sequence order and broadcast as one
+    ``table_delta``.  Each writer is then woken individually, so every
+    HTTP request still gets its own response; if any step fails, the
+    writers whose records were not applied get the error instead.
+    """
+
+    def __init__(self, store: TableStore, window_ms: float = WRITE_BATCH_WINDOW_MS):
+        self.store = store
+        self.window = window_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='table-log')
+        self._pending = []  # (record, source username, future) waiting for the next batch
+        self._flushing = False
+
+    async def commit(self, record: Dict[str, Any], username: str = None):
+        """Durably log a prepared record, apply and broadcast it; returns once done.
+
+        Once queued the record is committed even if the caller is
+        cancelled, so the caller (and the row mutex it holds) still waits
+        for it to be applied before the cancellation goes through.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((record, username, future))
+        if not self._flushing:
+            self._flushing = True
+            asyncio.create_task(self._flush())
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            while not future.done():
+                try:
+                    await asyncio.wait([future])
+                except asyncio.CancelledError:
+                    pass
+            if future.exception() is not None:
+                print(f"Write by a cancelled request failed: {future.exception()}")
+            raise
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending:
+                if self.window > 0:
+                    await asyncio.sleep(self.window)
+                batch, self._pending = self._pending, []
+                applied = []  # futures of the records now in the store
+                error = None
+                try:
+                    # A reset is always last: no write can be prepared behind it
+                    writes = batch[:-1] if batch[-1][0]['op'] == 'reset' else batch
+                    reset = batch[-1] if writes is not batch else None
+                    changes, payload = [], None
+                    if writes:
+                        changes, payload = await loop.run_in_executor(self.executor, self._log, writes)
+                    for record, _, future in writes:
+                        self.store.apply(record)
+                        applied.append(future)
+                    if reset is not None and await self._swap(reset):
+                        applied.append(reset[2])
+                    else:
+                        reset = None
+                    request_compaction_if_needed()
+                    try:
+                        await broadcast_table_delta(changes, payload)
+                        if reset is not None:
+                            await broadcast_table_snapshot()
+                        await broadcast_aggregates()
+                    except Exception as e:
+                        # Clients that miss it catch up through a resync
+                        print(f"Error broadcasting table delta: {e}")
+                except Exception as e:
+                    print(f"Error committing table writes: {e}")
+                    error = e
+                finally:
+                    await self._release(batch, applied, error)
+        finally:
+            self._flushing = False
+
+    def _log(self, writes) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Log a batch and build its table_delta, on the log thread rather than the loop."""
+        self.store.log.append_many([record for record, _, _ in writes])
+        changes = [change for record, username, _ in writes for change in row_changes(record, username)]
+        return changes, encode_table_delta(changes) if changes else None
+
+    async def _release(self, batch, applied, error: Optional[Exception]):
+        """Wake every writer of a batch: with a result if its record was applied, else an error."""
+        applied = set(map(id, applied))
+        for position, (record, _, future) in enumerate(batch, 1):
+            if id(future) not in applied:
+                self.store.discard(record)
+                if not future.done():
+                    future.set_exception(error or RuntimeError("The write was not committed"))
+            elif not future.done():
+                future.set_result(None)
+            if position % WRITE_RELEASE_SLICE == 0:
+                await asyncio.sleep(0)
+
+    async def _swap(self, entry) -> bool:
+        """Make a reset durable by swapping in a snapshot for its seq, then apply it.
+
+        The whole table is never written to the log: the log is rotated so
+        everything before the reset is in closed segments, and the snapshot
+        replaces the CSV with one atomic rename.
+        """
+        record, _, future = entry
+        # Every earlier write is applied by now, including ones in this batch
+        self.store.settle_reset(record)
+        try:
+            await self.run(self.store.log.rotate)
+            await asyncio.get_running_loop().run_in_executor(snapshot_executor, _swap_snapshot, record)
+        except Exception as e:
+            print(f"Error swapping in restored snapshot: {e}")
+            if not future.done():
+                future.set_exception(e)
+            return False
+        self.store.apply(record)
+        return True
+
+    async def run(self, fn, *args):
+        """Run other log file work (rotation) in order with the writes."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+
+write_batcher = WriteBatcher(table_store)
+
 def ensure_csv_exists():
     """Ensure the CSV file exists with the required columns."""
+    if os.path.exists(TABLE_SNAPSHOT_PATH):
+        return  # already imported; the CSV is not read again
     if not os.path.exists(CSV_FILE_PATH):
         print(f"CSV file not found, creating new one at: {CSV_FILE_PATH}")
         # Create an empty DataFrame with the required columns
-        df = pd.DataFrame(columns=[
-            'user', 'broker', 'API key', 'API secret', 'pnl', 'margin', 'max_risk'
-        ])
+        df = pd.DataFrame(columns=COLUMNS)
         
         # Add a sample row
         sample_row = {
@@ -46,73 +233,311 @@ def ensure_csv_exists():
     else:
         print(f"CSV file exists at: {CSV_FILE_PATH}")
 
-def create_backup():
-    """Create a backup of the current CSV file."""
-    if os.path.exists(CSV_FILE_PATH):
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_path = os.path.join(CSV_BACKUP_DIR, f'backup_{timestamp}.csv')
-        shutil.copy2(CSV_FILE_PATH, backup_path)
-        
-        # Clean up old backups (keep last 10)
-        backups = sorted([f for f in os.listdir(CSV_BACKUP_DIR) if f.startswith('backup_')])
-        if len(backups) > 10:
-            for old_backup in backups[:-10]:
-                os.remove(os.path.join(CSV_BACKUP_DIR, old_backup))
-
-def read_csv() -> List[Dict[str, Any]]:
-    """Read the CSV file and return its contents as a list of dictionaries."""
-    print(f"Reading CSV from: {CSV_FILE_PATH}")
+def init_table_store():
+    """Load the table snapshot and mutation log into memory (called once at startup)."""
     ensure_csv_exists()
-    df = pd.read_csv(CSV_FILE_PATH)
-    return df.to_dict('records')
+    table_store.load()
+    if not backup_store.catalog:
+        # First start with backups: the loaded snapshot is the earliest restore point
+        with open(table_store.path, 'rb') as f:
+            data = f.read()
+        snapshot = TableStore(table_store.path)  # scratch copy, only parsed
+        snapshot.load_bytes(data, table_store.snapshot_seq)
+        backup_store.add_snapshot(data, table_store.snapshot_seq, snapshot.columns(), force=True)
 
-async def update_csv_entry(index: int, entry: Dict[str, Any], username: str):
-    """Update a specific entry in the CSV file."""
-    ensure_csv_exists()
-    df = pd.read_csv(CSV_FILE_PATH)
-    
-    if index < 0 or index >= len(df):
-        raise ValueError(f"Invalid index: {index}")
-    
-    create_backup()
-    df.loc[index] = entry
-    df.to_csv(CSV_FILE_PATH, index=False)
-    
-    # Broadcast the update to all connected clients
-    await broadcast_table_update(df.to_dict('records'), username)
+def get_table_store() -> TableStore:
+    """Return the table store, loading it on first use."""
+    if not table_store.loaded:
+        init_table_store()
+    return table_store
 
-async def delete_csv_entry(index: int, username: str):
-    """Delete a specific entry from the CSV file."""
-    ensure_csv_exists()
-    df = pd.read_csv(CSV_FILE_PATH)
-    
-    if index < 0 or index >= len(df):
-        raise ValueError(f"Invalid index: {index}")
-    
-    create_backup()
-    df = df.drop(index)
-    df = df.reset_index(drop=True)
-    df.to_csv(CSV_FILE_PATH, index=False)
-    
-    # Broadcast the update to all connected clients
-    await broadcast_table_update(df.to_dict('records'), username)
+def read_csv_json() -> str:
+    """The table as a JSON array, serialized straight from its columns."""
+    return get_table_store().to_json()
+
+def _export_chunk(table: TableColumns, start: int, fmt: str, compressor) -> bytes:
+    chunk = table.slice(start, start + EXPORT_CHUNK_ROWS)
+    if fmt == 'csv':
+        data = to_csv(chunk, header=start == 0)
+    else:
+        data = chunk.to_ndjson().encode('utf-8')
+    return compressor.compress(data) if compressor is not None else data
+
+def export_table(fmt: str = 'csv', compress: bool = False) -> AsyncIterator[bytes]:
+    """Stream the current table as CSV or NDJSON, optionally gzipped.
+
+    The table is copied now, on the event loop that owns it, so the
+    download is one consistent version however long it takes.  Chunks of
+    ``EXPORT_CHUNK_ROWS`` rows are then encoded on the thread pool one at
+    a time, as the client reads them, so the encoded table is never held
+    in memory whole.  Raises ValueError for an unknown format.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid export format: {fmt} (expected one of {', '.join(EXPORT_FORMATS)})")
+    table = get_table_store().columns()
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None  # gzip container
+
+    async def chunks() -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        # A CSV of an empty table still gets its header row
+        for start in range(0, len(table) or 1, EXPORT_CHUNK_ROWS):
+            data = await loop.run_in_executor(None, _export_chunk, table, start, fmt, compressor)
+            if data:
+                yield data
+        if compressor is not None:
+            yield compressor.flush()
+
+    return chunks()
+
+def read_aggregates() -> Dict[str, Any]:
+    """Whole-table and per-broker totals, tagged with the table version."""
+    store = get_table_store()
+    return {"version": store.seq, **store.aggregates().to_dict()}
+
+def query_rows(sort: str = ID_COLUMN, limit: int = PAGE_DEFAULT_ROWS, cursor: Optional[str] = None,
+               equals: Optional[Dict[str, str]] = None,
+               ranges: Optional[Dict[str, tuple]] = None,
+               fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Return one page of rows from the column indexes.
+
+    ``sort`` is a sortable column, ``-`` prefixed for descending order.
+    ``equals`` filters on user/broker and ``ranges`` gives exclusive
+    ``(low, high)`` bounds per sortable column.  ``fields`` limits the
+    columns returned (``id`` is always included).  Pass the returned
+    ``next_cursor`` to get the following page; it is None on the last one.
+    Raises ValueError for invalid arguments.
+    """
+    column = sort[1:] if sort.startswith('-') else sort
+    if column not in SORT_COLUMNS:
+        raise ValueError(f"Invalid sort column: {column} (expected one of {', '.join(SORT_COLUMNS)})")
+    if not 1 <= limit <= PAGE_MAX_ROWS:
+        raise ValueError(f"limit must be between 1 and {PAGE_MAX_ROWS}")
+    for name in list(equals or {}) + list(ranges or {}):
+        if name not in GROUP_COLUMNS + SORT_COLUMNS:
+            raise ValueError(f"Cannot filter on {name}")
+    if fields is not None:
+        unknown = [field for field in fields if field not in [ID_COLUMN, VERSION_COLUMN] + COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        fields = [ID_COLUMN] + [field for field in fields if field != ID_COLUMN]
+    after = decode_cursor(cursor, sort) if cursor else None
+
+    store = get_table_store()
+    rows, last = store.index().query(column, sort.startswith('-'), equals, ranges, after, limit)
+    if fields is not None:
+        rows = [{field: row[field] for field in fields} for row in rows]
+    return {
+        "data": rows,
+        "next_cursor": encode_cursor(sort, last) if last is not None else None,
+        "version": store.seq
+    }
+
+def request_compaction_if_needed():
+    """Wake the compaction task early once the mutation log grows large."""
+    if table_store.log.records >= WAL_COMPACT_MAX_RECORDS:
+        compaction_requested.set()
+
+def _write_snapshot(table: TableColumns, seq: int):
+    data = table_store.write_snapshot(table, seq)
+    if data is not None:
+        backup_store.add_snapshot(data, seq, table)
+
+def _swap_snapshot(record: Dict[str, Any]):
+    data = table_store.write_snapshot(record['table'], record['seq'])
+    # Always a restore point: the reset itself is not in the log
+    backup_store.add_snapshot(data, record['seq'], record['table'], force=True)
+
+async def compact_table_store():
+    """Fold the mutation log into a fresh table snapshot without blocking the loop."""
+    if not table_store.loaded or not table_store.needs_compaction():
+        return
+    table, seq = table_store.begin_compaction()
+    await write_batcher.run(table_store.log.rotate)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(snapshot_executor, _write_snapshot, table, seq)
+    print(f"Compacted table snapshot at seq {seq}")
+
+async def periodic_compaction():
+    """Compact the mutation log every interval, or sooner when it grows large."""
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(compaction_requested.wait(), timeout=WAL_COMPACT_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            compaction_requested.clear()
+            try:
+                await compact_table_store()
+            except Exception as e:
+                print(f"Error compacting table snapshot: {e}")
+    except asyncio.CancelledError:
+        print("Compaction task cancelled")
+
+def shutdown_table_store():
+    """Write a final snapshot so the next start has nothing to replay."""
+    # Let queued log writes and snapshots finish first
+    for executor in (write_batcher.executor, snapshot_executor):
+        executor.submit(lambda: None).result()
+    if table_store.loaded and table_store.needs_compaction():
+        table, seq = table_store.begin_compaction()
+        table_store.log.rotate()
+        _write_snapshot(table, seq)
+    table_store.log.close()
+
+def check_row_lock(row_id: int, username: str):
+    """Raise RowLockError if another user is editing the row or it is in cooldown."""
+    allowed, reason = lock_manager.check(row_id, username)
+    if not allowed:
+        raise RowLockError(reason)
+
+async def update_csv_entry(row_id: int, entry: Dict[str, Any], username: str,
+                           expected_version: Optional[int] = None) -> Dict[str, Any]:
+    """Update a specific entry in the table and log it.
+
+    With ``expected_version`` the update only applies if the row is still at
+    that version (VersionConflictError otherwise).
+    """
+    store = get_table_store()
+    async with lock_manager.mutex(row_id):
+        store.check_id(row_id, expected_version)
+        check_row_lock(row_id, username)
+        
+        record = store.prepare_update(row_id, entry, expected_version)
+        await write_batcher.commit(record, username)
+        return record['row']
+
+async def delete_csv_entry(row_id: int, username: str, expected_version: Optional[int] = None):
+    """Delete a specific entry from the table and log it."""
+    store = get_table_store()
+    async with lock_manager.mutex(row_id):
+        store.check_id(row_id, expected_version)
+        check_row_lock(row_id, username)
+        
+        record = store.prepare_delete(row_id, expected_version)
+        await write_batcher.commit(record, username)
 
 async def append_csv_entry(entry: Dict[str, Any], username: str):
-    """Append a new entry to the CSV file."""
-    ensure_csv_exists()
-    df = pd.read_csv(CSV_FILE_PATH)
-    
-    create_backup()
-    df = pd.concat([df, pd.DataFrame([entry])], ignore_index=True)
-    df.to_csv(CSV_FILE_PATH, index=False)
+    """Append a new entry to the table and log it; returns the row and its table version."""
+    store = get_table_store()
     
-    # Broadcast the update to all connected clients
-    await broadcast_table_update(df.to_dict('records'), username)
-
-def restore_backup(backup_name: str):
-    """Restore a specific backup file."""
-    backup_path = os.path.join(CSV_BACKUP_DIR, backup_name)
-    if not os.path.exists(backup_path):
-        raise ValueError(f"Backup file not found: {backup_name}")
-    
-    shutil.copy2(backup_path, CSV_FILE_PATH)
+    record = store.prepare_append(entry)
+    await write_batcher.commit(record, username)
+    return record['row'], record['seq']
+
+def parse_bulk_rows(data: bytes, fmt: str) -> pd.DataFrame:
+    """Parse a bulk upload (``json`` array, ``ndjson`` or ``csv``) into validated rows."""
+    if fmt == 'csv':
+        # Keep text exactly as written; numbers are converted during validation
+        df = pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False)
+    elif fmt == 'ndjson':
+        df = pd.read_json(io.BytesIO(data), lines=True, dtype=False)
+    else:
+        rows = json.loads(data)
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("Expected a JSON array of row objects")
+        df = pd.DataFrame.from_records(rows)
+    if df.empty:
+        raise ValueError("No rows to import")
+    if len(df) > BULK_MAX_ROWS:
+        raise ValueError(f"Too many rows: {len(df)} (at most {BULK_MAX_ROWS})")
+    return normalize_frame(df.rename(columns=COLUMN_ALIASES))
+
+async def bulk_upsert_entries(frame: pd.DataFrame, username: str) -> Dict[str, Any]:
+    """Insert and update many rows as one logged mutation and one broadcast.
+
+    Returns the ``bulk`` record; rows without an id were inserted.  Only
+    the checks against the current rows run on the event loop; the rows
+    themselves are built on the thread pool.
+    """
+    store = get_table_store()
+    row_ids = [int(row_id) for row_id in frame[ID_COLUMN].dropna().unique()]
+    async with lock_manager.mutexes(row_ids):
+        for row_id in row_ids:
+            allowed, reason = lock_manager.check(row_id, username)
+            if not allowed:
+                raise RowLockError(f"Row {row_id}: {reason}")
+
+        ids, versions = store.plan_bulk(frame)
+        loop = asyncio.get_running_loop()
+        body = await loop.run_in_executor(None, bulk_changes, frame, ids, versions)
+        record = store.prepare_bulk(body)
+        await write_batcher.commit(record, username)
+        return record
+
+def rows_at(seq: int) -> TableColumns:
+    """Rebuild the table as it was right after mutation ``seq`` from the backups.
+
+    Reads only files, so it runs on the snapshot thread.
+    """
+    entry = backup_store.snapshot_before(seq)
+    replay = TableStore(table_store.path)  # scratch copy; never loaded from or written to disk
+    table = backup_store.cached_table(entry)
+    if table is not None:
+        replay.load_table(table, entry['seq'])
+    else:
+        replay.load_bytes(backup_store.read_snapshot(entry), entry['seq'])
+    for record in backup_store.records_between(entry['seq'], seq, table_store.log):
+        replay.apply(record)
+    return replay.columns()
+
+async def restore_backup(seq: int, username: str = None) -> Dict[str, Any]:
+    """Restore the table to how it was at mutation ``seq``.
+
+    The restore goes through the write batcher like any other write and
+    becomes a new table version, made durable by swapping in a snapshot;
+    history after ``seq`` stays in the backups.  Returns the reset record.
+    """
+    store = get_table_store()
+    if not 0 <= seq <= store.seq:
+        raise ValueError(f"seq must be between 0 and {store.seq}")
+    loop = asyncio.get_running_loop()
+    table = await loop.run_in_executor(snapshot_executor, rows_at, seq)
+
+    record = store.prepare_reset(table)
+    try:
+        await write_batcher.commit(record, username)
+    except Exception:
+        store.abort_reset(record)
+        raise
+    return record
+
+def list_backups() -> Dict[str, Any]:
+    """Restore points, newest first, and the range of seqs a restore or diff accepts."""
+    entries = backup_store.entries()
+    return {
+        "version": get_table_store().seq,
+        "oldest_seq": entries[-1]['seq'] if entries else None,
+        "backups": entries
+    }
+
+def diff_rows(old: List[Dict[str, Any]], new: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Row-by-row differences between two versions of the table, matched by id."""
+    before = {row[ID_COLUMN]: row for row in old}
+    after = {row[ID_COLUMN]: row for row in new}
+    added = [row for row_id, row in after.items() if row_id not in before]
+    removed = [row for row_id, row in before.items() if row_id not in after]
+    changed = []
+    for row_id, row in after.items():
+        previous = before.get(row_id)
+        if previous is None:
+            continue
+        fields = {column: [previous[column], row[column]] for column in COLUMNS if previous[column] != row[column]}
+        if fields:
+            changed.append({"id": row_id, "changes": fields})
+    return {
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "counts": {"added": len(added), "removed": len(removed), "changed": len(changed)}
+    }
+
+async def diff_backups(from_seq: int, to_seq: int) -> Dict[str, Any]:
+    """Compare the table at two seqs (any restore point or mutation in between)."""
+    current = get_table_store().seq
+    for seq in (from_seq, to_seq):
+        if not 0 <= seq <= current:
+            raise ValueError(f"seq must be between 0 and {current}")
+    loop = asyncio.get_running_loop()
+    old = await loop.run_in_executor(snapshot_executor, rows_at, from_seq)
+    new = await loop.run_in_executor(snapshot_executor, rows_at, to_seq)
+    return {"from": from_seq, "to": to_seq, **diff_rows(old.rows(), new.rows())}
@@ -0,0 +1,216 @@
+import heapq
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple, Callable, Awaitable, AsyncIterator
+import pytz
+
+# Constants for lock timeouts
+EDIT_TIMEOUT_MINUTES = 15  # Maximum time a user can hold a lock
+COOLDOWN_SECONDS = 5      # Cooldown period after editing
+MUTEX_SLICE = 500         # Row mutexes taken or released by ``mutexes`` between yields
+
+utc = pytz.UTC
+
+
+class LockManager:
+    """Row edit locks and the single task that expires them.
+
+    ``locks`` maps a row id to ``{username, expires_at, status,
+    last_modified}`` with timezone-aware UTC datetimes.  An editing lock
+    that times out turns into a cooldown, and a finished cooldown frees the
+    row.  Every deadline is pushed onto a heap and ``run`` sleeps until the
+    earliest one, so each lock costs O(log n) however many clients are
+    connected.  Heap entries made stale by a refresh or release are skipped
+    when they come up.
+
+    ``mutex`` holds one ``asyncio.Lock`` per row.  Lock changes and
+    table writes for a row run under it, so a lock cannot be granted in the
+    middle of a write while edits to other rows proceed in parallel.  A
+    row's lock only exists while someone holds or waits for it.
+    ``mutexes`` holds many rows' locks for a bulk write.
+    """
+
+    def __init__(self, notify: Callable[[dict], Awaitable[None]]):
+        self.locks: Dict[int, dict] = {}
+        self._heap: List[Tuple[datetime, int]] = []  # (expires_at, row_id)
+        self._notify = notify  # broadcasts lock_status changes made by the scheduler
+        self._wakeup = asyncio.Event()
+        self._mutexes: Dict[int, asyncio.Lock] = {}
+        self._mutex_users: Dict[int, int] = {}  # tasks holding or waiting for each row's mutex
+
+    def _use_mutex(self, row_id: int) -> asyncio.Lock:
+        mutex = self._mutexes.get(row_id)
+        if mutex is None:
+            mutex = self._mutexes[row_id] = asyncio.Lock()
+        self._mutex_users[row_id] = self._mutex_users.get(row_id, 0) + 1
+        return mutex
+
+    def _leave_mutex(self, row_id: int) -> None:
+        self._mutex_users[row_id] -= 1
+        if self._mutex_users[row_id] == 0:
+            # Nobody holds or waits for it: forget the row (it may be deleted)
+            del self._mutexes[row_id], self._mutex_users[row_id]
+
+    @asynccontextmanager
+    async def mutex(self, row_id: int) -> AsyncIterator[None]:
+        """Hold the lock serializing lock changes and writes for one row."""
+        mutex = self._use_mutex(row_id)
+        try:
+            async with mutex:
+                yield
+        finally:
+            self._leave_mutex(row_id)
+
+    @asynccontextmanager
+    async def mutexes(self, row_ids: Iterable[int]) -> AsyncIterator[None]:
+        """Hold the locks of many rows, taken in id order so two callers cannot deadlock.
+
+        Free locks are taken without suspending, so this yields to the event
+        loop every ``MUTEX_SLICE`` rows while taking and releasing them.
+        """
+        held: List[int] = []
+        try:
+            for row_id in sorted(row_ids):
+                mutex = self._use_mutex(row_id)
+                try:
+                    await mutex.acquire()
+                except BaseException:
+                    self._leave_mutex(row_id)
+                    raise
+                held.append(row_id)
+                if len(held) % MUTEX_SLICE == 0:
+                    await asyncio.sleep(0)
+            yield
+        finally:
+            cancelled = False
+            for position, row_id in enumerate(held, 1):
+                self._mutexes[row_id].release()
+                self._leave_mutex(row_id)
+                if position % MUTEX_SLICE == 0 and position < len(held):
+                    try:
+                        await asyncio.sleep(0)
+                    except asyncio.CancelledError:
+                        cancelled = True  # every lock still has to be released
+            if cancelled:
+                raise asyncio.CancelledError()
+
+    def get(self, row_id: int) -> Optional[dict]:
+        return self.locks.get(row_id)
+
+    def items(self) -> List[Tuple[int, dict]]:
+        return list(self.locks.items())
+
+    def _set(self, row_id: int, username: str, status: str, expires_at: datetime) -> dict:
+        lock = {
+            'username': username,
+            'expires_at': expires_at,
+            'status': status,
+            'last_modified': datetime.now(utc)
+        }
+        self.locks[row_id] = lock
+        if len(self._heap) > 2 * len(self.locks) + 64:
+            # Mostly stale entries from refreshes; rebuild from the live locks
+            self._heap = [(l['expires_at'], r) for r, l in self.locks.items() if r != row_id]
+            heapq.heapify(self._heap)
+        heapq.heappush(self._heap, (expires_at, row_id))
+        if self._heap[0] == (expires_at, row_id):
+            # New earliest deadline; let the scheduler shorten its sleep
+            self._wakeup.set()
+        return lock
+
+    def check(self, row_id: int, username: str) -> Tuple[bool, Optional[str]]:
+        """Return whether ``username`` may lock the row, and why not if it may not."""
+        lock = self.locks.get(row_id)
+        if lock is None:
+            return True, None
+
+        now = datetime.now(utc)
+        if now > lock['expires_at']:
+            return True, None
+
+        if lock['status'] == 'cooldown':
+            remaining = (lock['expires_at'] - now).total_seconds()
+            return False, f"Row is in cooldown ({int(remaining)} seconds remaining)"
+
+        if lock['username'] != username:
+            return False, f"Row is being edited by {lock['username']}"
+
+        return True, None
+
+    def holds(self, row_id: int, username: str) -> bool:
+        """True if ``username`` has an unexpired editing lock on the row."""
+        lock = self.locks.get(row_id)
+        return (lock is not None and lock['username'] == username
+                and lock['status'] == 'editing' and datetime.now(utc) <= lock['expires_at'])
+
+    def acquire(self, row_id: int, username: str) -> Tuple[Optional[dict], Optional[str]]:
+        """Grant or refresh an editing lock; returns ``(lock, None)`` or ``(None, reason)``."""
+        allowed, error = self.check(row_id, username)
+        if not allowed:
+            return None, error
+        expires_at = datetime.now(utc) + timedelta(minutes=EDIT_TIMEOUT_MINUTES)
+        return self._set(row_id, username, 'editing', expires_at), None
+
+    def release(self, row_id: int, username: str) -> Optional[dict]:
+        """Move the user's lock into cooldown; returns the new lock, or None if not theirs."""
+        lock = self.locks.get(row_id)
+        if lock is None or lock['username'] != username:
+            return None
+        expires_at = datetime.now(utc) + timedelta(seconds=COOLDOWN_SECONDS)
+        return self._set(row_id, username, 'cooldown', expires_at)
+
+    def release_all(self, username: str) -> List[int]:
+        """Drop every lock held by ``username`` and return the freed rows."""
+        freed = [row_id for row_id, lock in self.locks.items() if lock['username'] == username]
+        for row_id in freed:
+            del self.locks[row_id]
+        return freed
+
+    def held_by(self, username: str) -> List[Tuple[int, dict]]:
+        return [(row_id, lock) for row_id, lock in self.locks.items() if lock['username'] == username]
+
+    async def _expire(self, row_id: int, lock: dict):
+        if lock['status'] == 'editing':
+            expires_at = datetime.now(utc) + timedelta(seconds=COOLDOWN_SECONDS)
+            self._set(row_id, lock['username'], 'cooldown', expires_at)
+            await self._notify({
+                "type": "lock_status",
+                "row_id": row_id,
+                "status": "cooldown",
+                "locked_by": lock['username'],
+                "expires_at": expires_at.isoformat(),
+                "message": f"Row is in cooldown period for {COOLDOWN_SECONDS} seconds"
+            })
+        else:
+            del self.locks[row_id]
+            await self._notify({
+                "type": "lock_status",
+                "row_id": row_id,
+                "locked_by": None,
+                "status": "available",
+                "message": "Row is now available for editing"
+            })
+
+    async def run(self):
+        """Expire locks as their deadlines pass (one task for the whole server)."""
+        try:
+            while True:
+                self._wakeup.clear()
+                now = datetime.now(utc)
+                while self._heap and self._heap[0][0] <= now:
+                    expires_at, row_id = heapq.heappop(self._heap)
+                    lock = self.locks.get(row_id)
+                    if lock is None or lock['expires_at'] != expires_at:
+                        continue  # refreshed, released or dropped since it was scheduled
+                    try:
+                        await self._expire(row_id, lock)
+                    except Exception as e:
+                        print(f"Error expiring lock on row {row_id}: {e}")
+                timeout = (self._heap[0][0] - now).total_seconds() if self._heap else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            print("Lock expiry task cancelled")
@@ -1,5 +1,5 @@
+import gc
 import asyncio
-import sqlite3
 import random
 from datetime import datetime
 import pytz
@@ -8,7 +8,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
 from routes import router
 from database import init_db
-from websocket import websocket_endpoint, active_connections, broadcast_random_number
+from file_operations import init_table_store, periodic_compaction, shutdown_table_store
+from websocket import websocket_endpoint, active_connections, broadcast_random_number, lock_manager
+from timeseries import number_writer, recent_numbers, init_timeseries
 import os
 from dotenv import load_dotenv
 
@@ -44,6 +46,7 @@ app.add_middleware(
 
 # ✅ Initialize the database
 init_db()
+init_timeseries()
 
 # ✅ Include all API routes
 app.include_router(router, prefix="/api")
@@ -56,8 +59,22 @@ async def websocket_route(websocket: WebSocket, username: str = None):
 # ✅ Background Task to Generate Random Numbers
 @app.on_event("startup")
 async def startup_event():
+    init_table_store()
+    # Move the objects of every imported module out of the collector's view:
+    # otherwise each full collection walks them all, pausing the loop for
+    # tens of milliseconds
+    gc.collect()
+    gc.freeze()
+    number_writer.start()
+    asyncio.create_task(periodic_compaction())
+    asyncio.create_task(lock_manager.run())
     asyncio.create_task(generate_numbers())
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    shutdown_table_store()
+    number_writer.stop()
+
 async def generate_numbers():
     """Generate random numbers and broadcast to all connected clients."""
     prev_value = 50  # Starting value
@@ -71,15 +88,11 @@ async def generate_numbers():
             value = max(0, min(100, prev_value + change))  # Keep between 0 and 100
             prev_value = value
 
-            # Store in database with IST timestamp
-            conn = sqlite3.connect("backend.db")
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO random_numbers (timestamp, value) VALUES (?, ?)", 
-                (current_time.isoformat(), value)
-            )
-            conn.commit()
-            conn.close()
+            # Keep it in memory for recent-history reads and queue it for
+            # the batched database writer (epoch milliseconds)
+            ts_ms = int(current_time.timestamp() * 1000)
+            recent_numbers.append(ts_ms, value)
+            number_writer.add(ts_ms, value)
 
             # Broadcast to all connected clients with IST time
             await broadcast_random_number(value, current_time)
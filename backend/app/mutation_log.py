@@ -0,0 +1,188 @@
+import os
+import json
+import glob
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
+
+# Changes of a bulk record encoded per call, so the thread writing a large
+# record lets the event loop run in between
+ENCODE_SLICE = 1000
+
+
+def _dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def encode_record(record: Dict[str, Any]) -> bytes:
+    """A record as one log line, without its in-memory (``_``) fields."""
+    record = {key: value for key, value in record.items() if not key.startswith('_')}
+    changes = record.get('changes')
+    if changes is None or len(changes) <= ENCODE_SLICE:
+        return _dumps(record) + b'\n'
+    head = _dumps({key: value for key, value in record.items() if key != 'changes'})
+    parts = [_dumps(changes[start:start + ENCODE_SLICE])[1:-1] for start in range(0, len(changes), ENCODE_SLICE)]
+    return head[:-1] + b',"changes":[' + b','.join(parts) + b']}\n'
+
+
+class MutationLog:
+    """Append-only log of table mutations, one JSON record per line.
+
+    Every record carries a ``seq`` number and is fsynced before ``append``
+    returns; ``append_many`` writes a whole batch with a single fsync.
+    ``rotate`` closes the current segment under a ``<path>.<last_seq>`` name,
+    where ``last_seq`` is the highest sequence number written to it, so a
+    snapshot at seq N may drop every segment named N or lower while new
+    records keep going to a fresh segment.
+
+    A batch whose write or fsync fails is cut off the segment again before
+    anything else is appended, so a torn line never ends up in front of
+    acknowledged records (replay stops at the first bad line).  The same
+    goes for a line torn by a crash: ``read`` with ``repair`` (at startup)
+    marks it to be cut off before the next append.
+
+    Fields whose name starts with ``_`` are kept in memory only (e.g. the
+    columns of a bulk record) and are not written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self.records = 0  # records written since the last rotation
+        self.last_seq = 0  # highest seq written to the live segment or earlier
+        self._torn_at: Optional[int] = None  # size to truncate back to after a failed append
+
+    def open(self):
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, record: Dict[str, Any]):
+        """Durably append a single record."""
+        self.append_many([record])
+
+    def append_many(self, records: List[Dict[str, Any]]):
+        """Durably append records in order, with one fsync for the whole batch."""
+        self.open()
+        if self._torn_at is not None:
+            self._truncate()
+        offset = self._file.tell()
+        try:
+            self._file.write(b''.join(map(encode_record, records)))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except Exception:
+            self._torn_at = offset
+            try:
+                self._truncate()
+            except OSError as e:
+                # Retried before the next append, which fails until it works
+                print(f"Error truncating {self.path} after a failed append: {e}")
+            raise
+        self.records += len(records)
+        self.last_seq = max(self.last_seq, records[-1]['seq'])
+
+    def _truncate(self):
+        """Cut the live segment back to its size before the failed append."""
+        try:
+            self.close()
+        except OSError:
+            # Flushing the rest of the failed batch; it is cut off below anyway
+            self._file = None
+        with open(self.path, 'r+b') as f:
+            f.truncate(self._torn_at)
+            os.fsync(f.fileno())
+        self._torn_at = None
+        self.open()
+
+    def rotate(self):
+        """Close the current segment so it can be compacted away later."""
+        if self._torn_at is not None:
+            self._truncate()
+        self.close()
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            os.replace(self.path, f"{self.path}.{self.last_seq}")
+        self.records = 0
+        self.open()
+
+    def segments(self) -> List[str]:
+        """Return rotated segments in sequence order, followed by the live one."""
+        rotated = []
+        for path in glob.glob(f"{glob.escape(self.path)}.*"):
+            suffix = path[len(self.path) + 1:]
+            if suffix.isdigit():
+                rotated.append((int(suffix), path))
+        paths = [path for _, path in sorted(rotated)]
+        if os.path.exists(self.path):
+            paths.append(self.path)
+        return paths
+
+    def read(self, after_seq: int = 0, repair: bool = False) -> Iterator[Dict[str, Any]]:
+        """Yield the records with a sequence number greater than ``after_seq``.
+
+        With ``repair``, a torn record at the end of the live segment is cut
+        off before the next append; only for a reader that nothing is
+        appending behind.
+        """
+        for path in self.segments():
+            end = 0
+            for record, end in self._read_lines(path):
+                if record['seq'] > after_seq:
+                    yield record
+            if repair and path == self.path and end < os.path.getsize(path):
+                self._torn_at = end
+
+    @classmethod
+    def read_file(cls, path: str) -> Iterator[Dict[str, Any]]:
+        """Yield every complete record in one segment file."""
+        for record, _ in cls._read_lines(path):
+            yield record
+
+    @staticmethod
+    def _read_lines(path: str) -> Iterator[Tuple[Dict[str, Any], int]]:
+        """Yield each complete record and the file offset just after it."""
+        with open(path, 'rb') as f:
+            end = 0
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("no line end")
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn write at the tail of the log; nothing after it was acknowledged
+                    print(f"Ignoring incomplete record at the end of {path}")
+                    break
+                end += len(line)
+                yield record, end
+
+    def drop_segments(self, upto_seq: int, archive_dir: Optional[str] = None):
+        """Remove rotated segments that are fully covered by a snapshot.
+
+        With ``archive_dir`` they are moved there (keeping their names)
+        instead of being deleted.
+        """
+        for path in self.segments():
+            suffix = path[len(self.path) + 1:]
+            if suffix.isdigit() and int(suffix) <= upto_seq:
+                if archive_dir is None:
+                    os.remove(path)
+                else:
+                    os.replace(path, os.path.join(archive_dir, os.path.basename(path)))
+
+    def discard(self):
+        """Move every segment aside; used when the snapshot no longer matches the log."""
+        self.close()
+        stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        for path in self.segments():
+            os.replace(path, f"{path}.discarded-{stamp}")
+        self.records = 0
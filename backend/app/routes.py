@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, Request
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, Request, Response, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from auth import verify_token
 from auth import router as auth_router
-from database import get_db_connection
+from timeseries import query_numbers, latest_numbers, NUMBERS_DEFAULT_POINTS
 from file_operations import (
-    read_csv, update_csv_entry, delete_csv_entry, append_csv_entry, 
-    restore_backup, RowLockError
+    read_csv_json, update_csv_entry, delete_csv_entry, append_csv_entry, 
+    restore_backup, get_table_store, RowLockError,
+    parse_bulk_rows, bulk_upsert_entries, query_rows, read_aggregates, PAGE_DEFAULT_ROWS,
+    list_backups, diff_backups, export_table, EXPORT_FORMATS
 )
-from websocket import websocket_endpoint
+from table_index import SORT_COLUMNS, GROUP_COLUMNS
+from table_store import RowNotFoundError, VersionConflictError, BulkValidationError, RestoreInProgressError
+from websocket import websocket_endpoint, connection_metrics
 from typing import List, Dict, Any
 from pydantic import BaseModel, Field
 from typing import Optional
@@ -14,6 +20,18 @@ from typing import Optional
 
 router = APIRouter()
 
+# Query parameters that make /fetch_csv return a page instead of the whole table
+RANGE_PARAMS = {f"{column}_{bound}": (column, bound) for column in SORT_COLUMNS for bound in ("gt", "lt")}
+PAGE_PARAMS = {"limit", "cursor", "sort", "fields"} | set(GROUP_COLUMNS) | set(RANGE_PARAMS)
+
+# Request content types accepted by /bulk_csv and the parser each one uses
+BULK_FORMATS = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "text/csv": "csv",
+}
+
 
 class CSVEntry(BaseModel):
     user: Optional[str] = Field(default="")
@@ -28,20 +46,124 @@ class CSVEntry(BaseModel):
         allow_population_by_field_name = True
 
 
+def parse_if_match(value: Optional[str]) -> Optional[int]:
+    """Row version from an If-Match header (``"3"``, ``W/"3"`` or ``3``); None if absent or ``*``."""
+    if value is None or value.strip() == "*":
+        return None
+    tag = value.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    try:
+        return int(tag.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid If-Match header: {value}")
+
+
+def table_etag() -> str:
+    """Changes whenever the table does, including edits made to the CSV outside the server.
+
+    Outside edits are only picked up at startup, so the hash is that of the
+    snapshot loaded then; compaction rewrites the snapshot without changing
+    the rows and must not change the tag.
+    """
+    store = get_table_store()
+    return f'"{store.seq}-{(store.loaded_hash or "")[:12]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
 @router.get("/numbers", dependencies=[Depends(verify_token)])
-def get_numbers():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM random_numbers ORDER BY timestamp DESC LIMIT 100")
-    data = cursor.fetchall()
-    conn.close()
-    return data
+def get_numbers(
+    from_ms: Optional[int] = Query(default=None, alias="from"),
+    to_ms: Optional[int] = Query(default=None, alias="to"),
+    resolution: Optional[str] = Query(default=None),
+    downsample: str = Query(default="lttb"),
+    max_points: int = Query(default=NUMBERS_DEFAULT_POINTS, ge=3)
+) -> Dict[str, Any]:
+    # Without a range keep the old behaviour: the latest 100 raw ticks
+    if from_ms is None and to_ms is None and resolution is None:
+        points = latest_numbers(100)
+        return {
+            "from": points[0]["timestamp"] if points else None,
+            "to": points[-1]["timestamp"] + 1 if points else None,
+            "resolution": "raw",
+            "downsample": None,
+            "count": len(points),
+            "points": points
+        }
+    try:
+        return query_numbers(from_ms, to_ms, resolution or "auto", downsample, max_points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.get("/fetch_csv")
-async def fetch_csv(request: Request, _: str = Depends(verify_token)) -> List[Dict[str, Any]]:
+async def fetch_csv(request: Request, response: Response, _: str = Depends(verify_token)):
+    """Return the whole table, or one page of it when any paging parameter is given.
+
+    Paging parameters: ``limit``, ``cursor`` (the previous page's
+    ``next_cursor``), ``sort`` (``-`` prefix for descending), ``user`` and
+    ``broker`` filters, ``<column>_lt`` / ``<column>_gt`` bounds and
+    ``fields`` (comma separated).
+    """
     try:
-        return read_csv()
+        # Clients apply table_delta messages on top of this version
+        headers = {"X-Table-Version": str(get_table_store().seq), "ETag": table_etag()}
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        params = request.query_params
+        if not PAGE_PARAMS.intersection(params):
+            # Already JSON: skips building and re-encoding a dict per row
+            return Response(content=read_csv_json(), media_type="application/json", headers=headers)
+
+        ranges = {}
+        for name, (column, bound) in RANGE_PARAMS.items():
+            if name in params:
+                low, high = ranges.get(column, (float("-inf"), float("inf")))
+                value = float(params[name])
+                ranges[column] = (value, high) if bound == "gt" else (low, value)
+        return query_rows(
+            sort=params.get("sort", "id"),
+            limit=int(params.get("limit", PAGE_DEFAULT_ROWS)),
+            cursor=params.get("cursor"),
+            equals={column: params[column] for column in GROUP_COLUMNS if column in params},
+            ranges=ranges,
+            fields=[field.strip() for field in params["fields"].split(",")] if "fields" in params else None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/export_csv")
+async def get_export_csv(
+    format: str = Query(default="csv"),
+    gzip: bool = Query(default=False),
+    _: str = Depends(verify_token)
+):
+    """Stream the whole table as a CSV (or ``format=ndjson``) download.
+
+    The snapshot itself may be columnar.  With ``gzip=true`` the download
+    is a gzip file.  Other requests keep being served while it streams.
+    """
+    try:
+        filename = f"backend_table.{format}" + (".gz" if gzip else "")
+        headers = {
+            "X-Table-Version": str(get_table_store().seq),
+            "Content-Disposition": f'attachment; filename="{filename}"'
+        }
+        chunks = export_table(format, gzip)
+        media_type = "application/gzip" if gzip else EXPORT_FORMATS[format]
+        return StreamingResponse(chunks, media_type=media_type, headers=headers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -59,13 +181,18 @@ async def add_csv(request: Request, data: CSVEntry, _: str = Depends(verify_toke
             "margin": float(data.margin) if data.margin else 0.0,
             "max_risk": float(data.max_risk) if data.max_risk else 0.0
         }
-        await append_csv_entry(entry_data, username)
-        
-        updated_data = read_csv()
+        row, version = await append_csv_entry(entry_data, username)
+        # Only the new row: clients get the rest of the table from table_delta
         return {
             "message": "Entry added successfully",
-            "data": updated_data
+            "id": row["id"],
+            "row": row,
+            "version": version
         }
+    except RestoreInProgressError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -73,8 +200,59 @@ async def add_csv(request: Request, data: CSVEntry, _: str = Depends(verify_toke
         )
 
 
-@router.put("/update_csv/{index}")
-async def update_csv(index: int, data: CSVEntry, request: Request, _: str = Depends(verify_token)):
+@router.post("/bulk_csv")
+async def bulk_csv(request: Request, _: str = Depends(verify_token)):
+    """Insert and update many rows from a JSON array, NDJSON or a CSV upload.
+
+    Rows with an ``id`` update that row (checked against their ``version``
+    if one is given) and rows without one are inserted.  All of them are
+    validated first and then applied as a single change with one broadcast.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    try:
+        if content_type == "multipart/form-data":
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise ValueError("Expected a CSV file in the 'file' form field")
+            data, fmt = await upload.read(), "csv"
+        elif content_type in BULK_FORMATS:
+            data, fmt = await request.body(), BULK_FORMATS[content_type]
+        else:
+            raise HTTPException(status_code=415, detail=f"Unsupported content type: {content_type or 'none'}")
+
+        # Parsing and validating thousands of rows stays off the event loop
+        frame = await run_in_threadpool(parse_bulk_rows, data, fmt)
+        record = await bulk_upsert_entries(frame, request.state.username)
+        inserted = [change["row"]["id"] for change in record["changes"] if change["op"] == "add"]
+        return {
+            "message": "Rows imported successfully",
+            "inserted": len(inserted),
+            "updated": len(record["changes"]) - len(inserted),
+            "ids": inserted,
+            "version": record["seq"]
+        }
+    except HTTPException:
+        raise
+    except BulkValidationError as e:
+        raise HTTPException(status_code=400, detail={"message": str(e), "errors": e.errors})
+    except VersionConflictError as e:
+        raise HTTPException(status_code=412, detail=str(e))
+    except RowLockError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except RestoreInProgressError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to import rows: {str(e)}")
+
+
+@router.put("/update_csv/{row_id}")
+async def update_csv(row_id: int, data: CSVEntry, request: Request, response: Response,
+                     _: str = Depends(verify_token)):
+    # Optimistic concurrency: the row version the client's edit is based on
+    expected_version = parse_if_match(request.headers.get("if-match"))
     try:
         username = request.state.username
         entry_data = {
@@ -86,30 +264,101 @@ async def update_csv(index: int, data: CSVEntry, request: Request, _: str = Depe
             "margin": data.margin,
             "max_risk": data.max_risk
         }
-        await update_csv_entry(index, entry_data, username)
-        return {"message": "Entry updated successfully"}
+        row = await update_csv_entry(row_id, entry_data, username, expected_version)
+        response.headers["ETag"] = f'"{row["version"]}"'
+        return {"message": "Entry updated successfully", "version": row["version"]}
+    except VersionConflictError as e:
+        raise HTTPException(status_code=412, detail=str(e), headers={"ETag": f'"{e.current}"'})
     except RowLockError as e:
         raise HTTPException(status_code=409, detail=str(e))
+    except RestoreInProgressError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except RowNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.delete("/delete_csv/{index}")
-async def delete_csv(index: int, request: Request, _: str = Depends(verify_token)):
+@router.delete("/delete_csv/{row_id}")
+async def delete_csv(row_id: int, request: Request, _: str = Depends(verify_token)):
+    expected_version = parse_if_match(request.headers.get("if-match"))
     try:
         username = request.state.username
-        await delete_csv_entry(index, username)
+        await delete_csv_entry(row_id, username, expected_version)
         return {"message": "Entry deleted successfully"}
+    except VersionConflictError as e:
+        raise HTTPException(status_code=412, detail=str(e), headers={"ETag": f'"{e.current}"'})
     except RowLockError as e:
         raise HTTPException(status_code=409, detail=str(e))
+    except RestoreInProgressError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except RowNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/aggregates")
+async def aggregates(_: str = Depends(verify_token)):
+    """Totals for the whole table and per broker, kept up to date on every write."""
+    try:
+        return read_aggregates()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/backups")
+async def get_backups(_: str = Depends(verify_token)):
+    """Restore points with their row count, size and time, newest first."""
+    try:
+        return list_backups()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/backups/diff")
+async def get_backups_diff(
+    from_seq: int = Query(alias="from"),
+    to_seq: Optional[int] = Query(default=None, alias="to"),
+    _: str = Depends(verify_token)
+):
+    """Rows added, removed and changed between two seqs (``to`` defaults to now)."""
+    try:
+        return await diff_backups(from_seq, get_table_store().seq if to_seq is None else to_seq)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/backups/{seq}/restore")
+async def restore_table(seq: int, request: Request, _: str = Depends(verify_token)):
+    """Put the table back to how it was at ``seq``, as a new version."""
+    try:
+        record = await restore_backup(seq, request.state.username)
+        return {
+            "message": f"Table restored to seq {seq}",
+            "rows": len(record["table"]),
+            "version": record["seq"]
+        }
+    except RestoreInProgressError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to restore: {str(e)}")
+
+
+@router.get("/ws_metrics")
+async def ws_metrics(_: str = Depends(verify_token)):
+    """Outbound queue depth and drop counters for every connected client."""
+    return connection_metrics()
+
+
 @router.websocket("/ws")
 async def websocket_route(websocket: WebSocket, username: str = None):
     if not username:
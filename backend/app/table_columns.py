@@ -0,0 +1,244 @@
+import sys
+import math
+import numpy as np
+import pandas as pd
+from json.encoder import encode_basestring
+from typing import Dict, Any, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to encoding column by column
+    orjson = None
+
+# Array dtype per numeric column type; every other column holds a list of str
+DTYPES = {'int64': np.int64, 'float64': np.float64}
+
+# Smallest array capacity allocated when appending to an empty table
+MIN_CAPACITY = 16
+
+
+def group_positions(values: Sequence[Any]) -> Dict[Any, np.ndarray]:
+    """Positions of each distinct value in ``values``, in order."""
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    return {value: order[bounds[code]:bounds[code + 1]] for code, value in enumerate(uniques)}
+
+
+class TableColumns:
+    """Rows stored as typed columns, one slot per row.
+
+    ``schema`` lists ``(name, type)`` pairs as in ``columnar``.  Numeric
+    columns are numpy arrays with spare capacity (doubled when full), so a
+    number costs 8 bytes rather than a Python object in a dict; text
+    columns are lists of str, and values of the ``interned`` columns (few
+    distinct values, e.g. broker names) share one string object each.
+
+    A cleared slot keeps its place with ``live`` False, so slot numbers
+    held by the caller stay valid; ``take`` makes a compact copy.  Values
+    only become row dicts in ``row``/``rows`` and JSON in ``to_json``.
+    """
+
+    def __init__(self, schema: Sequence[Tuple[str, str]], interned: Iterable[str] = ()):
+        self.schema = list(schema)
+        self.interned = frozenset(interned)
+        self.data: Dict[str, Any] = {
+            name: np.zeros(0, dtype=DTYPES[kind]) if kind in DTYPES else [] for name, kind in self.schema
+        }
+        self.live = np.zeros(0, dtype=bool)
+        self.size = 0  # slots in use, live or cleared
+        self.count = 0  # live slots
+
+    @classmethod
+    def from_columns(cls, schema: Sequence[Tuple[str, str]], columns: Dict[str, Sequence],
+                     interned: Iterable[str] = ()) -> 'TableColumns':
+        """Build a compact table from whole columns (lists or arrays), copying them."""
+        table = cls(schema, interned)
+        size = len(columns[table.schema[0][0]]) if table.schema else 0
+        for name, kind in table.schema:
+            values = columns[name]
+            if kind in DTYPES:
+                table.data[name] = np.array(values, dtype=DTYPES[kind])
+            elif name in table.interned:
+                table.data[name] = list(map(sys.intern, values))
+            else:
+                table.data[name] = list(values)
+        table.live = np.ones(size, dtype=bool)
+        table.size = table.count = size
+        return table
+
+    @classmethod
+    def from_rows(cls, schema: Sequence[Tuple[str, str]], rows: List[Dict[str, Any]],
+                  interned: Iterable[str] = ()) -> 'TableColumns':
+        return cls.from_columns(schema, {name: [row[name] for row in rows] for name, _ in schema}, interned)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _grow(self, needed: int = 1):
+        capacity = max(MIN_CAPACITY, 2 * len(self.live), self.size + needed)
+        for name, kind in self.schema:
+            if kind in DTYPES:
+                grown = np.zeros(capacity, dtype=DTYPES[kind])
+                grown[:self.size] = self.data[name][:self.size]
+                self.data[name] = grown
+        live = np.zeros(capacity, dtype=bool)
+        live[:self.size] = self.live[:self.size]
+        self.live = live
+
+    def _text(self, name: str, value: str) -> str:
+        return sys.intern(value) if name in self.interned else value
+
+    def append(self, row: Dict[str, Any]) -> int:
+        """Store ``row`` in a new slot and return the slot."""
+        slot = self.size
+        if slot == len(self.live):
+            self._grow()
+        for name, kind in self.schema:
+            if kind in DTYPES:
+                self.data[name][slot] = row[name]
+            else:
+                self.data[name].append(self._text(name, row[name]))
+        self.live[slot] = True
+        self.size += 1
+        self.count += 1
+        return slot
+
+    def extend(self, rows: 'TableColumns') -> int:
+        """Store every row of ``rows`` (compact, same schema) in new slots; returns the first."""
+        start, size = self.size, rows.size
+        if start + size > len(self.live):
+            self._grow(size)
+        for name, kind in self.schema:
+            if kind in DTYPES:
+                self.data[name][start:start + size] = rows.data[name][:size]
+            else:
+                self.data[name].extend(rows.data[name][:size])
+        self.live[start:start + size] = True
+        self.size += size
+        self.count += size
+        return start
+
+    def set(self, slot: int, row: Dict[str, Any]):
+        for name, kind in self.schema:
+            self.data[name][slot] = row[name] if kind in DTYPES else self._text(name, row[name])
+
+    def set_many(self, slots: np.ndarray, rows: 'TableColumns', positions: np.ndarray):
+        """Overwrite ``slots`` with rows ``positions`` of ``rows`` (compact, same schema)."""
+        targets, sources = slots.tolist(), positions.tolist()
+        for name, kind in self.schema:
+            if kind in DTYPES:
+                self.data[name][slots] = rows.data[name][positions]
+            else:
+                column, values = self.data[name], rows.data[name]
+                for slot, position in zip(targets, sources):
+                    column[slot] = values[position]
+
+    def clear(self, slot: int):
+        """Mark a slot deleted and release its text values."""
+        self.live[slot] = False
+        self.count -= 1
+        for name, kind in self.schema:
+            if kind not in DTYPES:
+                self.data[name][slot] = ""
+
+    def value(self, slot: int, name: str) -> Any:
+        column = self.data[name]
+        return column.item(slot) if isinstance(column, np.ndarray) else column[slot]
+
+    def row(self, slot: int) -> Dict[str, Any]:
+        """The row in ``slot`` as a dict of plain Python values."""
+        data = self.data
+        return {name: data[name].item(slot) if kind in DTYPES else data[name][slot] for name, kind in self.schema}
+
+    def live_slots(self) -> np.ndarray:
+        return np.flatnonzero(self.live[:self.size])
+
+    def take(self, slots: Optional[np.ndarray] = None) -> 'TableColumns':
+        """A compact copy of ``slots`` (default: every live slot), in slot order."""
+        table = TableColumns(self.schema, self.interned)
+        if slots is None and self.count == self.size:
+            for name, kind in self.schema:
+                table.data[name] = self.data[name][:self.size].copy() if kind in DTYPES else self.data[name][:]
+            size = self.size
+        else:
+            slots = self.live_slots() if slots is None else slots
+            positions = slots.tolist()
+            for name, kind in self.schema:
+                values = self.data[name]
+                table.data[name] = values[slots] if kind in DTYPES else [values[slot] for slot in positions]
+            size = len(positions)
+        table.live = np.ones(size, dtype=bool)
+        table.size = table.count = size
+        return table
+
+    def _compact(self) -> 'TableColumns':
+        return self if self.count == self.size else self.take()
+
+    def slice(self, start: int, stop: int) -> 'TableColumns':
+        """A compact copy of live rows ``start`` to ``stop`` (positions, not slots)."""
+        table = self._compact()
+        size = max(0, min(stop, table.size) - start)
+        part = TableColumns(self.schema, self.interned)
+        for name, kind in self.schema:
+            values = table.data[name][:table.size][start:stop]
+            part.data[name] = values.copy() if kind in DTYPES else values
+        part.live = np.ones(size, dtype=bool)
+        part.size = part.count = size
+        return part
+
+    def columns(self) -> Dict[str, Sequence]:
+        """Live values per column: arrays for numbers, lists of str for text."""
+        table = self._compact()
+        return {name: table.data[name][:table.size] for name, _ in self.schema}
+
+    def values(self, name: str) -> List[Any]:
+        """Live values of one column as Python objects."""
+        values = self.columns()[name]
+        return values.tolist() if isinstance(values, np.ndarray) else values
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """Every live row as a dict (materializes the whole table)."""
+        names = [name for name, _ in self.schema]
+        return [dict(zip(names, values)) for values in zip(*(self.values(name) for name in names))]
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.columns(), columns=[name for name, _ in self.schema])
+
+    def json_rows(self) -> Iterable[str]:
+        """Each live row as a JSON object; non-finite numbers become null, as with orjson.
+
+        Without orjson each column is encoded on its own by C-level calls
+        (interned columns once per distinct value) and the rows are
+        assembled with a single format template, so no row dict is built.
+        """
+        if orjson is not None:
+            return (orjson.dumps(row).decode('utf-8') for row in self.rows())
+        table = self._compact()
+        encoded = []
+        for name, kind in self.schema:
+            values = table.data[name][:table.size]
+            if kind == 'float64' and not np.isfinite(values).all():
+                # repr() would write inf/nan, which is not JSON
+                encoded.append([repr(value) if math.isfinite(value) else 'null' for value in values.tolist()])
+            elif kind in DTYPES:
+                encoded.append(map(repr, values.tolist()))
+            elif name in self.interned:
+                distinct = {value: encode_basestring(value) for value in set(values)}
+                encoded.append(map(distinct.__getitem__, values))
+            else:
+                encoded.append(map(encode_basestring, values))
+        template = '{' + ','.join(encode_basestring(name).replace('%', '%%') + ':%s' for name, _ in self.schema) + '}'
+        return map(template.__mod__, zip(*encoded))
+
+    def to_json(self) -> str:
+        """The live rows as a JSON array of objects."""
+        if orjson is not None:
+            return orjson.dumps(self.rows()).decode('utf-8')
+        return '[' + ','.join(self.json_rows()) + ']'
+
+    def to_ndjson(self) -> str:
+        """The live rows as newline-delimited JSON, one object per line."""
+        if orjson is not None:
+            return b''.join(orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE) for row in self.rows()).decode('utf-8')
+        return ''.join(row + '\n' for row in self.json_rows())
@@ -0,0 +1,310 @@
+import json
+import base64
+from bisect import bisect_left, bisect_right, insort
+import numpy as np
+from collections import Counter
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+# Columns a page can be sorted on and columns with an equality index
+SORT_COLUMNS = ['id', 'pnl', 'margin', 'max_risk']
+GROUP_COLUMNS = ['user', 'broker']
+
+# Groups with at least this many rows keep their keys in each sort order once queried
+GROUP_CACHE_ROWS = 256
+
+INF = float('inf')
+
+Key = Tuple[Any, int]  # (sort value, row id)
+
+
+def encode_cursor(sort: str, key: Key) -> str:
+    """Opaque cursor pointing just after ``key`` in ``sort`` order."""
+    payload = json.dumps({'sort': sort, 'after': list(key)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str) -> Key:
+    """Return the key a cursor points after; ValueError if it is malformed or for another sort."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        value, row_id = payload['after']
+        cursor_sort = payload['sort']
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError(f"Cursor was issued for sort={cursor_sort}, not sort={sort}")
+    return value, int(row_id)
+
+
+class TableIndex:
+    """Column indexes over the rows of a TableStore.
+
+    ``sorted`` keeps one ascending list of ``(value, id)`` keys per sortable
+    column and ``groups`` one id-ordered key list per distinct user and
+    broker.  A page is read by bisecting to its start (the range filter on
+    the sort column and the cursor both become bounds) and walking keys
+    until ``limit`` rows pass the remaining filters.  Rows are updated as
+    remove + add.
+
+    With an equality filter the walk goes over the smallest group instead
+    of the whole sort index, in sort order: ``group_sorted`` keeps those
+    keys for groups of ``GROUP_CACHE_ROWS`` or more, built when first
+    queried (smaller groups are sorted per query).  A range on another
+    column that holds fewer rows than the walk is expected to visit is
+    read from that column's index and its matching rows sorted instead.
+    So a page costs about ``limit`` divided by the share of rows that
+    match, capped by the size of the smallest filter, rather than a walk
+    over every row that fails the filters.
+
+    The index holds keys only: ``lookup`` returns the row for an id and
+    ``field`` one of its values, so filters never build a row that is not
+    returned.
+    """
+
+    def __init__(self, table, lookup: Callable[[int], Dict[str, Any]], field: Callable[[int, str], Any]):
+        """Index the live rows of ``table`` (a ``TableColumns``)."""
+        self.lookup = lookup
+        self.field = field
+        ids = table.values('id')
+        self.sorted: Dict[str, List[Key]] = self.sorted_keys(table)
+        self.groups: Dict[str, Dict[str, List[Key]]] = {column: {} for column in GROUP_COLUMNS}
+        self.group_sorted: Dict[Tuple[str, str], Dict[str, List[Key]]] = {}  # (column, value) -> sort -> keys
+        for column in GROUP_COLUMNS:
+            groups = self.groups[column]
+            for row_id, value in sorted(zip(ids, table.values(column))):
+                groups.setdefault(value, []).append((row_id, row_id))
+
+    @staticmethod
+    def sorted_keys(table) -> Dict[str, List[Key]]:
+        """The sorted keys of each sortable column for the live rows of ``table``.
+
+        Ordered by numpy rather than by comparing tuples.  Only reads
+        ``table``, so it can run on another thread.
+        """
+        columns = table.columns()
+        ids = columns['id']
+        keys = {}
+        for column in SORT_COLUMNS:
+            order = np.lexsort((ids, columns[column]))
+            keys[column] = list(zip(columns[column][order].tolist(), ids[order].tolist()))
+        return keys
+
+    def add(self, row: Dict[str, Any]):
+        row_id = row['id']
+        for column in SORT_COLUMNS:
+            insort(self.sorted[column], (row[column], row_id))
+        for column in GROUP_COLUMNS:
+            insort(self.groups[column].setdefault(row[column], []), (row_id, row_id))
+            for sort, keys in self.group_sorted.get((column, row[column]), {}).items():
+                insort(keys, (row[sort], row_id))
+
+    def remove(self, row: Dict[str, Any]):
+        """Drop the keys of ``row`` as it was indexed."""
+        row_id = row['id']
+        for column in SORT_COLUMNS:
+            keys = self.sorted[column]
+            del keys[bisect_left(keys, (row[column], row_id))]
+        for column in GROUP_COLUMNS:
+            keys = self.groups[column][row[column]]
+            del keys[bisect_left(keys, (row_id, row_id))]
+            if not keys:
+                del self.groups[column][row[column]]
+                self.group_sorted.pop((column, row[column]), None)
+                continue
+            for sort, keys in self.group_sorted.get((column, row[column]), {}).items():
+                del keys[bisect_left(keys, (row[sort], row_id))]
+
+    def add_many(self, table, keys: Optional[Dict[str, List[Key]]] = None):
+        """``add`` every row of ``table`` (a compact ``TableColumns``), merging each key list once.
+
+        ``keys`` are its ``sorted_keys``, if already built off the event loop.
+        """
+        if not table.count:
+            return
+        keys = keys or self.sorted_keys(table)
+        for column in SORT_COLUMNS:
+            self._merge(column, keys[column])
+        ids = table.values('id')
+        for column in GROUP_COLUMNS:
+            self._add_members(column, ids, table.values(column))
+
+    def remove_many(self, table):
+        """``remove`` every row of ``table`` (a compact ``TableColumns``) as it was indexed."""
+        ids = table.values('id')
+        if not ids:
+            return
+        removed = set(ids)
+        for column in SORT_COLUMNS:
+            self.sorted[column] = [key for key in self.sorted[column] if key[1] not in removed]
+        for column in GROUP_COLUMNS:
+            self._remove_members(column, ids, table.values(column))
+
+    def update_many(self, old, new):
+        """Move rows from ``old`` to ``new`` (compact ``TableColumns`` of the same ids in order).
+
+        Only the keys of values that changed are moved, so a column the
+        update leaves alone costs one comparison per row.
+        """
+        if not new.count:
+            return
+        before, after = old.columns(), new.columns()
+        ids = after['id']
+        for column in SORT_COLUMNS:
+            changed = np.flatnonzero(before[column] != after[column])  # NaN counts as changed
+            if len(changed) == 0:
+                continue
+            moved = set(ids[changed].tolist())
+            self.sorted[column] = [key for key in self.sorted[column] if key[1] not in moved]
+            values, moved_ids = after[column][changed], ids[changed]
+            order = np.lexsort((moved_ids, values))
+            self._merge(column, list(zip(values[order].tolist(), moved_ids[order].tolist())))
+        row_ids = ids.tolist()
+        if self.group_sorted:
+            # The groups of every updated row may now be out of sort order
+            for column in GROUP_COLUMNS:
+                self._forget(column, before[column])
+                self._forget(column, after[column])
+        for column in GROUP_COLUMNS:
+            changed = [position for position, (a, b) in enumerate(zip(before[column], after[column])) if a != b]
+            if not changed:
+                continue
+            moved_ids = [row_ids[position] for position in changed]
+            self._remove_members(column, moved_ids, [before[column][position] for position in changed])
+            self._add_members(column, moved_ids, [after[column][position] for position in changed])
+
+    def _merge(self, column: str, keys: List[Key]):
+        merged = self.sorted[column]
+        merged.extend(keys)
+        merged.sort()  # two sorted runs, so this is a single merge
+
+    def _forget(self, column: str, values: List[str]):
+        """Drop the sorted keys of the groups of ``values``; they are rebuilt when next queried."""
+        for value in set(values):
+            self.group_sorted.pop((column, value), None)
+
+    def _add_members(self, column: str, ids: List[int], values: List[str]):
+        self._forget(column, values)
+        groups = self.groups[column]
+        unsorted = set()
+        for row_id, value in zip(ids, values):
+            key = (row_id, row_id)
+            keys = groups.get(value)
+            if keys is None:
+                groups[value] = [key]
+                continue
+            if keys[-1] > key:
+                unsorted.add(value)  # inserted rows have the highest ids and never get here
+            keys.append(key)
+        for value in unsorted:
+            groups[value].sort()
+
+    def _remove_members(self, column: str, ids: List[int], values: List[str]):
+        self._forget(column, values)
+        groups = self.groups[column]
+        counts = Counter(values)
+        removed, filtered = None, set()
+        for row_id, value in zip(ids, values):
+            if value in filtered:
+                continue  # its rows all went in one pass
+            keys = groups[value]
+            if len(keys) <= 64 or counts[value] * 8 < len(keys):
+                # A small group, or a few rows of a large one: cheaper than a pass over it
+                del keys[bisect_left(keys, (row_id, row_id))]
+            else:
+                filtered.add(value)
+                removed = removed or set(ids)
+                keys = groups[value] = [key for key in keys if key[1] not in removed]
+            if not keys:
+                del groups[value]
+
+    def query(self, sort: str = 'id', descending: bool = False,
+              equals: Optional[Dict[str, str]] = None,
+              ranges: Optional[Dict[str, Tuple[float, float]]] = None,
+              after: Optional[Key] = None, limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[Key]]:
+        """Return up to ``limit`` matching rows and the key of the last one.
+
+        ``equals`` maps user/broker to a required value and ``ranges`` maps a
+        sortable column to exclusive ``(low, high)`` bounds.  The last key is
+        None once the page is not full, i.e. there is nothing further.
+        """
+        equals = dict(equals or {})
+        ranges = dict(ranges or {})
+        bounds = ranges.pop(sort, None)
+        sizes = {column: len(self.groups[column].get(value, ())) for column, value in equals.items()}
+        spans = {column: self._span(self.sorted[column], low, high) for column, (low, high) in ranges.items()}
+        if not all(sizes.values()) or any(start >= end for start, end in spans.values()):
+            return [], None  # a filter no row passes
+
+        keys = self._plan(sort, equals, ranges, sizes, spans, limit)
+        start, end = self._span(keys, *bounds) if bounds is not None else (0, len(keys))
+        if after is not None:
+            if descending:
+                end = min(end, bisect_left(keys, after))
+            else:
+                start = max(start, bisect_right(keys, after))
+
+        positions = range(end - 1, start - 1, -1) if descending else range(start, end)
+        page, last = [], None
+        for position in positions:
+            key = keys[position]
+            if (equals or ranges) and not self._matches(key[1], equals, ranges):
+                continue
+            page.append(self.lookup(key[1]))
+            last = key
+            if len(page) == limit:
+                return page, last
+        return page, None
+
+    def _plan(self, sort: str, equals: Dict[str, str], ranges: Dict[str, Tuple[float, float]],
+              sizes: Dict[str, int], spans: Dict[str, Tuple[int, int]], limit: int) -> List[Key]:
+        """The keys to walk in ``sort`` order; pops the filters they already satisfy.
+
+        ``sizes`` are the row counts of the ``equals`` groups and ``spans``
+        the positions of the ``ranges`` in their columns' indexes.
+        """
+        group = min(sizes, key=sizes.get) if sizes else None
+        if spans:
+            rows = len(self.sorted['id'])
+            matching = float(rows)
+            for size in sizes.values():
+                matching *= size / rows
+            for start, end in spans.values():
+                matching *= (end - start) / rows
+            # Keys an ordered walk is expected to visit before the page is full
+            walked = sizes[group] if group is not None else rows
+            walk = min(walked, limit * walked / matching)
+            column = min(spans, key=lambda c: spans[c][1] - spans[c][0])
+            start, end = spans[column]
+            if end - start < walk:
+                del ranges[column]
+                matched = [row_id for _, row_id in self.sorted[column][start:end]
+                           if self._matches(row_id, equals, ranges)]
+                equals.clear()
+                ranges.clear()
+                return sorted((self.field(row_id, sort), row_id) for row_id in matched)
+        if group is not None:
+            return self._group_keys(group, equals.pop(group), sort)
+        return self.sorted[sort]
+
+    def _group_keys(self, column: str, value: str, sort: str) -> List[Key]:
+        """The keys of the rows whose ``column`` is ``value``, in ``sort`` order."""
+        members = self.groups[column][value]
+        if sort == 'id':
+            return members  # an id-ordered group list is already a pre-filtered sort index
+        cached = self.group_sorted.get((column, value))
+        if cached is not None and sort in cached:
+            return cached[sort]
+        keys = sorted((self.field(row_id, sort), row_id) for _, row_id in members)
+        if len(members) >= GROUP_CACHE_ROWS:
+            self.group_sorted.setdefault((column, value), {})[sort] = keys
+        return keys
+
+    def _matches(self, row_id: int, equals: Dict[str, str], ranges: Dict[str, Tuple[float, float]]) -> bool:
+        if any(self.field(row_id, c) != value for c, value in equals.items()):
+            return False
+        return all(low < self.field(row_id, c) < high for c, (low, high) in ranges.items())
+
+    @staticmethod
+    def _span(keys: List[Key], low: float, high: float) -> Tuple[int, int]:
+        """Positions in ``keys`` of the values strictly between ``low`` and ``high``."""
+        return bisect_right(keys, (low, INF)), bisect_left(keys, (high, -INF))
@@ -0,0 +1,698 @@
+import io
+import os
+import json
+import mmap
+import hashlib
+import math
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from mutation_log import MutationLog
+from table_index import TableIndex
+from aggregates import TableAggregates
+from columnar import encode_columns, decode_columns, is_columnar
+from table_columns import TableColumns
+
+# Column layout of the broker table
+COLUMNS = ['user', 'broker', 'API key', 'API secret', 'pnl', 'margin', 'max_risk']
+NUMERIC_COLUMNS = ['pnl', 'margin', 'max_risk']
+TEXT_COLUMNS = [c for c in COLUMNS if c not in NUMERIC_COLUMNS]
+
+# Stable row identifier and per-row version counter, stored as the first CSV columns
+ID_COLUMN = 'id'
+VERSION_COLUMN = 'version'
+
+# Snapshot file formats; either can be read whatever ``snapshot_format`` is set to
+SNAPSHOT_FORMATS = ('columnar', 'csv')
+
+# Column types, both in memory and in columnar snapshots
+SNAPSHOT_SCHEMA = ([(ID_COLUMN, 'int64'), (VERSION_COLUMN, 'int64')]
+                   + [(column, 'utf8') for column in TEXT_COLUMNS]
+                   + [(column, 'float64') for column in NUMERIC_COLUMNS])
+
+# Text columns with few distinct values, stored as shared (interned) strings
+INTERNED_COLUMNS = ['user', 'broker']
+
+# Rebuild the slot list once deleted rows outnumber live ones (and at least this many)
+MIN_TOMBSTONES_TO_COMPACT = 64
+
+# Bulk validation errors quoted in an exception message
+MAX_REPORTED_ERRORS = 20
+
+
+class RowNotFoundError(ValueError):
+    pass
+
+
+class BulkValidationError(ValueError):
+    """Bulk input rows that cannot be applied, one message per problem."""
+
+    def __init__(self, errors: List[str]):
+        super().__init__(f"{len(errors)} invalid row(s): " + "; ".join(errors[:MAX_REPORTED_ERRORS]))
+        self.errors = errors
+
+
+class RestoreInProgressError(Exception):
+    """Writes are refused while a restore is waiting to be applied."""
+
+
+class VersionConflictError(Exception):
+    """The row changed since the version the caller based its edit on."""
+
+    def __init__(self, row_id: int, expected: int, current: int):
+        super().__init__(f"Row {row_id} is at version {current}, not {expected}")
+        self.row_id = row_id
+        self.expected = expected
+        self.current = current
+
+
+def normalize_row(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a row dict with exactly the table columns and clean values."""
+    row = {}
+    for column in TEXT_COLUMNS:
+        value = entry.get(column)
+        row[column] = "" if value is None or value != value else str(value)
+    for column in NUMERIC_COLUMNS:
+        value = entry.get(column)
+        try:
+            value = float(value) if value is not None else 0.0
+        except (TypeError, ValueError):
+            value = 0.0
+        if value in (math.inf, -math.inf):
+            # Not representable in JSON, so every client reading the table would fail
+            raise ValueError(f"{column} must be a finite number (got {value!r})")
+        row[column] = 0.0 if value != value else value
+    return row
+
+
+def touched_rows(record: Dict[str, Any]) -> Iterator[Tuple[int, Optional[int]]]:
+    """``(row id, version after the change)`` for each row a record changes; None for a delete."""
+    if record['op'] == 'reset':
+        return
+    if '_rows' in record:
+        yield from zip(record['_rows'].values(ID_COLUMN), record['_rows'].values(VERSION_COLUMN))
+        return
+    for change in (record['changes'] if record['op'] == 'bulk' else [record]):
+        row = change.get('row')
+        yield (change['id'] if 'id' in change else row[ID_COLUMN]), (row[VERSION_COLUMN] if row else None)
+
+
+def table_from_rows(rows: List[Dict[str, Any]]) -> TableColumns:
+    return TableColumns.from_rows(SNAPSHOT_SCHEMA, rows, INTERNED_COLUMNS)
+
+
+def bulk_changes(frame: pd.DataFrame, ids: np.ndarray, versions: np.ndarray) -> Dict[str, Any]:
+    """The body of a planned bulk record, for ``TableStore.prepare_bulk``.
+
+    ``changes`` are the per-row changes that are logged and broadcast.
+    ``_rows`` (the same rows as columns) and ``_keys`` (the sorted index
+    keys of the inserted ones) let ``apply`` merge them in whole; they are
+    never logged.
+    Only reads its arguments, so it runs on the thread pool.
+    """
+    columns = {ID_COLUMN: ids, VERSION_COLUMN: versions}
+    for column in COLUMNS:
+        columns[column] = frame[column].to_numpy() if column in NUMERIC_COLUMNS else frame[column].tolist()
+    rows = TableColumns.from_columns(SNAPSHOT_SCHEMA, columns, INTERNED_COLUMNS)
+    updated = frame[ID_COLUMN].notna().to_numpy()
+    changes = [{'op': 'update', 'id': row[ID_COLUMN], 'row': row} if row_updated else {'op': 'add', 'row': row}
+               for row, row_updated in zip(rows.rows(), updated.tolist())]
+    keys = TableIndex.sorted_keys(rows.take(np.flatnonzero(~updated)))
+    return {'changes': changes, '_rows': rows, '_keys': keys}
+
+
+def to_csv(table: TableColumns, header: bool = True) -> bytes:
+    """The table as CSV, ``id`` and ``version`` first."""
+    return table.to_frame().to_csv(index=False, header=header).encode('utf-8')
+
+
+def _present(values: pd.Series) -> pd.Series:
+    """Cells that hold a value (not missing and not blank)."""
+    return values.notna() & (values.astype(str).str.strip() != "")
+
+
+def normalize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Vectorized ``normalize_row`` for bulk input, with strict checks.
+
+    Returns ``id`` and ``version`` as nullable integers followed by the table
+    columns.  Missing or blank cells take the usual defaults, but numbers,
+    ids and versions that do not parse (or are infinite) are reported as a
+    ``BulkValidationError`` instead of being zeroed.
+    """
+    df = df.reset_index(drop=True)
+    out = pd.DataFrame(index=df.index)
+    errors = []
+
+    def report(column: str, bad: pd.Series, expected: str):
+        for position in bad[bad].index[:MAX_REPORTED_ERRORS]:
+            value = df.at[position, column]
+            value = value.item() if hasattr(value, 'item') else value  # numpy scalar -> Python
+            errors.append(f"row {position + 1}: {column} must be {expected} (got {value!r})")
+        if bad.sum() > MAX_REPORTED_ERRORS:
+            errors.append(f"{column}: {bad.sum() - MAX_REPORTED_ERRORS} more")
+
+    for column in (ID_COLUMN, VERSION_COLUMN):
+        if column not in df.columns:
+            out[column] = pd.array([pd.NA] * len(df), dtype='Int64')
+            continue
+        values = pd.to_numeric(df[column], errors='coerce')
+        bad = _present(df[column]) & (values.isna() | (values % 1 != 0) | (values < 1))
+        report(column, bad, "a positive integer")
+        out[column] = values.where(~bad).astype('Int64')
+    for column in TEXT_COLUMNS:
+        out[column] = df[column].fillna("").astype(str) if column in df.columns else ""
+    for column in NUMERIC_COLUMNS:
+        if column not in df.columns:
+            out[column] = 0.0
+            continue
+        values = pd.to_numeric(df[column], errors='coerce')
+        bad = _present(df[column]) & values.isna()
+        report(column, bad, "a number")
+        infinite = values.isin([math.inf, -math.inf])
+        report(column, infinite, "a finite number")
+        out[column] = values.where(~infinite).fillna(0.0).astype(float)
+
+    duplicated = out[ID_COLUMN].notna() & out[ID_COLUMN].duplicated(keep=False)
+    report(ID_COLUMN, duplicated, "unique within the upload")
+    if errors:
+        raise BulkValidationError(errors)
+    return out
+
+
+class TableStore:
+    """Authoritative in-memory copy of the broker table.
+
+    The snapshot is read once by ``load`` and afterwards only written by
+    compaction.  Every mutation is first appended to the mutation log and
+    then applied in memory, so a single-row change costs one small fsynced
+    write instead of a full snapshot rewrite.
+
+    ``seq`` is the sequence number of the last applied mutation and doubles
+    as the table version.
+
+    Snapshots are written in ``snapshot_format``.  The columnar format is
+    memory-mapped on load and its columns copied whole, without the CSV
+    parser; a CSV at ``import_path`` seeds the table when there is no
+    snapshot yet.
+
+    Every row carries a stable ``id`` that is never reused and a ``version``
+    that starts at 1 and is bumped by every update, for optimistic
+    concurrency (``expected_version``).  Rows are held as typed columns
+    (``TableColumns``) with one slot per row in table order; a delete
+    leaves a cleared slot instead of shifting later rows, so the id -> slot
+    map stays valid and lookups, updates and deletes by id are O(1).  Row
+    dicts are only built for the rows a caller asks for, and the full
+    table is serialized straight from the columns (``to_json``).
+
+    ``index`` (column indexes for paged queries) and ``aggregates``
+    (running totals) are built on first use; every applied change keeps
+    them up to date.
+
+    ``prepare_reset`` replaces every row at once (a restore).  Between it
+    and the reset being applied, other writes raise RestoreInProgressError,
+    so nothing prepared against the old rows lands on the new ones.  A
+    reset is made durable by writing a snapshot rather than a log record.
+
+    ``prepare_bulk`` turns many inserts and updates into a single ``bulk``
+    record, so they are logged, replayed and versioned as one mutation.
+    Its rows are built off the event loop (``bulk_changes``) and applied
+    column by column, with one merge into the index and aggregates.
+
+    Writers (the ``WriteBatcher``) use the ``prepare_*`` methods, which
+    validate the change and reserve its sequence number (and row id), then
+    call ``apply`` once the record is durable (or ``discard`` if it never
+    will be).  Records must be applied in sequence order, and callers
+    serialize changes to the same row.  Until a record is applied, the rows
+    it touches are checked against it rather than the applied rows, so a
+    write prepared behind a pending delete is refused instead of failing
+    when it is applied.
+    """
+
+    def __init__(self, path: str, log_path: Optional[str] = None, archive_dir: Optional[str] = None,
+                 snapshot_format: str = 'csv', import_path: Optional[str] = None):
+        if snapshot_format not in SNAPSHOT_FORMATS:
+            raise ValueError(f"Unknown snapshot format: {snapshot_format} (expected one of {', '.join(SNAPSHOT_FORMATS)})")
+        self.path = path
+        self.snapshot_format = snapshot_format
+        self.import_path = import_path
+        self.meta_path = f"{path}.meta.json"
+        self.log = MutationLog(log_path or f"{path}.log")
+        self.archive_dir = archive_dir  # where compacted log segments go instead of being deleted
+        self._table = table_from_rows([])
+        self._positions: Dict[int, int] = {}  # row id -> slot
+        self.next_id = 1
+        self.seq = 0
+        self._reserved_seq = 0  # highest seq handed out by prepare_*
+        self._pending_reset: Optional[int] = None  # seq of a prepared, unapplied reset
+        self._pending: Dict[int, Tuple[int, Optional[int]]] = {}  # row id -> (seq, version) of an unapplied write
+        self.snapshot_seq = 0
+        self.snapshot_hash: Optional[str] = None
+        self.loaded_hash: Optional[str] = None  # hash of the snapshot read at startup; compaction keeps it
+        self.loaded = False
+        self._json: Optional[str] = None  # the table as JSON, until the next mutation
+        self._index: Optional[TableIndex] = None  # built on first query
+        self._aggregates: Optional[TableAggregates] = None  # built on first read
+
+    def _read_meta(self, path: Optional[str] = None) -> Dict[str, Any]:
+        try:
+            with open(path or self.meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, meta: Dict[str, Any]):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.meta_path)
+
+    def _parse(self, data: bytes) -> TableColumns:
+        if len(data) == 0:
+            # An empty file (e.g. a truncated CSV) is an empty table, not a parse error
+            return table_from_rows([])
+        if is_columnar(data):
+            return TableColumns.from_columns(SNAPSHOT_SCHEMA, decode_columns(data), INTERNED_COLUMNS)
+        df = pd.read_csv(io.BytesIO(data), float_precision='round_trip')
+        for column in COLUMNS:
+            if column not in df.columns:
+                df[column] = 0.0 if column in NUMERIC_COLUMNS else ""
+        if ID_COLUMN in df.columns:
+            ids = pd.to_numeric(df[ID_COLUMN], errors='coerce').tolist()
+        else:
+            ids = [None] * len(df)
+        if VERSION_COLUMN in df.columns:
+            versions = pd.to_numeric(df[VERSION_COLUMN], errors='coerce').fillna(1).astype(int).tolist()
+        else:
+            versions = [1] * len(df)
+
+        # CSVs written before rows had ids (or edited by hand) get fresh ones
+        known = [int(row_id) for row_id in ids if row_id is not None and row_id == row_id]
+        next_id = max(known, default=0) + 1
+        rows, seen = [], set()
+        for row_id, version, entry in zip(ids, versions, df[COLUMNS].to_dict('records')):
+            if row_id is None or row_id != row_id or int(row_id) in seen:
+                row_id = next_id
+                next_id += 1
+            row_id = int(row_id)
+            seen.add(row_id)
+            rows.append({ID_COLUMN: row_id, VERSION_COLUMN: version, **normalize_row(entry)})
+        return table_from_rows(rows)
+
+    def _serialize(self, table: TableColumns) -> bytes:
+        if self.snapshot_format == 'columnar':
+            return encode_columns(SNAPSHOT_SCHEMA, table.columns())
+        return to_csv(table)
+
+    def _read_snapshot(self, path: str) -> Tuple[str, TableColumns]:
+        """Content hash and rows of a snapshot file, read through a memory map."""
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return hashlib.sha256(b'').hexdigest(), self._parse(b'')
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return hashlib.sha256(data).hexdigest(), self._parse(data)
+
+    def _set_table(self, table: TableColumns):
+        """Take ``table`` (compact) as the current rows; it is not copied."""
+        self._table = table
+        self._positions = {row_id: slot for slot, row_id in enumerate(table.values(ID_COLUMN))}
+        self.next_id = max(self.next_id, max(self._positions, default=0) + 1)
+        self._json = None
+
+    def _compact_slots(self):
+        """Drop cleared slots; only slot numbers change, never row ids."""
+        self._set_table(self._table.take())
+
+    def load(self):
+        """Read the snapshot and replay the mutation log (called once at startup).
+
+        Without a snapshot at ``path`` the table is imported from
+        ``import_path`` together with that file's meta, and written back
+        in ``snapshot_format`` before the log is replayed.
+        """
+        source = self.path
+        if self.import_path and not os.path.exists(self.path):
+            source = self.import_path
+        content_hash, table = self._read_snapshot(source)
+        self._set_table(table)
+        self._index = self._aggregates = None
+
+        # The meta file records which snapshot content corresponds to which
+        # sequence number; "previous" covers a crash between writing the
+        # meta file and renaming the new snapshot into place.
+        meta = self._read_meta(f"{source}.meta.json")
+        previous = meta.get('previous') or {}
+        self.next_id = max(self.next_id, meta.get('next_id', 1))
+        if meta.get('sha256') == content_hash:
+            self.snapshot_seq = meta['seq']
+        elif previous.get('sha256') == content_hash:
+            self.snapshot_seq = previous['seq']
+        else:
+            self.snapshot_seq = meta.get('seq', 0)
+            if meta:
+                print(f"{source} was changed outside the server; discarding its mutation log")
+                self.log.discard()
+        self.snapshot_hash = self.loaded_hash = content_hash
+        self.seq = self.snapshot_seq
+        if source != self.path:
+            print(f"Importing {source} into {self.path}")
+            self.write_snapshot(self.columns(), self.seq)
+
+        replayed = 0
+        for record in self.log.read(after_seq=self.snapshot_seq, repair=True):
+            self.apply(record)
+            replayed += 1
+        self.log.records = replayed
+        self.log.last_seq = self.seq
+        self._reserved_seq = self.seq
+        self.log.open()
+        self.loaded = True
+        print(f"Loaded {len(self)} rows from {self.path} (replayed {replayed} mutations, seq {self.seq})")
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def records(self) -> List[Dict[str, Any]]:
+        """Return the table as a new list of row dicts (built from the columns on every call)."""
+        return self._table.rows()
+
+    def columns(self) -> TableColumns:
+        """A compact copy of the current rows, safe to hand to another thread."""
+        return self._table.take()
+
+    def to_json(self) -> str:
+        """The table as a JSON array of rows, cached until the next mutation."""
+        if self._json is None:
+            self._json = self._table.to_json()
+        return self._json
+
+    def index(self) -> TableIndex:
+        """Column indexes over the current rows, built on first use."""
+        if self._index is None:
+            self._index = TableIndex(self._table, self.get, self.field)
+        return self._index
+
+    def aggregates(self) -> TableAggregates:
+        """Running totals over the current rows, built on first use."""
+        if self._aggregates is None:
+            aggregates = TableAggregates([])
+            if self._table.count:
+                aggregates.add_many(self._table.columns())
+            self._aggregates = aggregates
+        return self._aggregates
+
+    def _slot(self, row_id: int) -> int:
+        slot = self._positions.get(row_id)
+        if slot is None:
+            raise RowNotFoundError(f"Row not found: {row_id}")
+        return slot
+
+    def get(self, row_id: int) -> Dict[str, Any]:
+        """The row as a dict; a new dict on every call."""
+        return self._table.row(self._slot(row_id))
+
+    def field(self, row_id: int, column: str) -> Any:
+        """One value of a row, without building the row."""
+        return self._table.value(self._slot(row_id), column)
+
+    def version(self, row_id: int) -> int:
+        """The row's version, counting prepared writes that are not applied yet."""
+        pending = self._pending.get(row_id)
+        if pending is None:
+            return self.field(row_id, VERSION_COLUMN)
+        if pending[1] is None:
+            raise RowNotFoundError(f"Row not found: {row_id}")
+        return pending[1]
+
+    def versions(self, row_ids: List[int]) -> np.ndarray:
+        """``version`` of many rows at once; every row must exist."""
+        if self._pending and any(row_id in self._pending for row_id in row_ids):
+            return np.array([self.version(row_id) for row_id in row_ids], dtype=np.int64)
+        slots = np.fromiter(map(self._positions.__getitem__, row_ids), dtype=np.int64, count=len(row_ids))
+        return self._table.data[VERSION_COLUMN][slots]
+
+    def check_id(self, row_id: int, expected_version: Optional[int] = None):
+        """Raise unless the row exists (and is at ``expected_version``, if given)."""
+        version = self.version(row_id)
+        if expected_version is not None and version != expected_version:
+            raise VersionConflictError(row_id, expected_version, version)
+
+    def apply(self, record: Dict[str, Any]):
+        """Apply a durable mutation record in memory."""
+        if record['op'] == 'reset':
+            # The record's table is also kept as a backup, so it is copied rather than taken over
+            self._set_table(record['table'].take())
+            self._index = self._aggregates = None
+            if self._pending_reset == record['seq']:
+                self._pending_reset = None
+        elif record['op'] == 'bulk':
+            rows = record.get('_rows')
+            if rows is None:
+                # Replayed from the log, which only has the per-row changes
+                rows = table_from_rows([change['row'] for change in record['changes']])
+            self._apply_rows(rows, record.get('_keys'))
+        else:
+            self._apply_change(record)
+        self.seq = record['seq']
+        self._json = None
+        self._settle(record)
+
+    def _apply_change(self, record: Dict[str, Any]):
+        op = record['op']
+        if 'index' in record:
+            # Logged before rows had ids: resolve the position against the current rows
+            slot = self._table.live_slots()[record['index']]
+            record = {**record, 'id': self._table.value(slot, ID_COLUMN)}
+        # Older records may lack the id/version fields; the defaults fill them in
+        if op == 'add':
+            row = {ID_COLUMN: self.next_id, VERSION_COLUMN: 1, **record['row']}
+            self._positions[row[ID_COLUMN]] = self._table.append(row)
+            self.next_id = max(self.next_id, row[ID_COLUMN] + 1)
+            self._track(None, row)
+        elif op == 'update':
+            slot = self._positions[record['id']]
+            old = self._table.row(slot)
+            row = {ID_COLUMN: record['id'], VERSION_COLUMN: old[VERSION_COLUMN] + 1, **record['row']}
+            self._table.set(slot, row)
+            self._track(old, row)
+        elif op == 'delete':
+            slot = self._positions.pop(record['id'])
+            self._track(self._table.row(slot), None)
+            self._table.clear(slot)
+            cleared = self._table.size - len(self._positions)
+            if cleared >= MIN_TOMBSTONES_TO_COMPACT and cleared > len(self._positions):
+                self._compact_slots()
+        else:
+            raise ValueError(f"Unknown mutation: {op}")
+
+    def _apply_rows(self, rows: TableColumns, keys: Optional[Dict[str, list]] = None):
+        """Insert or update (by id) every row of ``rows`` column by column.
+
+        ``keys`` are the sorted index keys of the rows that are inserted.
+        """
+        ids = rows.values(ID_COLUMN)
+        slots = np.fromiter(map(self._positions.get, ids, [-1] * len(ids)), dtype=np.int64, count=len(ids))
+        updated = slots >= 0
+        old = self._table.take(slots[updated])
+        self._table.set_many(slots[updated], rows, np.flatnonzero(updated))
+        inserted = rows.take(np.flatnonzero(~updated))
+        if keys is not None and len(keys[ID_COLUMN]) != inserted.count:
+            keys = None
+        start = self._table.extend(inserted)
+        inserted_ids = inserted.values(ID_COLUMN)
+        self._positions.update(zip(inserted_ids, range(start, start + len(inserted_ids))))
+        self.next_id = max(self.next_id, max(inserted_ids, default=0) + 1)
+        if self._index is None and self._aggregates is None:
+            return
+        new = rows.take(np.flatnonzero(updated))
+        if self._index is not None:
+            self._index.update_many(old, new)
+            self._index.add_many(inserted, keys)
+        if self._aggregates is not None:
+            self._aggregates.update_many(old.columns(), new.columns())
+            if inserted.count:
+                self._aggregates.add_many(inserted.columns())
+
+    def _track(self, old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]):
+        """Move the index and aggregates (where built) from ``old`` to ``new``."""
+        if self._index is not None:
+            if old is not None:
+                self._index.remove(old)
+            if new is not None:
+                self._index.add(new)
+        if self._aggregates is not None:
+            if old is not None:
+                self._aggregates.remove(old)
+            if new is not None:
+                self._aggregates.add(new)
+
+    def _reserve(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        if self._pending_reset is not None:
+            raise RestoreInProgressError("The table is being restored; try again shortly")
+        self._reserved_seq = max(self._reserved_seq, self.seq) + 1
+        record = {'seq': self._reserved_seq, **record}
+        for row_id, version in touched_rows(record):
+            self._pending[row_id] = (record['seq'], version)
+        return record
+
+    def _settle(self, record: Dict[str, Any]):
+        """Stop checking rows against ``record`` once it is applied or discarded."""
+        if not self._pending:
+            return
+        for row_id, _ in touched_rows(record):
+            pending = self._pending.get(row_id)
+            if pending is not None and pending[0] == record['seq']:
+                del self._pending[row_id]
+
+    def _row_ids(self) -> List[int]:
+        """Ids of the rows that exist once every prepared write is applied."""
+        if not self._pending:
+            return list(self._positions)
+        ids = set(self._positions)
+        for row_id, (_, version) in self._pending.items():
+            if version is None:
+                ids.discard(row_id)
+            else:
+                ids.add(row_id)
+        return list(ids)
+
+    def prepare_append(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        row_id = self.next_id
+        self.next_id += 1
+        row = {ID_COLUMN: row_id, VERSION_COLUMN: 1, **normalize_row(entry)}
+        return self._reserve({'op': 'add', 'row': row})
+
+    def prepare_update(self, row_id: int, entry: Dict[str, Any],
+                       expected_version: Optional[int] = None) -> Dict[str, Any]:
+        self.check_id(row_id, expected_version)
+        version = self.version(row_id) + 1
+        row = {ID_COLUMN: row_id, VERSION_COLUMN: version, **normalize_row(entry)}
+        return self._reserve({'op': 'update', 'id': row_id, 'row': row})
+
+    def prepare_delete(self, row_id: int, expected_version: Optional[int] = None) -> Dict[str, Any]:
+        self.check_id(row_id, expected_version)
+        return self._reserve({'op': 'delete', 'id': row_id})
+
+    def plan_bulk(self, frame: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """Check bulk input against the rows; returns each row's id and new version.
+
+        ``frame`` comes from ``normalize_frame``.  Rows with an id must
+        exist, and a ``version`` given with one must match the row's
+        current version.  Rows without an id get fresh ids, reserved here.
+        Pass the result to ``bulk_changes`` and then ``prepare_bulk``.
+        """
+        ids = frame[ID_COLUMN]
+        given = ids.notna()
+        unknown = given & ~ids.isin(self._row_ids())
+        if unknown.any():
+            raise BulkValidationError([f"row {position + 1}: no row with id {ids[position]}"
+                                       for position in unknown[unknown].index])
+        updated = ids[given].to_numpy(dtype=np.int64)
+        current = self.versions(updated.tolist())
+        expected = frame[VERSION_COLUMN][given].to_numpy(dtype=np.float64, na_value=np.nan)
+        conflicts = np.flatnonzero(~np.isnan(expected) & (expected != current))
+        if len(conflicts):
+            position = conflicts[0]
+            raise VersionConflictError(int(updated[position]), int(expected[position]), int(current[position]))
+
+        row_ids = np.empty(len(frame), dtype=np.int64)
+        versions = np.ones(len(frame), dtype=np.int64)
+        row_ids[given.to_numpy()] = updated
+        versions[given.to_numpy()] = current + 1
+        inserted = len(frame) - len(updated)
+        row_ids[~given.to_numpy()] = np.arange(self.next_id, self.next_id + inserted)
+        self.next_id += inserted
+        return row_ids, versions
+
+    def prepare_bulk(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Prepare one record inserting and updating rows; ``body`` comes from ``bulk_changes``."""
+        return self._reserve({'op': 'bulk', **body})
+
+    def prepare_reset(self, table: TableColumns) -> Dict[str, Any]:
+        """Prepare a record replacing the whole table with ``table`` (from a backup).
+
+        ``table`` becomes the record's ``table``; ``settle_reset`` must
+        give it its row versions before it is made durable.
+        """
+        record = self._reserve({'op': 'reset', 'table': table})
+        self._pending_reset = record['seq']
+        return record
+
+    def settle_reset(self, record: Dict[str, Any]):
+        """Give the restored rows versions above any they have had.
+
+        Called once every write ordered before the reset has been applied,
+        so versions handed out by writes still in flight when the restore
+        was prepared are covered too, and an edit based on any version from
+        before the restore is refused.  Updates the table in place.
+        """
+        table = record['table']
+        slots = np.array([self._positions.get(row_id, -1) for row_id in table.values(ID_COLUMN)], dtype=np.int64)
+        known = slots >= 0
+        current = np.zeros(len(slots), dtype=np.int64)
+        current[known] = self._table.data[VERSION_COLUMN][slots[known]]
+        versions = table.data[VERSION_COLUMN]
+        versions[:table.size] = np.maximum(versions[:table.size], current) + 1
+
+    def abort_reset(self, record: Dict[str, Any]):
+        """Allow writes again after a prepared reset failed to be logged."""
+        if self._pending_reset == record['seq']:
+            self._pending_reset = None
+
+    def discard(self, record: Dict[str, Any]):
+        """Forget a prepared record that will never be applied (its log write failed)."""
+        self.abort_reset(record)
+        self._settle(record)
+
+    def needs_compaction(self) -> bool:
+        return self.seq != self.snapshot_seq
+
+    def begin_compaction(self) -> Tuple[TableColumns, int]:
+        """Freeze the current rows for ``write_snapshot``.
+
+        Returns a copy of the rows and the sequence number they reflect.  The caller
+        rotates the log on whichever thread writes it; segments are named by
+        the last seq they hold, so records logged after this point are never
+        dropped by the snapshot.
+        """
+        return self.columns(), self.seq
+
+    def load_bytes(self, data: bytes, seq: int):
+        """Load rows from snapshot contents without touching any file (used to replay backups)."""
+        self.load_table(self._parse(data), seq)
+
+    def load_table(self, table: TableColumns, seq: int):
+        """Start from already parsed rows at ``seq``; ``table`` itself is left untouched."""
+        self._set_table(table.take())
+        self._index = self._aggregates = None
+        self.seq = self.snapshot_seq = self._reserved_seq = seq
+        self.loaded = True
+
+    def write_snapshot(self, table: TableColumns, seq: int) -> Optional[bytes]:
+        """Write ``table`` as the snapshot for ``seq`` and drop covered log segments.
+
+        Returns the snapshot contents, or None if a newer snapshot (from a
+        restore) is already on disk.  Safe to run in a worker thread: it
+        only touches the files.
+        """
+        if seq < self.snapshot_seq:
+            return None
+        data = self._serialize(table)
+        content_hash = hashlib.sha256(data).hexdigest()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._write_meta({
+            'seq': seq,
+            'sha256': content_hash,
+            'next_id': self.next_id,
+            'previous': {'seq': self.snapshot_seq, 'sha256': self.snapshot_hash}
+        })
+        os.replace(tmp_path, self.path)
+        self.snapshot_seq = seq
+        self.snapshot_hash = content_hash
+        self.log.drop_segments(seq, self.archive_dir)
+        return data
@@ -0,0 +1,448 @@
+import os
+import math
+from array import array
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional, List, Tuple, Dict, Any
+from database import read_connection, write_connection
+
+# How often buffered numbers are committed to SQLite
+NUMBERS_COMMIT_INTERVAL_SECONDS = float(os.getenv('NUMBERS_COMMIT_INTERVAL_SECONDS', 5))
+
+# Retention: raw ticks, then 1-minute and 1-hour OHLC rollups (0 keeps forever)
+NUMBERS_RAW_RETENTION_HOURS = float(os.getenv('NUMBERS_RAW_RETENTION_HOURS', 24))
+NUMBERS_MINUTE_RETENTION_DAYS = float(os.getenv('NUMBERS_MINUTE_RETENTION_DAYS', 30))
+NUMBERS_HOUR_RETENTION_DAYS = float(os.getenv('NUMBERS_HOUR_RETENTION_DAYS', 0))
+RETENTION_CHECK_SECONDS = 60
+
+MINUTE_MS = 60 * 1000
+HOUR_MS = 60 * MINUTE_MS
+DAY_MS = 24 * HOUR_MS
+
+# Rollup tables keyed by bucket width
+ROLLUP_TABLES = {
+    MINUTE_MS: "random_numbers_1m",
+    HOUR_MS: "random_numbers_1h",
+}
+
+# History queries: resolution name -> (table, bucket width, retention in ms)
+RESOLUTIONS = {
+    "raw": ("random_numbers", 1000, NUMBERS_RAW_RETENTION_HOURS * HOUR_MS),
+    "1m": (ROLLUP_TABLES[MINUTE_MS], MINUTE_MS, NUMBERS_MINUTE_RETENTION_DAYS * DAY_MS),
+    "1h": (ROLLUP_TABLES[HOUR_MS], HOUR_MS, NUMBERS_HOUR_RETENTION_DAYS * DAY_MS),
+}
+DOWNSAMPLE_METHODS = ("lttb", "buckets")
+NUMBERS_MAX_POINTS = int(os.getenv('NUMBERS_MAX_POINTS', 2000))
+NUMBERS_DEFAULT_POINTS = 500
+MAX_SCAN_ROWS = 50000  # "auto" picks the finest resolution that stays under this
+
+# Recent ticks kept in memory (one per second, so the default is an hour)
+NUMBERS_BUFFER_SIZE = int(os.getenv('NUMBERS_BUFFER_SIZE', 3600))
+
+_STOP = object()
+
+
+def _create_tables(conn: sqlite3.Connection):
+    # ts_ms is the rowid, so time-range scans walk the table in key order
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS random_numbers (
+        ts_ms INTEGER PRIMARY KEY,
+        value REAL NOT NULL
+    )""")
+    for table in ROLLUP_TABLES.values():
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            bucket_ms INTEGER PRIMARY KEY,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            count INTEGER NOT NULL,
+            sum REAL NOT NULL
+        )""")
+
+
+def _rebuild_rollups(conn: sqlite3.Connection, since_ms: int = 0):
+    """Recompute rollup buckets from the raw table.
+
+    Only buckets starting at or after ``since_ms`` (rounded up to the bucket
+    width) are rebuilt, so a bucket whose early ticks were already dropped
+    by retention is left alone.
+    """
+    for width, table in ROLLUP_TABLES.items():
+        first_bucket = -(-since_ms // width) * width
+        conn.execute(f"""
+        INSERT OR REPLACE INTO {table} (bucket_ms, open, high, low, close, count, sum)
+        SELECT b.bucket_ms,
+               (SELECT value FROM random_numbers WHERE ts_ms = b.first_ts),
+               b.high, b.low,
+               (SELECT value FROM random_numbers WHERE ts_ms = b.last_ts),
+               b.count, b.sum
+        FROM (
+            SELECT ts_ms / {width} * {width} AS bucket_ms,
+                   MIN(ts_ms) AS first_ts, MAX(ts_ms) AS last_ts,
+                   MAX(value) AS high, MIN(value) AS low,
+                   COUNT(*) AS count, SUM(value) AS sum
+            FROM random_numbers
+            WHERE ts_ms >= ?
+            GROUP BY bucket_ms
+        ) AS b""", (first_bucket,))
+
+
+def _add_rollup_sums(conn: sqlite3.Connection):
+    """Add the ``sum`` column to rollups created before averages were queryable."""
+    added = False
+    for table in ROLLUP_TABLES.values():
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if 'sum' not in columns:
+            # Buckets whose ticks are gone can only be approximated
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN sum REAL NOT NULL DEFAULT 0")
+            conn.execute(f"UPDATE {table} SET sum = (open + high + low + close) / 4.0 * count")
+            added = True
+    if added:
+        oldest = conn.execute("SELECT MIN(ts_ms) FROM random_numbers").fetchone()[0]
+        if oldest is not None:
+            _rebuild_rollups(conn, since_ms=oldest)
+
+
+def _migrate_legacy_table(conn: sqlite3.Connection) -> bool:
+    """Convert the old ISO-text keyed random_numbers table, if present."""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(random_numbers)")]
+    if 'timestamp' not in columns:
+        return False
+    print("Migrating random_numbers to the epoch-millisecond schema")
+    conn.execute("BEGIN")
+    conn.execute("ALTER TABLE random_numbers RENAME TO random_numbers_legacy")
+    _create_tables(conn)
+    conn.execute("""
+    INSERT OR IGNORE INTO random_numbers (ts_ms, value)
+    SELECT CAST(ROUND((julianday(timestamp) - 2440587.5) * 86400000) AS INTEGER),
+           CAST(value AS REAL)
+    FROM random_numbers_legacy
+    WHERE julianday(timestamp) IS NOT NULL""")
+    _rebuild_rollups(conn)
+    conn.execute("DROP TABLE random_numbers_legacy")
+    return True
+
+
+def init_timeseries():
+    """Create (or migrate) the random number tables, apply retention and seed the tick buffer."""
+    with write_connection() as conn:
+        if not _migrate_legacy_table(conn):
+            _create_tables(conn)
+            _add_rollup_sums(conn)
+    apply_retention()
+    _load_recent_numbers()
+
+
+def apply_retention(now_ms: Optional[int] = None):
+    """Drop raw ticks and rollups that are older than their retention window."""
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+    limits = [
+        ("random_numbers", "ts_ms", NUMBERS_RAW_RETENTION_HOURS * HOUR_MS),
+        (ROLLUP_TABLES[MINUTE_MS], "bucket_ms", NUMBERS_MINUTE_RETENTION_DAYS * DAY_MS),
+        (ROLLUP_TABLES[HOUR_MS], "bucket_ms", NUMBERS_HOUR_RETENTION_DAYS * DAY_MS),
+    ]
+    with write_connection() as conn:
+        for table, column, window_ms in limits:
+            if window_ms > 0:
+                conn.execute(f"DELETE FROM {table} WHERE {column} < ?", (int(now_ms - window_ms),))
+
+
+def _rollup(batch: List[Tuple[int, float]], width: int) -> List[tuple]:
+    """Fold a time-ordered batch into (bucket, open, high, low, close, count, sum) rows."""
+    buckets = []
+    for ts_ms, value in batch:
+        bucket = ts_ms // width * width
+        if buckets and buckets[-1][0] == bucket:
+            _, open_, high, low, _, count, total = buckets[-1]
+            buckets[-1] = (bucket, open_, max(high, value), min(low, value), value, count + 1, total + value)
+        else:
+            buckets.append((bucket, value, value, value, value, 1, value))
+    return buckets
+
+
+def lttb(points: List[Tuple[int, float]], threshold: int) -> List[Tuple[int, float]]:
+    """Largest-Triangle-Three-Buckets downsampling of time-ordered (ts, value) points."""
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return points
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = sum(p[0] for p in points[avg_start:avg_end]) / (avg_end - avg_start)
+        avg_y = sum(p[1] for p in points[avg_start:avg_end]) / (avg_end - avg_start)
+
+        ax, ay = points[a]
+        best, best_area = None, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+
+def bucket_downsample(rows: List[tuple], from_ms: int, width: int) -> List[Dict[str, Any]]:
+    """Aggregate (ts, low, high, sum, count, last) rows into min/max/avg/last buckets."""
+    buckets = []
+    for ts_ms, low, high, total, count, last in rows:
+        start = from_ms + (ts_ms - from_ms) // width * width
+        if buckets and buckets[-1]["timestamp"] == start:
+            bucket = buckets[-1]
+            bucket["min"] = min(bucket["min"], low)
+            bucket["max"] = max(bucket["max"], high)
+            bucket["sum"] += total
+            bucket["count"] += count
+            bucket["last"] = last
+        else:
+            buckets.append({"timestamp": start, "min": low, "max": high,
+                            "sum": total, "count": count, "last": last})
+    return [{
+        "timestamp": b["timestamp"],
+        "min": b["min"],
+        "max": b["max"],
+        "avg": b["sum"] / b["count"] if b["count"] else None,
+        "last": b["last"],
+        "count": b["count"]
+    } for b in buckets]
+
+
+def _pick_resolution(from_ms: int, to_ms: int, now_ms: int) -> str:
+    """Finest resolution that still holds ``from_ms`` and keeps the scan small."""
+    for name, (_, width, retention_ms) in RESOLUTIONS.items():
+        covers = retention_ms <= 0 or from_ms >= now_ms - retention_ms
+        if covers and (to_ms - from_ms) / width <= MAX_SCAN_ROWS:
+            return name
+    return "1h"
+
+
+def _fetch_rows(resolution: str, from_ms: int, to_ms: int) -> List[tuple]:
+    """Rows as (ts, low, high, sum, count, last) for a half-open [from, to) range."""
+    table, width, _ = RESOLUTIONS[resolution]
+    with read_connection() as conn:
+        if resolution == "raw":
+            cursor = conn.execute(
+                "SELECT ts_ms, value FROM random_numbers WHERE ts_ms >= ? AND ts_ms < ? ORDER BY ts_ms",
+                (from_ms, to_ms)
+            )
+            return [(ts, v, v, v, 1, v) for ts, v in cursor]
+        cursor = conn.execute(
+            f"SELECT bucket_ms, low, high, sum, count, close FROM {table} "
+            "WHERE bucket_ms >= ? AND bucket_ms < ? ORDER BY bucket_ms",
+            (from_ms // width * width, to_ms)
+        )
+        return cursor.fetchall()
+
+
+def query_numbers(from_ms: Optional[int] = None, to_ms: Optional[int] = None,
+                  resolution: str = "auto", downsample: str = "lttb",
+                  max_points: int = NUMBERS_DEFAULT_POINTS) -> Dict[str, Any]:
+    """Number history for [from_ms, to_ms), downsampled to at most ``max_points``.
+
+    ``downsample="lttb"`` returns shape-preserving {timestamp, value} points;
+    ``"buckets"`` returns {timestamp, min, max, avg, last, count} per bucket.
+    Raises ValueError for invalid arguments.
+    """
+    if resolution != "auto" and resolution not in RESOLUTIONS:
+        raise ValueError(f"resolution must be one of: auto, {', '.join(RESOLUTIONS)}")
+    if downsample not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"downsample must be one of: {', '.join(DOWNSAMPLE_METHODS)}")
+    max_points = max(3, min(max_points, NUMBERS_MAX_POINTS))
+
+    now_ms = int(time.time() * 1000)
+    to_ms = to_ms if to_ms is not None else now_ms + 1
+    from_ms = from_ms if from_ms is not None else to_ms - HOUR_MS
+    if from_ms >= to_ms:
+        raise ValueError("'from' must be earlier than 'to'")
+    if resolution == "auto":
+        resolution = _pick_resolution(from_ms, to_ms, now_ms)
+
+    if resolution == "raw" and recent_numbers.covers(from_ms):
+        rows = [(ts, v, v, v, 1, v) for ts, v in recent_numbers.between(from_ms, to_ms)]
+    else:
+        rows = _fetch_rows(resolution, from_ms, to_ms)
+    if downsample == "buckets":
+        # Bucket edges stay aligned to the source resolution
+        source_width = RESOLUTIONS[resolution][1]
+        width = max(1, math.ceil((to_ms - from_ms) / max_points / source_width)) * source_width
+        points = bucket_downsample(rows, from_ms // source_width * source_width, width)
+    else:
+        sampled = lttb([(row[0], row[5]) for row in rows], max_points)
+        points = [{"timestamp": ts, "value": value} for ts, value in sampled]
+    return {
+        "from": from_ms,
+        "to": to_ms,
+        "resolution": resolution,
+        "downsample": downsample,
+        "count": len(points),
+        "points": points
+    }
+
+
+def latest_numbers(limit: int = 100) -> List[Dict[str, Any]]:
+    """The most recent raw ticks, oldest first, served from memory."""
+    return [{"timestamp": ts, "value": value} for ts, value in recent_numbers.latest(limit)]
+
+
+class TickBuffer:
+    """Fixed-size ring of the most recent (ts_ms, value) ticks.
+
+    Timestamps and values live in two preallocated ``array`` buffers, so
+    appending a tick never allocates.  ``generate_numbers`` appends on the
+    event loop while threadpool routes read, hence the small lock.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self._ts = array('q', bytes(8 * self.capacity))
+        self._values = array('d', bytes(8 * self.capacity))
+        self._next = 0  # slot the next tick goes into
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, ts_ms: int, value: float):
+        with self._lock:
+            self._ts[self._next] = ts_ms
+            self._values[self._next] = value
+            self._next = (self._next + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def latest(self, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Up to ``limit`` most recent ticks, oldest first."""
+        with self._lock:
+            count = self._size if limit is None else max(0, min(limit, self._size))
+            start = (self._next - count) % self.capacity
+            return [(self._ts[i % self.capacity], self._values[i % self.capacity])
+                    for i in range(start, start + count)]
+
+    def between(self, from_ms: int, to_ms: int) -> List[Tuple[int, float]]:
+        """Ticks in the half-open range [from_ms, to_ms), oldest first."""
+        return [(ts, value) for ts, value in self.latest() if from_ms <= ts < to_ms]
+
+    def covers(self, from_ms: int) -> bool:
+        """True if every retained tick at or after ``from_ms`` is in the buffer.
+
+        Until the ring wraps it holds everything loaded at startup plus every
+        tick since, so any range is covered.
+        """
+        with self._lock:
+            if self._size < self.capacity:
+                return True
+            return self._ts[self._next] <= from_ms
+
+    def load(self, ticks: List[Tuple[int, float]]):
+        """Seed the buffer with time-ordered ticks (e.g. from SQLite at startup)."""
+        for ts_ms, value in ticks[-self.capacity:]:
+            self.append(ts_ms, value)
+
+
+recent_numbers = TickBuffer(NUMBERS_BUFFER_SIZE)
+
+
+def _load_recent_numbers():
+    """Fill the in-memory buffer with the newest ticks already in SQLite."""
+    with read_connection() as conn:
+        cursor = conn.execute(
+            "SELECT ts_ms, value FROM random_numbers ORDER BY ts_ms DESC LIMIT ?",
+            (recent_numbers.capacity,)
+        )
+        rows = cursor.fetchall()
+    recent_numbers.load(list(reversed(rows)))
+
+
+class NumberWriter:
+    """Persists generated numbers from a dedicated thread.
+
+    The event loop only puts rows on an in-memory queue.  The writer thread
+    commits everything that accumulated in a single transaction on the
+    shared writer connection (WAL journal, synchronous=NORMAL) once per
+    commit interval, so database I/O never runs on the loop.  The same
+    transaction folds the batch into the 1-minute and 1-hour rollups, and
+    the thread periodically applies the retention windows.
+    """
+
+    def __init__(self, interval: float = NUMBERS_COMMIT_INTERVAL_SECONDS):
+        self.interval = interval
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="number-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        """Flush pending rows and stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def add(self, ts_ms: int, value: float):
+        """Queue a number for the next batch (safe to call from the event loop)."""
+        self._queue.put((ts_ms, value))
+
+    def _flush(self, batch: list):
+        if not batch:
+            return
+        try:
+            with write_connection() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO random_numbers (ts_ms, value) VALUES (?, ?)",
+                    batch
+                )
+                for width, table in ROLLUP_TABLES.items():
+                    conn.executemany(f"""
+                    INSERT INTO {table} (bucket_ms, open, high, low, close, count, sum)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(bucket_ms) DO UPDATE SET
+                        high = max(high, excluded.high),
+                        low = min(low, excluded.low),
+                        close = excluded.close,
+                        count = count + excluded.count,
+                        sum = sum + excluded.sum""", _rollup(batch, width))
+        except sqlite3.Error as e:
+            print(f"Error writing {len(batch)} numbers: {e}")
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.interval
+        next_retention = time.monotonic() + RETENTION_CHECK_SECONDS
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    item = None
+                if item is _STOP:
+                    break
+                if item is not None:
+                    batch.append(item)
+                if time.monotonic() >= deadline:
+                    self._flush(batch)
+                    batch = []
+                    deadline = time.monotonic() + self.interval
+                if time.monotonic() >= next_retention:
+                    try:
+                        apply_retention()
+                    except sqlite3.Error as e:
+                        print(f"Error applying number retention: {e}")
+                    next_retention = time.monotonic() + RETENTION_CHECK_SECONDS
+        finally:
+            self._flush(batch)
+
+
+number_writer = NumberWriter()
@@ -1,233 +1,327 @@
+import os
 import json
-import sqlite3
 import asyncio
+from collections import deque
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict
-from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from datetime import datetime
 import pytz
+from timeseries import recent_numbers
+from locks import LockManager, COOLDOWN_SECONDS
 
-# Constants for lock timeouts
-EDIT_TIMEOUT_MINUTES = 15  # Maximum time a user can hold a lock
-COOLDOWN_SECONDS = 5      # Cooldown period after editing
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
+
+# Number of recent table deltas kept for clients that fall behind
+TABLE_DELTA_HISTORY = int(os.getenv('TABLE_DELTA_HISTORY', 1000))
+
+# Row deltas encoded per call when a large table_delta is encoded in slices
+DELTA_ENCODE_SLICE = 1000
+
+# Recent random numbers sent to a client when it connects
+NUMBERS_SNAPSHOT_POINTS = int(os.getenv('NUMBERS_SNAPSHOT_POINTS', 100))
+
+# Outbound queue per client and what to do when a slow client fills it
+OVERFLOW_POLICIES = ('drop_oldest', 'coalesce', 'disconnect')
+WS_SEND_QUEUE_SIZE = int(os.getenv('WS_SEND_QUEUE_SIZE', 256))
+WS_OVERFLOW_POLICY = os.getenv('WS_OVERFLOW_POLICY', 'drop_oldest')
+if WS_OVERFLOW_POLICY not in OVERFLOW_POLICIES:
+    print(f"Unknown WS_OVERFLOW_POLICY {WS_OVERFLOW_POLICY!r}, using 'drop_oldest'")
+    WS_OVERFLOW_POLICY = 'drop_oldest'
 
 # Add IST and UTC timezones
 ist = pytz.timezone('Asia/Kolkata')
 utc = pytz.UTC
 
-active_connections: Dict[str, WebSocket] = {}
-row_locks: Dict[int, dict] = {}  # Stores {row_index: {username, expires_at, status, last_modified}}
-
-async def validate_lock_request(row_index: int, username: str):
-    """Validate lock request with proper error handling"""
-    if row_index not in row_locks:
-        return True, None
-        
-    lock = row_locks[row_index]
-    now = datetime.now(utc)
-    
-    if now > lock['expires_at']:
-        return True, None
-        
-    if lock['status'] == 'cooldown':
-        remaining = (lock['expires_at'] - now).total_seconds()
-        return False, f"Row is in cooldown ({int(remaining)} seconds remaining)"
-        
-    if lock['username'] != username:
-        return False, f"Row is being edited by {lock['username']}"
-        
-    return True, None
-
-def is_row_locked(row_index: int, requesting_user: str) -> bool:
-    """Check if a row is locked by another user."""
-    if row_index not in row_locks:
-        return False
-    
-    lock = row_locks[row_index]
-    now = datetime.now(utc)
-    
-    # If lock has expired, clean it up
-    if now > lock['expires_at']:
-        if lock['status'] == 'editing':
-            # Convert to cooldown
-            row_locks[row_index] = {
-                'username': lock['username'],
-                'expires_at': now + timedelta(seconds=COOLDOWN_SECONDS),
-                'status': 'cooldown',
-                'last_modified': now
-            }
-            return True
-        else:
-            del row_locks[row_index]
+active_connections: Dict[str, "ClientConnection"] = {}
+table_deltas: deque = deque(maxlen=TABLE_DELTA_HISTORY)  # Recent row changes, oldest first
+
+def encode_message(message: dict) -> str:
+    """Serialize a message into the JSON text sent over the socket."""
+    if orjson is not None:
+        return orjson.dumps(message).decode('utf-8')
+    return json.dumps(message, separators=(',', ':'))
+
+class ClientConnection:
+    """A connected client with a bounded outbound queue and its own writer task.
+
+    Sending only enqueues, so a slow or stalled socket never holds up the
+    broadcaster or other clients.  When the queue is full the overflow policy
+    decides what happens: ``drop_oldest`` discards the oldest queued message,
+    ``coalesce`` replaces a queued message of the same type with the newer
+    one, and ``disconnect`` closes the slow consumer.
+
+    Streams such as ``random_number`` bypass the queue: ``offer_latest``
+    keeps only the newest undelivered message per type, so a slow client
+    gets the current value plus a ``skipped`` count instead of a backlog.
+    """
+
+    def __init__(self, username: str, websocket: WebSocket,
+                 max_queue: int = WS_SEND_QUEUE_SIZE, policy: str = WS_OVERFLOW_POLICY):
+        self.username = username
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.policy = policy
+        self.queue: deque = deque()  # (message type, encoded payload)
+        self.latest: Dict[str, tuple] = {}  # message type -> (payload, message, skipped)
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.max_depth = 0
+        self._wakeup = asyncio.Event()
+
+    @property
+    def client_state(self):
+        return self.websocket.client_state
+
+    def enqueue(self, payload: str, kind: Optional[str] = None) -> bool:
+        """Queue an encoded message; returns False if the client is (now) closed."""
+        if self.closed:
             return False
-    
-    # If the row is in cooldown, it's locked for everyone
-    if lock['status'] == 'cooldown':
+        if len(self.queue) >= self.max_queue:
+            if self.policy == 'disconnect':
+                print(f"Disconnecting slow client {self.username} ({len(self.queue)} messages queued)")
+                self.closed = True
+                self._wakeup.set()
+                return False
+            if self.policy == 'coalesce' and self._drop_latest_of_kind(kind):
+                self.coalesced += 1
+            else:
+                self.queue.popleft()
+                self.dropped += 1
+        self.queue.append((kind, payload))
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self._wakeup.set()
         return True
-    
-    # If someone else has the lock, it's locked
-    if lock['username'] != requesting_user:
+
+    def offer_latest(self, payload: str, message: dict) -> bool:
+        """Replace any undelivered message of the same type with this one."""
+        if self.closed:
+            return False
+        kind = message.get('type')
+        pending = self.latest.get(kind)
+        skipped = 0
+        if pending is not None:
+            skipped = pending[2] + 1
+            self.skipped += 1
+        self.latest[kind] = (payload, message, skipped)
+        self._wakeup.set()
         return True
-    
-    # The requesting user has the lock
-    return False
+
+    def _drop_latest_of_kind(self, kind: Optional[str]) -> bool:
+        if kind is None:
+            return False
+        for i in range(len(self.queue) - 1, -1, -1):
+            if self.queue[i][0] == kind:
+                del self.queue[i]
+                return True
+        return False
+
+    async def send_json(self, message: dict):
+        """Queue a message for this client only."""
+        self.enqueue(encode_message(message), message.get('type'))
+
+    async def receive_text(self) -> str:
+        return await self.websocket.receive_text()
+
+    async def run_writer(self):
+        """Drain the queue to the socket until the client is closed or a send fails."""
+        try:
+            while not self.closed:
+                if self.queue:
+                    _, payload = self.queue.popleft()
+                elif self.latest:
+                    kind = next(iter(self.latest))
+                    payload, message, skipped = self.latest.pop(kind)
+                    if skipped:
+                        payload = encode_message({**message, "skipped": skipped})
+                else:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                await self.websocket.send_text(payload)
+                self.sent += 1
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error sending to {self.username}: {e}")
+        finally:
+            self.closed = True
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+        self._wakeup.set()
+        try:
+            if is_websocket_connected(self.websocket):
+                await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    def metrics(self) -> dict:
+        return {
+            "username": self.username,
+            "queue_depth": len(self.queue),
+            "max_queue_depth": self.max_depth,
+            "queue_limit": self.max_queue,
+            "overflow_policy": self.policy,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "skipped_ticks": self.skipped
+        }
+
+
+def connection_metrics() -> dict:
+    """Per-client outbound queue statistics."""
+    clients = [client.metrics() for client in list(active_connections.values())]
+    return {
+        "connections": len(clients),
+        "total_queued": sum(c["queue_depth"] for c in clients),
+        "clients": clients
+    }
 
 async def broadcast_message(message: dict, exclude: list = None):
-    """Broadcast a message to all connected clients except those in exclude list."""
+    """Broadcast a message to all connected clients except those in exclude list.
+
+    The message is encoded once and the same text frame is queued for every
+    client; each client's writer task delivers it independently.
+    """
+    await broadcast_encoded(encode_message(message), message.get('type'), exclude)
+
+async def broadcast_encoded(payload: str, kind: str, exclude: list = None):
+    """Broadcast an already encoded message of type ``kind``."""
     if exclude is None:
         exclude = []
+    disconnected = []
     
-    print(f"Broadcasting message to {len(active_connections)} clients: {message['type']}")
-    disconnected_users = []
-    
-    for username, connection in list(active_connections.items()):
+    for username, client in list(active_connections.items()):
         if username in exclude:
             continue
-            
-        try:
-            if is_websocket_connected(connection):
-                try:
-                    await connection.send_json(message)
-                    print(f"Successfully sent to {username}")
-                except RuntimeError as e:
-                    if "already completed" in str(e) or "websocket.close" in str(e):
-                        print(f"Connection already closed for {username}")
-                        disconnected_users.append(username)
-                    else:
-                        print(f"Error sending to {username}: {e}")
-                        disconnected_users.append(username)
-            else:
-                print(f"Connection not active for {username}")
-                disconnected_users.append(username)
-        except Exception as e:
-            print(f"Error sending to {username}: {e}")
-            disconnected_users.append(username)
+        if not client.enqueue(payload, kind):
+            disconnected.append((username, client))
     
-    # Clean up disconnected users
-    for username in disconnected_users:
-        if username in active_connections:
-            try:
-                connection = active_connections[username]
-                if is_websocket_connected(connection):
-                    await connection.close(code=1000)
-            except Exception:
-                pass
-            finally:
-                if username in active_connections:
-                    del active_connections[username]
+    # Clean up clients that were closed or overflowed
+    for username, client in disconnected:
+        await drop_client(username, client)
+
+async def drop_client(username: str, client: ClientConnection):
+    """Forget a closed or overflowing client (unless it has already been replaced)."""
+    if active_connections.get(username) is client:
+        del active_connections[username]
+    await client.close(code=1013)
+
+async def broadcast_latest(message: dict):
+    """Broadcast on a latest-value channel: slow clients only ever hold the newest message."""
+    payload = encode_message(message)
+    for username, client in list(active_connections.items()):
+        if not client.offer_latest(payload, message):
+            await drop_client(username, client)
+
+# One lock table and expiry scheduler for the whole server
+lock_manager = LockManager(broadcast_message)
 
-async def handle_lock_request(username: str, row_index: int):
+async def handle_lock_request(username: str, row_id: int):
     """Handle a request to lock a row for editing."""
     try:
-        # Use a lock to prevent race conditions
-        async with asyncio.Lock():
+        # Serialized with writes to the same row
+        async with lock_manager.mutex(row_id):
             # Check if user already has this lock
-            if row_index in row_locks and row_locks[row_index]['username'] == username:
-                # Refresh the lock
-                now = datetime.now(utc)
-                expires_at = now + timedelta(minutes=EDIT_TIMEOUT_MINUTES)
-                row_locks[row_index]['expires_at'] = expires_at
-                row_locks[row_index]['last_modified'] = now
-                
+            refreshed = lock_manager.holds(row_id, username)
+            lock, error_message = lock_manager.acquire(row_id, username)
+        if lock is None:
+            if username in active_connections:
                 await active_connections[username].send_json({
-                    "type": "lock_confirmation",
-                    "row_index": row_index,
-                    "status": "editing",
-                    "expires_at": expires_at.isoformat(),
-                    "message": "Lock refreshed successfully"
+                    "type": "lock_denied",
+                    "row_id": row_id,
+                    "message": error_message
                 })
-                return True
+            return False
+        expires_at = lock['expires_at']
+
+        if refreshed:
+            await active_connections[username].send_json({
+                "type": "lock_confirmation",
+                "row_id": row_id,
+                "status": "editing",
+                "expires_at": expires_at.isoformat(),
+                "message": "Lock refreshed successfully"
+            })
+            return True
 
-            # Validate lock request
-            is_valid, error_message = await validate_lock_request(row_index, username)
-            if not is_valid:
-                if username in active_connections:
-                    await active_connections[username].send_json({
-                        "type": "lock_denied",
-                        "row_index": row_index,
-                        "message": error_message
-                    })
-                return False
-            
-            # Grant the lock
-            now = datetime.now(utc)
-            expires_at = now + timedelta(minutes=EDIT_TIMEOUT_MINUTES)
-            row_locks[row_index] = {
-                'username': username,
-                'expires_at': expires_at,
-                'status': 'editing',
-                'last_modified': now
-            }
-            
-            # Send direct confirmation to requester immediately
-            if username in active_connections:
-                try:
-                    await active_connections[username].send_json({
-                        "type": "lock_confirmation",
-                        "row_index": row_index,
-                        "status": "editing",
-                        "expires_at": expires_at.isoformat(),
-                        "message": "Lock acquired successfully"
-                    })
-                except Exception as e:
-                    print(f"Error sending lock confirmation to {username}: {e}")
-                    return False
-            
-            # Broadcast to others
+        # Send direct confirmation to requester immediately
+        if username in active_connections:
             try:
-                await broadcast_message({
-                    "type": "lock_status",
-                    "row_index": row_index,
-                    "status": 'editing',
-                    "locked_by": username,
+                await active_connections[username].send_json({
+                    "type": "lock_confirmation",
+                    "row_id": row_id,
+                    "status": "editing",
                     "expires_at": expires_at.isoformat(),
-                    "message": f"{username} is editing this row"
-                }, exclude=[username])
+                    "message": "Lock acquired successfully"
+                })
             except Exception as e:
-                print(f"Error broadcasting lock status: {e}")
-            
-            return True
-            
+                print(f"Error sending lock confirmation to {username}: {e}")
+                return False
+
+        # Broadcast to others
+        try:
+            await broadcast_message({
+                "type": "lock_status",
+                "row_id": row_id,
+                "status": 'editing',
+                "locked_by": username,
+                "expires_at": expires_at.isoformat(),
+                "message": f"{username} is editing this row"
+            }, exclude=[username])
+        except Exception as e:
+            print(f"Error broadcasting lock status: {e}")
+
+        return True
+
     except Exception as e:
         print(f"Lock error: {e}")
         if username in active_connections:
             try:
                 await active_connections[username].send_json({
                     "type": "lock_denied",
-                    "row_index": row_index,
+                    "row_id": row_id,
                     "message": f"Lock request failed: {str(e)}"
                 })
             except Exception:
                 pass
         return False
 
-async def restore_user_locks(username: str, websocket: WebSocket):
+async def restore_user_locks(username: str, client: ClientConnection):
     """Restore user's locks after reconnection"""
-    now = datetime.now(utc)
-    for row_index, lock in list(row_locks.items()):
-        if lock['username'] == username and lock['status'] == 'editing':
-            if now > lock['expires_at']:
-                # Convert to cooldown if expired
-                await handle_unlock_request(username, row_index)
-            else:
-                # Refresh the lock
-                lock['expires_at'] = now + timedelta(minutes=EDIT_TIMEOUT_MINUTES)
-                await websocket.send_json({
-                    "type": "lock_restored",
-                    "row_index": row_index,
-                    "expires_at": lock['expires_at'].isoformat(),
-                    "message": "Your lock has been restored"
-                })
+    for row_id, lock in lock_manager.held_by(username):
+        if lock['status'] != 'editing':
+            continue
+        if not lock_manager.holds(row_id, username):
+            # Convert to cooldown if expired
+            await handle_unlock_request(username, row_id)
+        else:
+            # Refresh the lock
+            lock, _ = lock_manager.acquire(row_id, username)
+            await client.send_json({
+                "type": "lock_restored",
+                "row_id": row_id,
+                "expires_at": lock['expires_at'].isoformat(),
+                "message": "Your lock has been restored"
+            })
 
-async def verify_lock_state(websocket: WebSocket, username: str):
+async def verify_lock_state(client: ClientConnection, username: str):
     """Verify and sync lock states after reconnection"""
     try:
         # Send all current locks to the reconnected client
-        for row_index, lock in row_locks.items():
+        for row_id, lock in lock_manager.items():
             try:
-                if is_websocket_connected(websocket):
-                    await websocket.send_json({
+                if is_websocket_connected(client):
+                    await client.send_json({
                         "type": "lock_status",
-                        "row_index": row_index,
+                        "row_id": row_id,
                         "status": lock['status'],
                         "locked_by": lock['username'],
                         "expires_at": lock['expires_at'].isoformat(),
@@ -237,29 +331,11 @@ async def verify_lock_state(websocket: WebSocket, username: str):
                 print(f"Error sending lock status during verification: {e}")
 
         # Restore user's locks
-        await restore_user_locks(username, websocket)
+        await restore_user_locks(username, client)
         
     except Exception as e:
         print(f"Error in verify_lock_state: {e}")
 
-async def connect_client(websocket: WebSocket, username: str):
-    await websocket.accept()
-    active_connections[username] = websocket
-
-
-async def disconnect_client(username: str):
-    if username in active_connections:
-        for row_index in list(row_locks.keys()):
-            if row_locks[row_index]['username'] == username:
-                del row_locks[row_index]
-                await broadcast_message({
-                    "type": "lock_status",
-                    "row_index": row_index,
-                    "locked_by": None
-                })
-        del active_connections[username]
-
-
 def is_websocket_connected(websocket: WebSocket) -> bool:
     """Check if a WebSocket connection is still active."""
     try:
@@ -268,18 +344,151 @@ def is_websocket_connected(websocket: WebSocket) -> bool:
         return False
 
 
-async def broadcast_table_update(data: list, source_username: str = None):
-    """Broadcast table updates to all connected clients."""
-    print(f"Broadcasting table update from {source_username}")
-    current_time = datetime.now(ist)
-    message = {
-        "type": "csv_update",
-        "data": data,
-        "source": source_username,
-        "timestamp": current_time.isoformat()
+# Row delta type for each mutation log operation
+CHANGE_TYPES = {'add': 'row_inserted', 'update': 'row_updated', 'delete': 'row_deleted'}
+
+
+def row_changes(record: dict, source_username: str = None) -> List[dict]:
+    """Build the row deltas for a committed mutation record.
+
+    ``version`` is the table version after the change; clients apply deltas
+    in version order and ask for a resync when they see a gap.  The rows of
+    a bulk record all share its version.
+    """
+    timestamp = datetime.now(ist).isoformat()
+    changes = []
+    for change in (record['changes'] if record['op'] == 'bulk' else [record]):
+        row = change.get('row')
+        delta = {
+            "type": CHANGE_TYPES[change['op']],
+            "version": record['seq'],
+            "id": change['id'] if 'id' in change else row['id'],
+            "source": source_username,
+            "timestamp": timestamp
+        }
+        if row is not None:
+            delta["row"] = row
+        changes.append(delta)
+    return changes
+
+
+def table_delta_message(changes: List[dict]) -> dict:
+    """Wrap consecutive row deltas into a single table_delta message."""
+    return {
+        "type": "table_delta",
+        "from_version": changes[0]["version"] - 1,
+        "version": changes[-1]["version"],
+        "changes": changes,
+        "timestamp": datetime.now(ist).isoformat()
     }
-    await broadcast_message(message)
-    print("Table update broadcast completed")
+
+
+def encode_table_delta(changes: List[dict]) -> str:
+    """``table_delta_message(changes)``, encoded.
+
+    The deltas of a bulk change are encoded ``DELTA_ENCODE_SLICE`` at a
+    time and spliced together, so a worker thread encoding them lets the
+    event loop run in between.
+    """
+    message = table_delta_message(changes)
+    if len(changes) <= DELTA_ENCODE_SLICE:
+        return encode_message(message)
+    header = encode_message({key: value for key, value in message.items() if key != "changes"})
+    parts = [encode_message(changes[start:start + DELTA_ENCODE_SLICE])[1:-1]
+             for start in range(0, len(changes), DELTA_ENCODE_SLICE)]
+    return f'{header[:-1]},"changes":[{",".join(parts)}]}}'
+
+
+async def broadcast_table_delta(changes: List[dict], payload: Optional[str] = None):
+    """Broadcast a batch of committed row changes as one table_delta message.
+
+    ``payload`` is the message from ``encode_table_delta``, if it was
+    already encoded off the event loop.
+    """
+    if not changes:
+        return
+    table_deltas.extend(changes)
+    await broadcast_encoded(payload or encode_table_delta(changes), "table_delta")
+
+
+def encode_table_snapshot() -> str:
+    """The table_snapshot message, encoded.
+
+    The rows come from the table's cached JSON and are spliced in as they
+    are, so no row dict is built for it.
+    """
+    from file_operations import get_table_store
+    store = get_table_store()
+    header = encode_message({
+        "type": "table_snapshot",
+        "version": store.seq,
+        "timestamp": datetime.now(ist).isoformat()
+    })
+    return f'{header[:-1]},"data":{store.to_json()}}}'
+
+
+async def send_table_snapshot(client: ClientConnection):
+    """Send the whole table to a single client."""
+    client.enqueue(encode_table_snapshot(), "table_snapshot")
+
+
+async def broadcast_table_snapshot():
+    """Send the whole table to every client, e.g. after a restore.
+
+    Deltas from before it no longer apply, so they are dropped from the
+    resync history as well.
+    """
+    table_deltas.clear()
+    await broadcast_encoded(encode_table_snapshot(), "table_snapshot")
+
+
+async def handle_resync_request(client: ClientConnection, from_version: int):
+    """Replay the deltas a client missed, or send a snapshot if they are no longer kept."""
+    missed = [delta for delta in table_deltas if delta["version"] > from_version]
+    # Replaying more deltas than the client's queue comfortably holds would
+    # just overflow it again, so fall back to a snapshot in that case
+    replayable = len(missed) <= client.max_queue // 2
+    # The history may have been cut in the middle of a bulk change; the
+    # replay is only complete if an older delta or nothing was dropped
+    complete = len(missed) < len(table_deltas) or len(table_deltas) < table_deltas.maxlen
+    if missed and replayable and complete and missed[0]["version"] == from_version + 1:
+        await client.send_json(table_delta_message(missed))
+        return
+    from file_operations import get_table_store
+    if not missed and from_version == get_table_store().seq:
+        return
+    await send_table_snapshot(client)
+
+
+def aggregates_message() -> dict:
+    from file_operations import read_aggregates
+    return {
+        "type": "aggregates",
+        **read_aggregates(),
+        "timestamp": datetime.now(ist).isoformat()
+    }
+
+
+async def broadcast_aggregates():
+    """Push the current totals; latest-value only, like the number ticks."""
+    if active_connections:
+        await broadcast_latest(aggregates_message())
+
+
+async def send_number_history(client: ClientConnection):
+    """Send the recent random numbers so a new chart starts filled."""
+    ticks = recent_numbers.latest(NUMBERS_SNAPSHOT_POINTS)
+    await client.send_json({
+        "type": "number_history",
+        "points": [
+            {
+                "value": value,
+                "timestamp": format_time(datetime.fromtimestamp(ts_ms / 1000, utc)),
+                "ts_ms": ts_ms
+            }
+            for ts_ms, value in ticks
+        ]
+    })
 
 
 # Format timestamp without seconds, using IST
@@ -300,7 +509,7 @@ async def broadcast_random_number(value: float, timestamp: str):
         # Format current time without seconds
         current_time_str = format_time(current_time)
         
-        await broadcast_message({
+        await broadcast_latest({
             "type": "random_number",
             "value": value,
             "timestamp": current_time_str
@@ -309,74 +518,47 @@ async def broadcast_random_number(value: float, timestamp: str):
         print(f"Error in broadcast_random_number: {e}")
         # Fallback to current IST time if there's an error
         current_time = datetime.now(ist)
-        await broadcast_message({
+        await broadcast_latest({
             "type": "random_number",
             "value": value,
             "timestamp": format_time(current_time)
         })
 
 
-async def handle_unlock_request(username: str, row_index: int):
+async def handle_unlock_request(username: str, row_id: int):
     """Handle a request to unlock a row."""
     try:
-        if row_index not in row_locks:
+        if lock_manager.get(row_id) is None:
             return True
-            
-        lock = row_locks[row_index]
-        if lock['username'] != username:
+
+        # Set cooldown period; the lock manager frees the row when it ends
+        async with lock_manager.mutex(row_id):
+            lock = lock_manager.release(row_id, username)
+        if lock is None:
             return False
-            
-        # Set cooldown period
-        now = datetime.now()
-        expires_at = now + timedelta(seconds=COOLDOWN_SECONDS)
-        row_locks[row_index] = {
-            'username': username,
-            'expires_at': expires_at,
-            'status': 'cooldown',
-            'last_modified': now
-        }
-        
+
         await broadcast_message({
             "type": "lock_status",
-            "row_index": row_index,
+            "row_id": row_id,
             "status": 'cooldown',
             "locked_by": username,
-            "expires_at": expires_at.isoformat(),
+            "expires_at": lock['expires_at'].isoformat(),
             "message": f"Row is in cooldown period for {COOLDOWN_SECONDS} seconds"
         })
-        
-        # Schedule lock removal after cooldown
-        asyncio.create_task(remove_lock_after_cooldown(row_index, expires_at))
         return True
-        
+
     except Exception as e:
         print(f"Unlock error: {e}")
         return False
 
 
-async def remove_lock_after_cooldown(row_index: int, expires_at: datetime):
-    try:
-        await asyncio.sleep((expires_at - datetime.now()).total_seconds())
-        if row_index in row_locks and row_locks[row_index]['expires_at'] == expires_at:
-            del row_locks[row_index]
-            await broadcast_message({
-                "type": "lock_status",
-                "row_index": row_index,
-                "locked_by": None,
-                "status": "available",
-                "message": "Row is now available for editing"
-            })
-    except Exception as e:
-        print(f"Error in cooldown cleanup: {e}")
-
-
-async def send_ping(websocket: WebSocket):
+async def send_ping(client: ClientConnection):
     try:
         while True:
             try:
                 await asyncio.sleep(10)
-                if is_websocket_connected(websocket):
-                    await websocket.send_json({"type": "ping"})
+                if is_websocket_connected(client):
+                    await client.send_json({"type": "ping"})
                 else:
                     break
             except Exception as e:
@@ -388,19 +570,19 @@ async def send_ping(websocket: WebSocket):
         print("Ping task ended")
 
 
-async def process_messages(websocket: WebSocket, username: str):
+async def process_messages(client: ClientConnection, username: str):
     while True:
         try:
-            data = await websocket.receive_text()
+            data = await client.receive_text()
             message = json.loads(data)
             
             if message["type"] == "lock_row":
-                row_index = message["row_index"]
-                success = await handle_lock_request(username, row_index)
+                row_id = message["row_id"]
+                success = await handle_lock_request(username, row_id)
                 try:
-                    await websocket.send_json({
+                    await client.send_json({
                         "type": "lock_status",
-                        "row_index": row_index,
+                        "row_id": row_id,
                         "locked_by": username if success else None,
                         "status": "editing" if success else "locked"
                     })
@@ -408,8 +590,11 @@ async def process_messages(websocket: WebSocket, username: str):
                     print(f"Error sending lock status: {e}")
             
             elif message["type"] == "unlock_row":
-                row_index = message["row_index"]
-                await handle_unlock_request(username, row_index)
+                row_id = message["row_id"]
+                await handle_unlock_request(username, row_id)
+
+            elif message["type"] == "resync":
+                await handle_resync_request(client, int(message.get("from_version", 0)))
 
         except WebSocketDisconnect:
             break
@@ -422,7 +607,8 @@ async def process_messages(websocket: WebSocket, username: str):
 
 
 async def websocket_endpoint(websocket: WebSocket, username: str):
-    cleanup_task = None
+    client = None
+    writer_task = None
     ping_task = None
     message_task = None
     
@@ -440,27 +626,27 @@ async def websocket_endpoint(websocket: WebSocket, username: str):
         
         # Clean up any existing connection for this user
         if username in active_connections:
-            old_connection = active_connections[username]
-            try:
-                if is_websocket_connected(old_connection):
-                    await old_connection.close(code=1000)
-            except Exception:
-                pass
+            await active_connections[username].close(code=1000)
         
-        # Store the new connection
-        active_connections[username] = websocket
+        # Store the new connection and start its writer
+        client = ClientConnection(username, websocket)
+        active_connections[username] = client
+        writer_task = asyncio.create_task(client.run_writer())
+        
+        # Queued ahead of any live tick, so the chart fills in order
+        await send_number_history(client)
+        await client.send_json(aggregates_message())
         
         # Verify and restore lock states
-        await verify_lock_state(websocket, username)
+        await verify_lock_state(client, username)
         
         # Create tasks
-        ping_task = asyncio.create_task(send_ping(websocket))
-        message_task = asyncio.create_task(process_messages(websocket, username))
-        cleanup_task = asyncio.create_task(periodic_lock_cleanup())
+        ping_task = asyncio.create_task(send_ping(client))
+        message_task = asyncio.create_task(process_messages(client, username))
         
         # Wait for any task to complete
         done, pending = await asyncio.wait(
-            [ping_task, message_task, cleanup_task],
+            [writer_task, ping_task, message_task],
             return_when=asyncio.FIRST_COMPLETED
         )
         
@@ -478,7 +664,7 @@ async def websocket_endpoint(websocket: WebSocket, username: str):
         print(f"WebSocket error for user {username}: {e}")
     finally:
         # Cancel any remaining tasks
-        tasks = [t for t in [ping_task, message_task, cleanup_task] if t and not t.done()]
+        tasks = [t for t in [writer_task, ping_task, message_task] if t and not t.done()]
         for task in tasks:
             task.cancel()
             try:
@@ -486,78 +672,21 @@ async def websocket_endpoint(websocket: WebSocket, username: str):
             except asyncio.CancelledError:
                 pass
             
-        # Handle disconnection
-        if username in active_connections:
-            del active_connections[username]
+        # Handle disconnection (a reconnect may already have replaced this client)
+        if client is not None:
+            if active_connections.get(username) is client:
+                del active_connections[username]
+            await client.close()
             
         # Clean up locks
-        for row_index in list(row_locks.keys()):
-            if row_index in row_locks and row_locks[row_index]['username'] == username:
-                del row_locks[row_index]
-                try:
-                    await broadcast_message({
-                        "type": "lock_status",
-                        "row_index": row_index,
-                        "locked_by": None,
-                        "status": "available",
-                        "message": f"Row unlocked - {username} disconnected"
-                    })
-                except Exception as e:
-                    print(f"Error broadcasting unlock message: {e}")
-
-
-async def periodic_lock_cleanup():
-    """Periodically clean up expired locks"""
-    cleanup_interval = 5  # Check every 5 seconds
-    
-    try:
-        while True:
+        for row_id in lock_manager.release_all(username):
             try:
-                async with asyncio.Lock():
-                    now = datetime.now()
-                    expired_locks = []
-                    
-                    for row_index, lock in row_locks.items():
-                        if now > lock['expires_at']:
-                            if lock['status'] == 'editing':
-                                # Convert to cooldown state
-                                row_locks[row_index] = {
-                                    'username': lock['username'],
-                                    'expires_at': now + timedelta(seconds=COOLDOWN_SECONDS),
-                                    'status': 'cooldown',
-                                    'last_modified': now
-                                }
-                                await broadcast_message({
-                                    "type": "lock_status",
-                                    "row_index": row_index,
-                                    "status": "cooldown",
-                                    "locked_by": lock['username'],
-                                    "expires_at": row_locks[row_index]['expires_at'].isoformat(),
-                                    "message": f"Row is in cooldown period for {COOLDOWN_SECONDS} seconds"
-                                })
-                            elif lock['status'] == 'cooldown':
-                                expired_locks.append(row_index)
-                    
-                    # Remove expired cooldown locks
-                    for row_index in expired_locks:
-                        if row_index in row_locks:
-                            del row_locks[row_index]
-                            await broadcast_message({
-                                "type": "lock_status",
-                                "row_index": row_index,
-                                "locked_by": None,
-                                "status": "available",
-                                "message": "Row is now available for editing"
-                            })
-                            
+                await broadcast_message({
+                    "type": "lock_status",
+                    "row_id": row_id,
+                    "locked_by": None,
+                    "status": "available",
+                    "message": f"Row unlocked - {username} disconnected"
+                })
             except Exception as e:
-                print(f"Error in cleanup iteration: {e}")
-                
-            await asyncio.sleep(cleanup_interval)
-            
-    except asyncio.CancelledError:
-        print("Lock cleanup task cancelled")
-    except Exception as e:
-        print(f"Fatal error in lock cleanup: {e}")
-    finally:
-        print("Lock cleanup task ended")
\ No newline at end of file
+                print(f"Error broadcasting unlock message: {e}")
@@ -0,0 +1,122 @@
+"""Cost of one WebSocket broadcast as the number of connected clients grows.
+
+Connects stub clients (in-process sockets whose ``send_text`` only yields)
+through the server's ``ClientConnection`` and writer tasks, then times
+``broadcast_message`` for a ``table_delta`` sized message:
+
+- ``broadcast``: encoding it once and queueing it for every client, which
+  is the time the event loop spends inside the broadcaster;
+- ``delivered``: until every client's writer has handed it to its socket.
+
+It is compared with encoding the message separately for each client, as
+broadcasts did before they shared one encoded frame.
+
+    cd backend
+    python benchmarks/broadcast_fanout.py
+    python benchmarks/broadcast_fanout.py --clients 10 100 1000 5000 --rounds 50
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault('DATABASE_URL', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+import websocket as ws  # noqa: E402
+
+MESSAGE = {
+    "type": "table_delta",
+    "from_version": 41,
+    "version": 42,
+    "changes": [{
+        "type": "row_updated",
+        "version": 42,
+        "id": 7,
+        "source": "alice",
+        "row": {"id": 7, "version": 3, "user": "user_7", "broker": "BrokerA", "API key": "APIKEY_1294",
+                "API secret": "APISECRET_83978", "pnl": 3911.21, "margin": 32134.43, "max_risk": 2.77}
+    }]
+}
+
+
+class StubState:
+    value = 1  # connected
+
+
+class StubSocket:
+    client_state = StubState()
+    delivered = 0  # messages sent across all stub sockets
+
+    def __init__(self):
+        self.received = 0
+
+    async def send_text(self, payload: str):
+        self.received += 1
+        StubSocket.delivered += 1
+        await asyncio.sleep(0)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def measure(clients: int, rounds: int) -> dict:
+    ws.active_connections.clear()
+    sockets, writers = [], []
+    for i in range(clients):
+        socket = StubSocket()
+        client = ws.ClientConnection(f"bench{i}", socket, max_queue=rounds + 1)
+        ws.active_connections[client.username] = client
+        sockets.append(socket)
+        writers.append(asyncio.create_task(client.run_writer()))
+
+    broadcast = delivered = 0.0
+    StubSocket.delivered = 0
+    for round_number in range(1, rounds + 1):
+        start = time.perf_counter()
+        await ws.broadcast_message(MESSAGE)
+        broadcast += time.perf_counter() - start
+        while StubSocket.delivered < round_number * clients:
+            await asyncio.sleep(0)
+        delivered += time.perf_counter() - start
+
+    # The old path: one json.dumps per recipient
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for _client in ws.active_connections.values():
+            json.dumps(MESSAGE)
+    per_client = time.perf_counter() - start
+
+    for client in list(ws.active_connections.values()):
+        await client.close()
+    for writer in writers:
+        writer.cancel()
+    await asyncio.gather(*writers, return_exceptions=True)
+    ws.active_connections.clear()
+    assert all(socket.received == rounds for socket in sockets), "a client missed a broadcast"
+    return {
+        "broadcast": broadcast / rounds * 1000,
+        "delivered": delivered / rounds * 1000,
+        "per_client_encode": per_client / rounds * 1000
+    }
+
+
+async def main(client_counts, rounds):
+    print(f"encoder: {'orjson' if ws.orjson is not None else 'json'}, {rounds} rounds")
+    print(f"{'clients':>8} {'broadcast ms':>13} {'delivered ms':>13} {'encode per client ms':>21}")
+    for clients in client_counts:
+        result = await measure(clients, rounds)
+        print(f"{clients:>8} {result['broadcast']:>13.3f} {result['delivered']:>13.3f} "
+              f"{result['per_client_encode']:>21.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.clients, args.rounds))
@@ -0,0 +1,191 @@
+"""Event loop tick jitter while the server handles a burst of table writes.
+
+Starts the app under uvicorn with its data in a temporary directory,
+seeds the broker table, then runs a ticker on the server's event loop
+(sleeping ``--interval-ms`` like the number generator sleeps between
+ticks) while a separate client process sends a burst of concurrent
+``add_csv``, ``update_csv`` and ``delete_csv`` requests, and then one
+``bulk_csv`` insert of ``--bulk-rows`` rows followed by a bulk update of
+the same rows.  A tick's jitter is how late it wakes up.  Exits with
+status 1 if the worst tick during the burst is later than ``--bound-ms``,
+or the worst tick during the bulk writes later than ``--bulk-bound-ms``.
+
+    cd backend
+    python benchmarks/tick_jitter.py
+    python benchmarks/tick_jitter.py --rows 100000 --writes 600 --bound-ms 10
+    python benchmarks/tick_jitter.py --bulk-rows 50000 --bulk-bound-ms 300
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+SECRET = 'tick-jitter-benchmark'
+ROW = {"user": "bench", "broker": "BrokerA", "API key": "APIKEY_1", "API secret": "APISECRET_1",
+       "pnl": 1.5, "margin": 2.5, "max_risk": 0.5}
+
+
+def cpu_steal_ms() -> float:
+    """CPU time the hypervisor gave to other guests so far (Linux only, else 0)."""
+    try:
+        with open('/proc/stat') as f:
+            fields = f.readline().split()
+        return int(fields[8]) * 1000 / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+
+def auth_headers() -> dict:
+    from jose import jwt
+    return {"Authorization": "Bearer " + jwt.encode({"sub": "bench"}, SECRET, algorithm="HS256")}
+
+
+async def run_client(url: str, rows: int, writes: int, concurrency: int, bulk_rows: int):
+    """The burst (or with ``bulk_rows``, the bulk writes), sent from its own process
+    so it does not share the server's loop."""
+    import httpx
+    # Lowest priority, so on a machine with few cores the client's own CPU
+    # time is not counted as server jitter
+    if hasattr(os, 'SCHED_IDLE'):
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+    else:
+        os.nice(19)
+    headers = auth_headers()
+    if bulk_rows:
+        bulk_headers = {**headers, "content-type": "application/json"}
+        async with httpx.AsyncClient(base_url=url, timeout=120) as client:
+            response = await client.post("/api/bulk_csv", content=json.dumps([ROW] * bulk_rows), headers=bulk_headers)
+            response.raise_for_status()
+            update = [{**ROW, "id": row_id, "pnl": 2.5} for row_id in response.json()["ids"]]
+            response = await client.post("/api/bulk_csv", content=json.dumps(update), headers=bulk_headers)
+            response.raise_for_status()
+        return
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+        async def write(i: int) -> int:
+            kind = i % 10
+            if kind < 5:
+                response = await client.put(f"/api/update_csv/{1 + i % rows}", json=ROW, headers=headers)
+            elif kind < 9:
+                response = await client.post("/api/add_csv", json=ROW, headers=headers)
+            else:
+                response = await client.delete(f"/api/delete_csv/{rows - i}", headers=headers)
+            return response.status_code
+
+        statuses = await asyncio.gather(*[write(i) for i in range(writes)])
+    failed = [status for status in statuses if status != 200]
+    if failed:
+        sys.exit(f"{len(failed)} of {writes} writes failed: {sorted(set(failed))}")
+
+
+async def measure(url: str, args, rows: int, bulk_rows: int = 0):
+    """Tick on this loop while a client process writes; the ticks' lateness in ms,
+    the seconds taken, the CPU steal in ms and whether the client succeeded."""
+    interval = args.interval_ms / 1000
+    late = []
+    client = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.abspath(__file__), '--client', url, '--rows', str(rows),
+        '--writes', str(args.writes), '--concurrency', str(args.concurrency), '--bulk-rows', str(bulk_rows))
+    started, steal = time.perf_counter(), cpu_steal_ms()
+    while client.returncode is None:
+        tick = time.perf_counter()
+        await asyncio.sleep(interval)
+        late.append((time.perf_counter() - tick - interval) * 1000)
+    elapsed, steal = time.perf_counter() - started, cpu_steal_ms() - steal
+    await client.wait()
+    return sorted(late), elapsed, steal, client.returncode == 0
+
+
+def report(late, steal: float, bound: float) -> bool:
+    """Print the jitter of one run; False if a tick was later than ``bound``."""
+    worst = late[-1]
+    print(f"tick jitter ms: median {statistics.median(late):.2f}  p99 {late[int(len(late) * 0.99)]:.2f}  "
+          f"max {worst:.2f}  (bound {bound:g})")
+    if worst <= bound:
+        return True
+    over = sum(1 for value in late if value > bound)
+    print(f"FAIL: {over} tick(s) later than the bound")
+    if steal:
+        # On a VM a stolen time slice delays the loop however idle it is
+        print(f"(the hypervisor stole {steal:.0f} ms of CPU during the run; rerun to rule it out)")
+    return False
+
+
+async def run_server(args) -> int:
+    data_dir = tempfile.mkdtemp(prefix='tick-jitter-')
+    os.environ.update({
+        'CSV_FILE_PATH': os.path.join(data_dir, 'backend_table.csv'),
+        'CSV_BACKUP_DIR': os.path.join(data_dir, 'backups'),
+        'DATABASE_URL': os.path.join(data_dir, 'backend.db'),
+        'JWT_SECRET_KEY': SECRET,
+    })
+    sys.path.insert(0, APP_DIR)
+    import uvicorn
+    from main import app
+    import file_operations
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='error'))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    # Seed the table in one bulk write, then let compaction fold it into the snapshot
+    import httpx
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120) as client:
+        response = await client.post("/api/bulk_csv", content=json.dumps([ROW] * args.rows),
+                                     headers={**auth_headers(), "content-type": "application/json"})
+        response.raise_for_status()
+    await file_operations.compact_table_store()
+    rows = len(file_operations.get_table_store())
+    url = f"http://127.0.0.1:{port}"
+
+    burst, elapsed, steal, burst_ok = await measure(url, args, rows)
+    if burst_ok:
+        print(f"{args.writes} writes ({args.concurrency} concurrent) against {rows} rows in {elapsed:.2f}s, "
+              f"{len(burst)} ticks of {args.interval_ms:g} ms")
+        passed = report(burst, steal, args.bound_ms)
+    if burst_ok and args.bulk_rows:
+        bulk, elapsed, steal, bulk_ok = await measure(url, args, rows, args.bulk_rows)
+        if bulk_ok:
+            print(f"bulk insert and update of {args.bulk_rows} rows in {elapsed:.2f}s, "
+                  f"{len(bulk)} ticks of {args.interval_ms:g} ms")
+            passed = report(bulk, steal, args.bulk_bound_ms) and passed
+    else:
+        bulk_ok = True
+
+    server.should_exit = True
+    await serving
+    if not burst_ok or not bulk_ok:
+        print("The write burst failed" if not burst_ok else "The bulk writes failed")
+        return 1
+    if not passed:
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=50000, help="rows in the table before the burst")
+    parser.add_argument('--writes', type=int, default=300, help="writes in the burst")
+    parser.add_argument('--concurrency', type=int, default=50, help="writes in flight at once")
+    parser.add_argument('--interval-ms', type=float, default=5, help="ticker interval")
+    parser.add_argument('--bound-ms', type=float, default=10, help="largest acceptable tick jitter")
+    parser.add_argument('--bulk-rows', type=int, default=5000, help="rows in each bulk write (0 to skip)")
+    parser.add_argument('--bulk-bound-ms', type=float, default=50,
+                        help="largest acceptable tick jitter during the bulk writes")
+    parser.add_argument('--client', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.client:
+        asyncio.run(run_client(args.client, args.rows, args.writes, args.concurrency, args.bulk_rows))
+    else:
+        sys.exit(asyncio.run(run_server(args)))
@@ -0,0 +1,45 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app's modules import each other by name, and file_operations reads
+# its paths from the environment when it is first imported, so both are
+# set up before any test module is collected.
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+sys.path.insert(0, os.path.abspath(APP_DIR))
+
+DATA_DIR = tempfile.mkdtemp(prefix='table-tests-')
+os.environ.update({
+    'CSV_FILE_PATH': os.path.join(DATA_DIR, 'backend_table.csv'),
+    'CSV_BACKUP_DIR': os.path.join(DATA_DIR, 'backups'),
+    'DATABASE_URL': os.path.join(DATA_DIR, 'backend.db'),
+    'JWT_SECRET_KEY': 'tests',
+})
+
+from table_store import TableStore, table_from_rows  # noqa: E402
+
+
+ROW = {"user": "alice", "broker": "BrokerA", "API key": "KEY", "API secret": "SECRET",
+       "pnl": 1.5, "margin": 2.5, "max_risk": 0.5}
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    """Open (or reopen) a table store kept in ``tmp_path``, as the server does at startup."""
+    def open_store(snapshot_format: str = 'columnar') -> TableStore:
+        name = 'table.cols' if snapshot_format == 'columnar' else 'table.csv'
+        store = TableStore(str(tmp_path / name), snapshot_format=snapshot_format)
+        if not os.path.exists(store.path):
+            store.write_snapshot(table_from_rows([]), 0)
+        store.load()
+        return store
+    return open_store
+
+
+def commit(store: TableStore, record: dict) -> dict:
+    """Log and apply a prepared record, as the write batcher does."""
+    store.log.append(record)
+    store.apply(record)
+    return record
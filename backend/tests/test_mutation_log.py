@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+import mutation_log
+from conftest import ROW, commit
+
+
+def test_replay_stops_at_a_torn_tail_and_later_writes_survive(open_store):
+    store = open_store()
+    for user in ('a', 'b', 'c'):
+        commit(store, store.prepare_append({**ROW, 'user': user}))
+    store.log.close()
+    with open(store.log.path, 'ab') as f:
+        f.write(b'{"seq": 4, "op": "add", "row": {"id": 4, "us')  # crashed mid-append
+
+    store = open_store()
+    assert store.seq == 3
+    assert [row['user'] for row in store.records()] == ['a', 'b', 'c']
+
+    commit(store, store.prepare_append({**ROW, 'user': 'd'}))
+    store.log.close()
+    store = open_store()
+    assert store.seq == 4
+    assert [row['user'] for row in store.records()] == ['a', 'b', 'c', 'd']
+
+
+def test_a_failed_append_is_cut_off_the_log(open_store, monkeypatch):
+    store = open_store()
+    commit(store, store.prepare_append({**ROW, 'user': 'a'}))
+    size = os.path.getsize(store.log.path)
+
+    fsync = os.fsync
+    calls = []
+
+    def fail_once(fd):
+        calls.append(fd)
+        if len(calls) == 1:
+            raise OSError("disk full")
+        fsync(fd)
+
+    monkeypatch.setattr(mutation_log.os, 'fsync', fail_once)
+    record = store.prepare_append({**ROW, 'user': 'lost'})
+    with pytest.raises(OSError):
+        store.log.append(record)
+    store.discard(record)
+    assert os.path.getsize(store.log.path) == size
+
+    commit(store, store.prepare_append({**ROW, 'user': 'b'}))
+    store.log.close()
+    store = open_store()
+    assert [row['user'] for row in store.records()] == ['a', 'b']
+
+
+def test_rotated_segments_are_read_in_order_and_dropped_once_covered(tmp_path):
+    log = mutation_log.MutationLog(str(tmp_path / 'table.log'))
+    log.append_many([{'seq': 1, 'op': 'delete', 'id': 1}, {'seq': 2, 'op': 'delete', 'id': 2}])
+    log.rotate()
+    log.append({'seq': 3, 'op': 'delete', 'id': 3})
+
+    assert log.segments() == [f"{log.path}.2", log.path]
+    assert [record['seq'] for record in log.read(after_seq=1)] == [2, 3]
+
+    log.drop_segments(2)
+    assert log.segments() == [log.path]
+    assert [record['seq'] for record in log.read()] == [3]
+    log.close()
+
+
+def test_in_memory_fields_are_not_logged(tmp_path):
+    changes = [{'op': 'add', 'row': {'id': i}} for i in range(mutation_log.ENCODE_SLICE * 2 + 1)]
+    line = mutation_log.encode_record({'seq': 1, 'op': 'bulk', 'changes': changes, '_rows': object()})
+    assert line.endswith(b'\n')
+    record = mutation_log.json.loads(line)
+    assert record == {'seq': 1, 'op': 'bulk', 'changes': changes}
@@ -0,0 +1,91 @@
+import json
+
+import pandas as pd
+import pytest
+
+from conftest import ROW, commit
+from table_store import RowNotFoundError, VersionConflictError, bulk_changes, normalize_frame
+
+
+def test_replay_rebuilds_adds_updates_and_deletes(open_store):
+    store = open_store()
+    first = commit(store, store.prepare_append({**ROW, 'user': 'a'}))['row']['id']
+    second = commit(store, store.prepare_append({**ROW, 'user': 'b'}))['row']['id']
+    commit(store, store.prepare_update(first, {**ROW, 'user': 'a2', 'pnl': -3.25}, expected_version=1))
+    commit(store, store.prepare_delete(second))
+    expected = store.records()
+    store.log.close()
+
+    store = open_store()
+    assert store.records() == expected
+    assert store.get(first)['version'] == 2
+    with pytest.raises(RowNotFoundError):
+        store.get(second)
+    with pytest.raises(VersionConflictError):
+        store.prepare_update(first, ROW, expected_version=1)
+
+
+def test_compaction_folds_the_log_into_the_snapshot(open_store):
+    store = open_store()
+    for user in ('a', 'b', 'c'):
+        commit(store, store.prepare_append({**ROW, 'user': user}))
+    table, seq = store.begin_compaction()
+    store.log.rotate()
+    store.write_snapshot(table, seq)
+    assert store.log.segments() == [store.log.path]
+    assert not store.needs_compaction()
+
+    commit(store, store.prepare_delete(2))
+    expected = store.records()
+    store.log.close()
+
+    store = open_store()
+    assert store.snapshot_seq == 3
+    assert store.seq == 4
+    assert store.log.records == 1  # only the delete was replayed
+    assert store.records() == expected
+    assert store.next_id == 4
+
+
+@pytest.mark.parametrize('snapshot_format', ['columnar', 'csv'])
+def test_snapshot_round_trip_is_exact(open_store, snapshot_format):
+    store = open_store(snapshot_format)
+    rows = [
+        {**ROW, 'user': 'ünïcødé ✓', 'broker': '', 'pnl': 0.1, 'margin': -1e-300, 'max_risk': 1e308},
+        {**ROW, 'API key': 'with, comma', 'API secret': 'quote " and\nnewline', 'pnl': 1 / 3},
+        {**ROW, 'user': '0099', 'pnl': -0.0, 'margin': 123456789.123456789},
+    ]
+    for row in rows:
+        commit(store, store.prepare_append(row))
+    commit(store, store.prepare_delete(2))
+    table, seq = store.begin_compaction()
+    store.log.rotate()
+    store.write_snapshot(table, seq)
+    expected = store.records()
+    store.log.close()
+
+    store = open_store(snapshot_format)
+    assert store.records() == expected
+    assert store.seq == seq
+    assert store.log.records == 0
+
+
+def test_bulk_record_is_replayed_as_one_mutation(open_store):
+    store = open_store()
+    commit(store, store.prepare_append({**ROW, 'user': 'kept'}))
+    frame = normalize_frame(pd.DataFrame([{**ROW, 'id': 1, 'version': 1, 'user': 'updated'}]
+                                         + [{**ROW, 'user': f"new{i}"} for i in range(3)]))
+    ids, versions = store.plan_bulk(frame)
+    record = commit(store, store.prepare_bulk(bulk_changes(frame, ids, versions)))
+    expected = store.records()
+    store.log.close()
+
+    with open(store.log.path, 'rb') as f:
+        logged = [json.loads(line) for line in f]
+    assert logged[-1]['seq'] == record['seq'] == 2
+    assert not any(key.startswith('_') for key in logged[-1])
+
+    store = open_store()
+    assert store.records() == expected
+    assert [row['user'] for row in expected] == ['updated', 'new0', 'new1', 'new2']
+    assert store.get(1)['version'] == 2
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+import file_operations
+from conftest import ROW
+from table_store import RowNotFoundError, TableStore
+
+
+@pytest.fixture(scope='module')
+def store():
+    return file_operations.get_table_store()
+
+
+def add_rows(count: int):
+    """Insert ``count`` rows through the batcher; returns their ids."""
+    async def add():
+        return [await file_operations.append_csv_entry(ROW, 'alice') for _ in range(count)]
+    return [row['id'] for row, _ in asyncio.run(add())]
+
+
+def reopen(store: TableStore) -> TableStore:
+    """Load the store's files into a new store, as a restart would."""
+    file_operations.write_batcher.executor.submit(lambda: None).result()
+    copy = TableStore(store.path, store.log.path, snapshot_format=store.snapshot_format)
+    copy.load()
+    copy.log.close()
+    return copy
+
+
+def test_a_cancelled_delete_holds_its_row_until_applied(store):
+    row_id, = add_rows(1)
+
+    async def run():
+        delete = asyncio.create_task(file_operations.delete_csv_entry(row_id, 'alice'))
+        await asyncio.sleep(0.001)  # queued in the batch window
+        delete.cancel()
+        with pytest.raises(RowNotFoundError):
+            await asyncio.wait_for(file_operations.update_csv_entry(row_id, {'user': 'late'}, 'alice'), 5)
+        with pytest.raises(asyncio.CancelledError):
+            await delete
+
+    asyncio.run(run())
+    with pytest.raises(RowNotFoundError):
+        store.get(row_id)
+    with pytest.raises(RowNotFoundError):
+        reopen(store).get(row_id)
+
+
+def test_a_cancelled_writer_is_still_committed(store):
+    row_id, = add_rows(1)
+
+    async def run():
+        update = asyncio.create_task(file_operations.update_csv_entry(row_id, {'user': 'cancelled'}, 'alice'))
+        await asyncio.sleep(0.001)
+        update.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await update
+
+    asyncio.run(run())
+    assert store.get(row_id)['user'] == 'cancelled'
+    assert store.version(row_id) == 2
+    assert reopen(store).get(row_id) == store.get(row_id)
+
+
+def test_writers_get_the_error_when_the_log_write_fails(store, monkeypatch):
+    first, second = add_rows(2)
+
+    def fail(records):
+        raise OSError("disk full")
+
+    async def run():
+        with monkeypatch.context() as patch:
+            patch.setattr(store.log, 'append_many', fail)
+            return await asyncio.gather(file_operations.delete_csv_entry(first, 'alice'),
+                                        file_operations.update_csv_entry(second, {'user': 'lost'}, 'alice'),
+                                        return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [type(result) for result in results] == [OSError, OSError]
+    assert store._pending == {}
+    assert store.get(first)['version'] == 1
+    assert store.get(second)['user'] == ROW['user']
+
+    asyncio.run(file_operations.update_csv_entry(second, {'user': 'after'}, 'alice'))
+    assert reopen(store).get(second)['user'] == 'after'
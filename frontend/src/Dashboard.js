@@ -97,6 +97,33 @@ const styles = `
     height: 350px;
 }
 
+.aggregates-container {
+    display: grid;
+    grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
+    gap: 1rem;
+    margin-bottom: 2rem;
+}
+
+.aggregate-card {
+    background-color: #1F2937;
+    padding: 1rem 1.25rem;
+    border-radius: 1rem;
+    border: 1px solid rgba(255, 255, 255, 0.1);
+    font-size: 0.875rem;
+    color: #9CA3AF;
+}
+
+.aggregate-card h3 {
+    margin: 0 0 0.5rem 0;
+    font-size: 1rem;
+    color: #ffffff;
+}
+
+.aggregate-card span {
+    color: #ffffff;
+    font-weight: 600;
+}
+
 .data-table {
     width: 100%;
     border-collapse: separate;
@@ -373,10 +400,25 @@ const styles = `
 }
 `;
 
+// Apply one change from a table_delta to the table rows (matched by stable row id)
+const applyRowChange = (rows, change) => {
+    switch (change.type) {
+        case "row_inserted":
+            return [...rows, change.row];
+        case "row_updated":
+            return rows.map(row => (row.id === change.id ? change.row : row));
+        case "row_deleted":
+            return rows.filter(row => row.id !== change.id);
+        default:
+            return rows;
+    }
+};
+
 const Dashboard = () => {
     const { user, logout } = useAuth();
     const navigate = useNavigate();
     const wsRef = useRef(null);
+    const tableVersionRef = useRef(0); // Table version the local rows reflect
     const [data, setData] = useState([]);
     const [headers] = useState([
         "user", "broker", "API key", "API secret", "pnl", "margin", "max_risk"
@@ -386,7 +428,7 @@ const Dashboard = () => {
         values: []
     });
     const [wsStatus, setWsStatus] = useState("connecting");
-    const [editIndex, setEditIndex] = useState(null);
+    const [editRowId, setEditRowId] = useState(null);
     const [editRow, setEditRow] = useState({});
     const [lockedRows, setLockedRows] = useState({});
     const lockedRowsRef = useRef(lockedRows);
@@ -394,6 +436,7 @@ const Dashboard = () => {
     const [isAddingNew, setIsAddingNew] = useState(false);
     const [newRow, setNewRow] = useState(null);
     const [isLoading, setIsLoading] = useState(true);
+    const [aggregates, setAggregates] = useState(null); // Server-maintained totals
     const MAX_DATA_POINTS = 50; // Maximum number of points to show on chart
 
     // Create style element
@@ -432,6 +475,7 @@ const Dashboard = () => {
                 
                 if (Array.isArray(response.data)) {
                     setData(response.data);
+                    tableVersionRef.current = Number(response.headers['x-table-version']) || 0;
                     console.log("CSV data loaded successfully:", response.data.length, "rows");
                 } else {
                     throw new Error("Invalid data format received");
@@ -472,6 +516,14 @@ const Dashboard = () => {
         const PING_INTERVAL = 30000;
         let lastPingTime = Date.now();
         let pingTimeoutId;
+        let resyncFrom = null;
+
+        const requestResync = (ws) => {
+            const currentVersion = tableVersionRef.current;
+            if (resyncFrom === currentVersion) return;
+            resyncFrom = currentVersion;
+            ws.send(JSON.stringify({ type: "resync", from_version: currentVersion }));
+        };
 
         const checkConnection = () => {
             const now = Date.now();
@@ -497,6 +549,11 @@ const Dashboard = () => {
                     reconnectAttempts = 0;
                     lastPingTime = Date.now();
 
+                    // Catch up on table changes missed while disconnected
+                    if (tableVersionRef.current > 0) {
+                        requestResync(ws);
+                    }
+
                     // Start ping interval
                     pingInterval = setInterval(() => {
                         if (ws.readyState === WebSocket.OPEN) {
@@ -506,11 +563,11 @@ const Dashboard = () => {
                     }, PING_INTERVAL);
 
                     // Request lock state verification after reconnection
-                    if (editIndex !== null) {
+                    if (editRowId !== null) {
                         console.log("Requesting lock verification after reconnection");
                         ws.send(JSON.stringify({
                             type: "verify_lock",
-                            row_index: editIndex
+                            row_id: editRowId
                         }));
                     }
                 };
@@ -535,7 +592,7 @@ const Dashboard = () => {
                         } else {
                             setErrorMessage("Connection lost. Please refresh the page to continue editing.");
                             // Clear edit state after max reconnection attempts
-                            setEditIndex(null);
+                            setEditRowId(null);
                             setEditRow({});
                         }
                     }
@@ -556,7 +613,7 @@ const Dashboard = () => {
                             setLockedRows(prev => {
                                 const newLocks = { ...prev };
                                 if (message.locked_by) {
-                                    newLocks[message.row_index] = {
+                                    newLocks[message.row_id] = {
                                         username: message.locked_by,
                                         status: message.status,
                                         expiresAt: new Date(message.expires_at),
@@ -566,57 +623,66 @@ const Dashboard = () => {
                                     // If this is our lock being restored after reconnection
                                     if (message.locked_by === user?.username && 
                                         message.status === 'editing' && 
-                                        message.row_index === editIndex) {
+                                        message.row_id === editRowId) {
                                         console.log("Lock restored after reconnection");
                                     }
                                     // If our lock was taken by someone else
-                                    else if (message.row_index === editIndex && 
+                                    else if (message.row_id === editRowId && 
                                              message.locked_by !== user?.username) {
-                                        setEditIndex(null);
+                                        setEditRowId(null);
                                         setEditRow({});
                                         setErrorMessage("Your lock was lost due to connection issues.");
                                     }
                                 } else {
-                                    delete newLocks[message.row_index];
-                                    if (message.row_index === editIndex) {
-                                        setEditIndex(null);
+                                    delete newLocks[message.row_id];
+                                    if (message.row_id === editRowId) {
+                                        setEditRowId(null);
                                         setEditRow({});
                                     }
                                 }
                                 return newLocks;
                             });
-                } else if (message.type === "csv_update") {
-                            console.log("Received CSV update:", {
-                                source: message.source,
-                                currentUser: user?.username,
-                                timestamp: message.timestamp,
-                                rowCount: message.data?.length
-                            });
+                } else if (message.type === "table_delta") {
+                            const currentVersion = tableVersionRef.current;
 
-                            // Skip if we're the source of the update
-                            if (message.source === user?.username) {
-                                console.log("Skipping update from self");
+                            // Skip changes already applied, e.g. our own echoed back after a resync
+                            const changes = message.changes.filter(change => change.version > currentVersion);
+                            if (changes.length === 0) {
                                 return;
                             }
 
-                            // Handle updates from other users while preserving local edits
-                            setData(prevData => {
-                                const newData = [...message.data];
-                                
-                                // If we're currently editing, preserve our edits
-                                if (editIndex !== null && editIndex < newData.length) {
-                                    console.log("Preserving local edits for row", editIndex);
-                                    newData[editIndex] = { ...editRow };
-                                }
-                                
-                                return newData;
-                            });
+                            // A gap means we missed deltas; ask the server to replay them
+                            if (changes[0].version !== currentVersion + 1) {
+                                console.log(`Missed table changes (have v${currentVersion}, got v${changes[0].version}), resyncing`);
+                                requestResync(ws);
+                                return;
+                            }
+
+                            tableVersionRef.current = message.version;
+                            resyncFrom = null;
+                            setData(prevData => changes.reduce(applyRowChange, prevData));
 
                             // Show notification about the update
-                            if (message.source) {
-                                setErrorMessage(`Data updated by ${message.source}`);
+                            const source = changes.map(change => change.source)
+                                .find(source => source && source !== user?.username);
+                            if (source) {
+                                setErrorMessage(`Data updated by ${source}`);
                                 setTimeout(() => setErrorMessage(""), 3000);
                             }
+                        } else if (message.type === "table_snapshot") {
+                            tableVersionRef.current = message.version;
+                            resyncFrom = null;
+                            setData(message.data);
+                        } else if (message.type === "aggregates") {
+                            // Latest-value channel; keep whichever reflects the newer table version
+                            setAggregates(prev => (prev && prev.version > message.version ? prev : message));
+                        } else if (message.type === "number_history") {
+                            // Recent ticks sent on connect; replaces whatever the chart had
+                            const points = message.points.slice(-MAX_DATA_POINTS);
+                            setChartData({
+                                labels: points.map(point => point.timestamp),
+                                values: points.map(point => point.value)
+                            });
                         } else if (message.type === "random_number") {
                             setChartData(prevData => {
                                 const newLabels = prevData.labels.slice(-MAX_DATA_POINTS + 1)
@@ -656,18 +722,18 @@ const Dashboard = () => {
                 ws.close(1000, "Component unmounting");
             }
         };
-    }, [user?.username, editIndex]);
+    }, [user?.username, editRowId]);
 
     useEffect(() => {
         lockedRowsRef.current = lockedRows;
     }, [lockedRows, editRow]);
 
-    const unlockRow = useCallback((index) => {
+    const unlockRow = useCallback((rowId) => {
         if (wsRef.current?.readyState === WebSocket.OPEN) {
             try {
                 wsRef.current.send(JSON.stringify({
                     type: "unlock_row",
-                    row_index: index
+                    row_id: rowId
                 }));
             } catch (error) {
                 console.error('Error sending unlock message:', error);
@@ -711,9 +777,10 @@ const Dashboard = () => {
                 }
             });
             
-            // Update the local data state with the new data
-            if (response.data && response.data.data) {
-                setData(response.data.data);
+            // Add the row now if it is the next version; otherwise its table_delta brings it
+            if (response.data && response.data.row && response.data.version === tableVersionRef.current + 1) {
+                setData(prevData => applyRowChange(prevData, { type: "row_inserted", row: response.data.row }));
+                tableVersionRef.current = response.data.version;
             }
             
             setNewRow(null);
@@ -754,50 +821,56 @@ const Dashboard = () => {
         }));
     };
 
-    const handleUpdate = async (index) => {
+    const handleUpdate = async (rowId) => {
         try {
             setErrorMessage("");
-            const response = await axios.put(`${API_URL}/update_csv/${index}`, editRow, {
-                headers: { Authorization: `Bearer ${localStorage.getItem("token")}` }
+            // If-Match makes the server reject the save if the row changed since we loaded it
+            const response = await axios.put(`${API_URL}/update_csv/${rowId}`, editRow, {
+                headers: {
+                    Authorization: `Bearer ${localStorage.getItem("token")}`,
+                    'If-Match': `"${editRow.version}"`
+                }
             });
             
             // Update local state immediately
-            setData(prevData => {
-                const newData = [...prevData];
-                newData[index] = { ...editRow };
-                return newData;
-            });
+            setData(prevData => prevData.map(row => (
+                row.id === rowId ? { ...editRow, id: rowId, version: response.data.version } : row
+            )));
             
-            setEditIndex(null);
+            setEditRowId(null);
             setEditRow({});
             setIsAddingNew(false);
-            unlockRow(index);
+            unlockRow(rowId);
             
             // The WebSocket will handle broadcasting the update to all clients
         } catch (error) {
+            if (error.response?.status === 412) {
+                setErrorMessage("This row was changed by someone else. Cancel and edit it again to see the latest values.");
+                return;
+            }
             setErrorMessage(error.response?.data?.detail || "Failed to update entry");
             console.error("Update Entry Error:", error);
         }
     };
 
-    const handleDelete = async (index) => {
+    const handleDelete = async (rowId, version) => {
         try {
             setErrorMessage("");
-            await axios.delete(`${API_URL}/delete_csv/${index}`, {
-                headers: { Authorization: `Bearer ${localStorage.getItem("token")}` }
+            await axios.delete(`${API_URL}/delete_csv/${rowId}`, {
+                headers: {
+                    Authorization: `Bearer ${localStorage.getItem("token")}`,
+                    'If-Match': `"${version}"`
+                }
             });
             
-            // Update local state immediately
-            setData(prevData => prevData.filter((_, i) => i !== index));
-            
-            // The WebSocket will handle broadcasting the update to all clients
+            // The row_deleted delta from the WebSocket removes the row locally
         } catch (error) {
             setErrorMessage(error.response?.data?.detail || "Failed to delete entry");
             console.error("Delete Entry Error:", error);
         }
     };
 
-    const startEditing = async (index, row) => {
+    const startEditing = async (rowId, row) => {
         if (!user?.username) {
             setErrorMessage("Authentication required");
             return;
@@ -809,10 +882,10 @@ const Dashboard = () => {
         }
     
         try {
-            console.log(`Requesting lock for row ${index}`);
+            console.log(`Requesting lock for row ${rowId}`);
             wsRef.current.send(JSON.stringify({
                 type: "lock_row",
-                row_index: index
+                row_id: rowId
             }));
 
             // Wait for lock confirmation with retries
@@ -827,10 +900,10 @@ const Dashboard = () => {
                 const handler = (event) => {
                     try {
                         const message = JSON.parse(event.data);
-                        if (message.type === "lock_confirmation" && message.row_index === index) {
+                        if (message.type === "lock_confirmation" && message.row_id === rowId) {
                             cleanup();
                             resolve(true);
-                        } else if (message.type === "lock_denied" && message.row_index === index) {
+                        } else if (message.type === "lock_denied" && message.row_id === rowId) {
                             cleanup();
                             reject(new Error(message.message));
                         }
@@ -851,7 +924,7 @@ const Dashboard = () => {
                 try {
                     await attemptLock();
                     // Lock acquired successfully
-                    setEditIndex(index);
+                    setEditRowId(rowId);
                     setEditRow({ ...row });
                     setErrorMessage("");
                     return;
@@ -867,7 +940,7 @@ const Dashboard = () => {
         } catch (error) {
             console.error("Failed to acquire lock:", error);
             setErrorMessage(error.message || "Failed to start editing. Please try again.");
-            setEditIndex(null);
+            setEditRowId(null);
             setEditRow({});
         }
     };
@@ -883,16 +956,16 @@ const Dashboard = () => {
                         const newLocks = { ...prev };
                         if (message.locked_by) {
                             const serverTime = new Date(message.expires_at);
-                            newLocks[message.row_index] = {
+                            newLocks[message.row_id] = {
                                 username: message.locked_by,
                                 status: message.status,
                                 expiresAt: serverTime,
                                 message: message.message || ''
                             };
                         } else {
-                            delete newLocks[message.row_index];
-                            if (message.row_index === editIndex) {
-                                setEditIndex(null);
+                            delete newLocks[message.row_id];
+                            if (message.row_id === editRowId) {
+                                setEditRowId(null);
                                 setEditRow({});
                             }
                         }
@@ -903,7 +976,7 @@ const Dashboard = () => {
                     const serverTime = new Date(message.expires_at);
                     setLockedRows(prev => ({
                         ...prev,
-                        [message.row_index]: {
+                        [message.row_id]: {
                             username: user?.username,
                             status: 'editing',
                             expiresAt: serverTime,
@@ -928,16 +1001,16 @@ const Dashboard = () => {
                 wsRef.current.removeEventListener('message', handleWebSocketMessage);
             }
         };
-    }, [wsRef.current, user?.username, editIndex]);
+    }, [wsRef.current, user?.username, editRowId]);
 
-    const cancelEditing = (index) => {
+    const cancelEditing = (rowId) => {
         if (wsRef.current?.readyState === WebSocket.OPEN) {
             wsRef.current.send(JSON.stringify({
                 type: "unlock_row",
-                row_index: index
+                row_id: rowId
             }));
         }
-        setEditIndex(null);
+        setEditRowId(null);
         setEditRow({});
         setErrorMessage("");
     };
@@ -1105,10 +1178,24 @@ const Dashboard = () => {
                 />
             </div>
 
+                    {aggregates && (
+                        <div className="aggregates-container">
+                            {[["All brokers", aggregates.total], ...Object.entries(aggregates.brokers)].map(([name, totals]) => (
+                                <div className="aggregate-card" key={name}>
+                                    <h3>{name || "(no broker)"}</h3>
+                                    <div>Rows: <span>{totals.rows}</span></div>
+                                    <div>Total pnl: <span>{totals.total_pnl.toFixed(2)}</span></div>
+                                    <div>Total margin: <span>{totals.total_margin.toFixed(2)}</span></div>
+                                    <div>Worst max_risk: <span>{totals.worst_max_risk === null ? "-" : totals.worst_max_risk.toFixed(2)}</span></div>
+                                </div>
+                            ))}
+                        </div>
+                    )}
+
                     <button 
                         className="add-button" 
                         onClick={handleAdd}
-                        disabled={isAddingNew || editIndex !== null}
+                        disabled={isAddingNew || editRowId !== null}
                     >
                         Add New Entry
                     </button>
@@ -1155,8 +1242,8 @@ const Dashboard = () => {
                             )}
 
                             {/* Existing Rows */}
-                            {data.map((row, index) => {
-                                const lockInfo = lockedRows[index];
+                            {data.map((row) => {
+                                const lockInfo = lockedRows[row.id];
                                 const isLocked = lockInfo && new Date() < new Date(lockInfo.expiresAt);
                                 const isCooldown = lockInfo?.status === 'cooldown';
                                 const remainingTime = lockInfo 
@@ -1164,11 +1251,11 @@ const Dashboard = () => {
                                     : 0;
 
                                 return (
-                                    <tr key={index} 
+                                    <tr key={row.id} 
                                         className={isLocked ? (isCooldown ? "cooldown-row" : "editing-row") : ""}>
                                         {headers.map(header => (
                                 <td key={header}>
-                                    {editIndex === index ? (
+                                    {editRowId === row.id ? (
                                         <input
                                                         type={['pnl', 'margin', 'max_risk'].includes(header) ? "number" : "text"}
                                             className="data-input"
@@ -1191,17 +1278,17 @@ const Dashboard = () => {
                                 </td>
                             ))}
                             <td>
-                                {editIndex === index ? (
+                                {editRowId === row.id ? (
                                                 <>
                                     <button 
                                         className="action-button save-button"
-                                                        onClick={() => handleUpdate(index)}
+                                                        onClick={() => handleUpdate(row.id)}
                                     >
                                         Save
                                     </button>
                                                     <button
                                                         className="action-button"
-                                                        onClick={() => cancelEditing(index)}
+                                                        onClick={() => cancelEditing(row.id)}
                                                     >
                                                         Cancel
                                                     </button>
@@ -1210,14 +1297,14 @@ const Dashboard = () => {
                                     <>
                                         <button 
                                             className="action-button"
-                                            onClick={() => startEditing(index, row)}
+                                            onClick={() => startEditing(row.id, row)}
                                                         disabled={isLocked}
                                         >
                                             Edit
                                         </button>
                                         <button 
                                             className="action-button delete-button"
-                                            onClick={() => handleDelete(index)}
+                                            onClick={() => handleDelete(row.id, row.version)}
                                                         disabled={isLocked}
                                         >
                                             Delete